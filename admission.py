@@ -0,0 +1,232 @@
+"""
+Admission control in front of the chat pipeline.
+
+A request is first charged against its client's token bucket. It then needs
+one of `max_concurrent` slots. If none is free it waits in a bounded priority
+queue. A request is turned away with a 429 and a Retry-After hint when:
+
+- the client is over its rate,
+- the queue is full,
+- the expected wait is already longer than the queue deadline, or
+- it waits past that deadline.
+
+That beats letting every request pile onto Cohere and OpenRouter and time out
+together. Short selected-text questions get priority: they skip retrieval and
+finish quickly, so serving them first keeps the median low under load.
+
+When several books are served, one book may hold at most BOOK_MAX_SHARE of the
+slots and of the queue while requests for other books are waiting or running.
+A freed slot goes to the best waiter whose book is under its share. With no
+contention a single book can still use every slot, so the limit costs nothing
+until another book needs room.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from config import Config
+import metrics
+
+HIGH_PRIORITY = 0
+NORMAL_PRIORITY = 1
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted; maps to HTTP 429"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Server busy ({reason}), retry in {math.ceil(retry_after)}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """
+    `rate` requests per second with bursts up to `burst`
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """
+        Take a token; return 0 on success or the seconds until one is available
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class AdmissionController:
+    """
+    Per-client rate limits, a global concurrency limit with per-book shares and a bounded priority wait queue.
+
+    All state is touched only from the event loop, so no locks are needed.
+    """
+
+    def __init__(self,
+                 max_concurrent: int = Config.ADMISSION_MAX_CONCURRENT,
+                 max_queue: int = Config.ADMISSION_MAX_QUEUE,
+                 queue_timeout: float = Config.ADMISSION_QUEUE_TIMEOUT_SECONDS,
+                 client_rate: float = Config.CLIENT_RATE_LIMIT_PER_SECOND,
+                 client_burst: float = Config.CLIENT_RATE_LIMIT_BURST,
+                 book_share: float = Config.BOOK_MAX_SHARE,
+                 max_clients: int = 10000):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_clients = max_clients
+        self.book_slots = max(1, int(max_concurrent * book_share))
+        self.book_queue = max(1, int(max_queue * book_share))
+        self.in_flight = 0
+        self._book_in_flight: Dict[str, int] = {}
+        self._waiters = []  # heap of (priority, sequence, future, book)
+        self._sequence = itertools.count()
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        # Moving average of how long an admitted request holds its slot
+        self._service_time = 1.0
+
+    def check_rate(self, client: str):
+        if self.client_rate <= 0:
+            return
+        bucket = self._buckets.pop(client, None) or TokenBucket(self.client_rate, self.client_burst)
+        # Most recently seen clients at the end; the least recent are evicted
+        self._buckets[client] = bucket
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        wait = bucket.try_acquire()
+        if wait:
+            self._reject("rate_limit", wait)
+
+    def expected_wait(self, priority: int) -> float:
+        ahead = sum(1 for entry in self._waiters if entry[0] <= priority and not entry[2].done())
+        return (ahead + 1) * self._service_time / max(1, self.max_concurrent)
+
+    def _contended(self, book: str) -> bool:
+        """
+        Whether requests for another book are running or waiting
+        """
+        return (any(n for b, n in self._book_in_flight.items() if b != book)
+                or any(entry[3] != book for entry in self._waiters))
+
+    def _take_slot(self, book: str):
+        self._book_in_flight[book] = self._book_in_flight.get(book, 0) + 1
+
+    def _reject(self, reason: str, retry_after: float):
+        metrics.ADMISSION_REJECTED.inc(reason=reason)
+        raise AdmissionRejected(reason, max(1.0, retry_after))
+
+    def _update_gauges(self):
+        metrics.ADMISSION_IN_FLIGHT.set(self.in_flight)
+        metrics.ADMISSION_QUEUED.set(len(self._waiters))
+
+    async def _acquire_slot(self, priority: int, book: str):
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            self._take_slot(book)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self._reject("queue_full", self.expected_wait(priority))
+        if self._contended(book) and sum(1 for entry in self._waiters if entry[3] == book) >= self.book_queue:
+            self._reject("book_share", self.expected_wait(priority))
+        # Don't queue a request that would blow its deadline anyway
+        if self.expected_wait(priority) > self.queue_timeout:
+            self._reject("deadline", self.expected_wait(priority))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), future, book)
+        heapq.heappush(self._waiters, entry)
+        self._update_gauges()
+        try:
+            # The slot is handed over by _release, which counts it in in_flight
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._remove_waiter(entry)
+            if future.done() and not future.cancelled():
+                # Admitted at the last moment
+                return
+            self._reject("deadline", self.expected_wait(priority))
+        except asyncio.CancelledError:
+            self._remove_waiter(entry)
+            if future.done() and not future.cancelled():
+                self._release(book)
+            raise
+
+    def _remove_waiter(self, entry):
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        self._update_gauges()
+
+    def _release(self, book: str):
+        self._book_in_flight[book] -= 1
+        if not self._book_in_flight[book]:
+            del self._book_in_flight[book]
+        # Hand the slot straight to the best waiter, so in_flight never dips and lets a newcomer jump the queue
+        entry = self._next_waiter()
+        if entry is not None:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            self._take_slot(entry[3])
+            entry[2].set_result(None)
+            self._update_gauges()
+            return
+        self.in_flight -= 1
+        self._update_gauges()
+
+    def _next_waiter(self):
+        """
+        The best waiter whose book is under its share, else the best waiter
+        """
+        self._waiters = [entry for entry in self._waiters if not entry[2].done()]
+        heapq.heapify(self._waiters)
+        for entry in sorted(self._waiters):
+            if self._book_in_flight.get(entry[3], 0) < self.book_slots:
+                return entry
+        return self._waiters[0] if self._waiters else None
+
+    @asynccontextmanager
+    async def admit(self, client: str, priority: int = NORMAL_PRIORITY, book: str = "") -> AsyncIterator[None]:
+        """
+        Hold a concurrency slot for the duration of the block, or raise AdmissionRejected
+        """
+        self.check_rate(client)
+        queued_at = time.perf_counter()
+        await self._acquire_slot(priority, book)
+        started = time.perf_counter()
+        metrics.ADMISSION_WAIT_SECONDS.observe(started - queued_at, priority=str(priority))
+        self._update_gauges()
+        try:
+            yield
+        finally:
+            self._service_time = 0.9 * self._service_time + 0.1 * (time.perf_counter() - started)
+            self._release(book)
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'queued': len(self._waiters),
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'avg_service_seconds': round(self._service_time, 3),
+            'in_flight_by_book': dict(self._book_in_flight),
+        }
+
+def request_priority(message: str, selected_text: Optional[str]) -> int:
+    """
+    Short selected-text questions skip retrieval and are cheap, so they go first
+    """
+    if selected_text and len(message) + len(selected_text) <= Config.ADMISSION_SHORT_REQUEST_CHARS:
+        return HIGH_PRIORITY
+    return NORMAL_PRIORITY
@@ -0,0 +1,179 @@
+"""
+Registry of the books served by one deployment.
+
+Each book has an id, a title used in its system prompt, a Qdrant collection
+alias and a docs directory for ingestion. Books are registered in BOOKS_FILE:
+
+    {
+      "default": "robobook",
+      "books": [
+        {"id": "robobook", "title": "Physical AI & Humanoid Robotics textbook",
+         "collection": "physical_ai_robobook", "docs_path": "../physical-ai-humanoid-robotics-ts/docs"},
+        {"id": "controls", "title": "Feedback Control textbook", "collection": "controls_book",
+         "docs_path": "../controls-book/docs", "system_prompt": "optional; replaces the generated prompt"}
+      ]
+    }
+
+Without the file a single book is served from QDRANT_COLLECTION_NAME and
+BOOK_DOCS_PATH. The file is re-read when it changes, so a book registered
+through PUT /admin/books/{id} reaches every worker.
+
+Every book gets its own query-embedding and answer caches, bound to its
+collection alias, so re-indexing one book leaves the others' caches warm.
+"""
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from caches import LRUCache
+from config import Config
+from prompts import DEFAULT_BOOK_TITLE, system_prompt as default_system_prompt
+
+BOOK_ID = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+class UnknownBook(KeyError):
+    """Raised for a book id that is not registered; maps to HTTP 404"""
+
+    def __str__(self):
+        return f"Unknown book: {self.args[0]}"
+
+class Book:
+    def __init__(self, book_id: str, title: str = DEFAULT_BOOK_TITLE, collection: Optional[str] = None,
+                 docs_path: Optional[str] = None, system_prompt: Optional[str] = None):
+        if not BOOK_ID.match(book_id):
+            raise ValueError(f"Invalid book id {book_id!r}: use lowercase letters, digits, '-' and '_'")
+        self.id = book_id
+        self.title = title
+        self.collection = collection or f"{book_id}_book"
+        self.docs_path = docs_path
+        self.custom_prompt = system_prompt
+        self.answer_cache = LRUCache(f"answers:{book_id}", Config.ANSWER_CACHE_SIZE, index=self.collection)
+        self.query_embedding_cache = LRUCache(f"query_embeddings:{book_id}", Config.QUERY_EMBEDDING_CACHE_SIZE,
+                                              index=self.collection)
+
+    @staticmethod
+    def normalize(data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        A registry entry with its defaults filled in
+        """
+        normalized = {
+            'id': data['id'],
+            'title': data.get('title') or DEFAULT_BOOK_TITLE,
+            'collection': data.get('collection') or f"{data['id']}_book",
+            'docs_path': data.get('docs_path'),
+        }
+        if data.get('system_prompt'):
+            normalized['system_prompt'] = data['system_prompt']
+        return normalized
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Book":
+        data = cls.normalize(data)
+        return cls(data['id'], data['title'], data['collection'], data['docs_path'], data.get('system_prompt'))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self.normalize({'id': self.id, 'title': self.title, 'collection': self.collection,
+                               'docs_path': self.docs_path, 'system_prompt': self.custom_prompt})
+
+    def system_prompt(self, mode: str) -> Optional[str]:
+        """
+        The book's system message, or None when the LLM service's default applies
+        """
+        if self.custom_prompt:
+            return self.custom_prompt
+        if self.title != DEFAULT_BOOK_TITLE:
+            return default_system_prompt(mode, self.title)
+        return None
+
+    def index(self, qdrant_service):
+        """
+        The Qdrant service bound to this book's collection alias
+        """
+        if getattr(qdrant_service, 'alias', None) in (None, self.collection):
+            # Already this book's collection, or a stand-in without aliases
+            return qdrant_service
+        return qdrant_service.for_collection(self.collection)
+
+class BookRegistry:
+    """
+    Book id -> Book, loaded from BOOKS_FILE and reloaded when the file changes
+    """
+
+    def __init__(self, path: Optional[str] = Config.BOOKS_FILE, check_seconds: float = 1.0):
+        self.path = path
+        self.check_seconds = check_seconds
+        self._books: Dict[str, Book] = {}
+        self.default_id = Config.DEFAULT_BOOK
+        self._mtime: Optional[float] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _builtin(self) -> Dict[str, Any]:
+        return {'id': Config.DEFAULT_BOOK, 'collection': Config.QDRANT_COLLECTION_NAME, 'docs_path': Config.BOOK_DOCS_PATH}
+
+    def _load(self):
+        data = {'default': Config.DEFAULT_BOOK, 'books': [self._builtin()]}
+        mtime = None
+        if self.path and os.path.exists(self.path):
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+
+        books = {}
+        for entry in data.get('books', []):
+            current = self._books.get(entry['id'])
+            # Unchanged books keep their Book object and so their warm caches
+            if current is not None and current.to_dict() == Book.normalize(entry):
+                books[current.id] = current
+            else:
+                books[entry['id']] = Book.from_dict(entry)
+        default_id = data.get('default') or next(iter(books), None)
+        if default_id not in books:
+            raise ValueError(f"Default book {default_id!r} is not registered")
+        self._books, self.default_id, self._mtime = books, default_id, mtime
+
+    def _refresh(self):
+        now = time.monotonic()
+        if not self.path or now - self._checked < self.check_seconds:
+            return
+        self._checked = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            with self._lock:
+                try:
+                    self._load()
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Keeping the current books, {self.path} is invalid: {e}")
+                    self._mtime = mtime
+
+    def get(self, book_id: Optional[str] = None) -> Book:
+        self._refresh()
+        book = self._books.get(book_id or self.default_id)
+        if book is None:
+            raise UnknownBook(book_id)
+        return book
+
+    def list(self) -> List[Book]:
+        self._refresh()
+        return list(self._books.values())
+
+    def register(self, book: Book) -> Book:
+        """
+        Add or replace a book and persist the registry to BOOKS_FILE
+        """
+        with self._lock:
+            books = {**self._books, book.id: book}
+            if self.path:
+                tmp = f"{self.path}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({'default': self.default_id, 'books': [b.to_dict() for b in books.values()]}, f, indent=2)
+                os.replace(tmp, self.path)
+                self._mtime = os.path.getmtime(self.path)
+            self._books = books
+        return book
@@ -0,0 +1,125 @@
+"""
+In-process LRU caches.
+
+Every cache registers itself by name, so caches can be listed in /health and
+cleared together when the data behind them changes. Lookups are counted in the
+rag_cache_hits_total / rag_cache_misses_total metrics under the cache's name.
+
+Caches created with index=<collection alias> hold results derived from that
+index (query embeddings, answers) and are cleared whenever the alias moves to
+another version.
+"""
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+import metrics
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache bounded by entry count
+    """
+
+    def __init__(self, name: str, max_entries: int, index: Optional[str] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.index = index
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        register(self)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        if value is None:
+            metrics.CACHE_MISSES.inc(cache=self.name)
+        else:
+            metrics.CACHE_HITS.inc(cache=self.name)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Return the cached value or compute and store it; concurrent misses may compute twice
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'index': self.index,
+            'hits': metrics.CACHE_HITS.value(cache=self.name),
+            'misses': metrics.CACHE_MISSES.value(cache=self.name),
+        }
+
+_registry: Dict[str, LRUCache] = {}
+_registry_lock = threading.Lock()
+
+def register(cache: LRUCache):
+    with _registry_lock:
+        _registry[cache.name] = cache
+
+def clear(names: Optional[Iterable[str]] = None):
+    """
+    Clear the named caches, or all of them
+    """
+    with _registry_lock:
+        caches = list(_registry.values()) if names is None else [_registry[n] for n in names if n in _registry]
+    for cache in caches:
+        cache.clear()
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    with _registry_lock:
+        caches = list(_registry.values())
+    return {cache.name: cache.stats() for cache in caches}
+
+def clear_index_caches(index: Optional[str] = None):
+    """
+    Clear every cache bound to the given index alias, or to any index
+    """
+    with _registry_lock:
+        names = [name for name, cache in _registry.items()
+                 if cache.index is not None and index in (None, cache.index)]
+    clear(names)
+
+async def watch_index_versions(read_versions: Callable[[], Dict[str, Any]], interval: float):
+    """
+    Clear an index's caches when its entry in read_versions() (alias -> live collection) changes.
+
+    The process that flips an alias clears its own caches right away; this
+    poll catches flips made by other workers or by an offline ingestion run.
+    """
+    last: Dict[str, Any] = {}
+    while True:
+        try:
+            current = await asyncio.to_thread(read_versions)
+            for index, version in current.items():
+                if index in last and last[index] != version:
+                    print(f"Index {index} moved from {last[index]} to {version}, clearing its caches")
+                    clear_index_caches(index)
+            last = current
+        except Exception as e:
+            print(f"Index version check failed: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,442 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+from books import Book, BookRegistry
+from config import Config
+from embedding_batcher import QueryEmbeddingBatcher
+from service_errors import LLMUnavailableError
+from singleflight import SingleFlight, make_request_key
+from text_ranking import compress_context, extractive_answer, focus_selection, passage_sources
+import metrics
+
+NOT_AVAILABLE = "The answer is not available in the provided content."
+
+def cut_results(results: List[Dict[str, Any]], max_k: int = Config.TOP_K,
+                min_score: float = Config.RETRIEVAL_MIN_SCORE, relative: float = Config.RETRIEVAL_RELATIVE_SCORE,
+                min_gap: float = Config.RETRIEVAL_MIN_GAP) -> List[Dict[str, Any]]:
+    """
+    The search hits worth sending to the LLM, best first.
+
+    Nothing when the best hit is under min_score. Otherwise the hits scoring
+    at least relative * best, at most max_k of them, cut after the largest
+    drop in score when that drop is at least min_gap.
+    """
+    if not results or results[0]['score'] < min_score:
+        return []
+    floor = max(min_score, results[0]['score'] * relative)
+    kept = [r for r in results if r['score'] >= floor][:max_k]
+    if min_gap > 0 and len(kept) > 1:
+        gaps = [kept[i]['score'] - kept[i + 1]['score'] for i in range(len(kept) - 1)]
+        largest = max(range(len(gaps)), key=gaps.__getitem__)
+        if gaps[largest] >= min_gap:
+            kept = kept[:largest + 1]
+    return kept
+
+_END = object()
+
+async def iterate_in_thread(make_iterator: Callable[[], Iterator[Any]],
+                            executor: Optional[Executor] = None) -> AsyncIterator[Any]:
+    """
+    Drive a blocking iterator in a worker thread and yield its items on the event loop.
+
+    If the consumer stops early (cancelled or closed), the thread stops at the
+    next item and closes the iterator, which lets a streaming client release
+    its upstream connection.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stopped = threading.Event()
+
+    def put(item, error=None):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:
+            stopped.set()  # the loop is gone
+
+    def pump():
+        iterator = None
+        try:
+            iterator = make_iterator()
+            for item in iterator:
+                if stopped.is_set():
+                    break
+                put(item)
+        except BaseException as e:
+            put(_END, e)
+            return
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+        put(_END)
+
+    context = contextvars.copy_context()
+    loop.run_in_executor(executor, context.run, pump)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+class ChatPipeline:
+    """
+    The retrieve-then-generate flow behind the chat endpoints.
+
+    The backend clients are synchronous, so each stage runs in a worker thread
+    to keep the event loop free. LLM calls get their own thread pool: a
+    generation holds its thread for seconds, and one abandoned at the deadline
+    keeps it until it returns, which must not starve embed and search calls
+    (see LLM_EXECUTOR_THREADS). Identical concurrent questions are coalesced
+    into a single embed/search/LLM round trip.
+
+    When the LLM misses its deadline, every model's circuit is open or the
+    caller asks for it, the answer is extracted from the retrieved context
+    instead, so degraded answers still arrive in milliseconds.
+
+    Every stage takes the Book being asked about (the default book when
+    None): its collection, caches and system prompt.
+    """
+
+    def __init__(self, services, books: Optional[BookRegistry] = None):
+        self.services = services
+        self.books = books or BookRegistry()
+        self.single_flight = SingleFlight(on_coalesced=metrics.COALESCED_REQUESTS.inc)
+        # Batches depend on timing, so cassettes get one embed_query call per question
+        self.query_embeddings = QueryEmbeddingBatcher(
+            lambda: self.services.embedding_service,
+            max_wait=Config.QUERY_BATCH_MAX_WAIT_MS / 1000 if Config.UPSTREAM_CASSETTE_MODE == 'off' else 0,
+        )
+        concurrent = max(1, Config.ADMISSION_MAX_CONCURRENT)
+        self.threads = {'llm': Config.LLM_EXECUTOR_THREADS or 2 * concurrent,
+                        'stages': Config.STAGE_EXECUTOR_THREADS or concurrent}
+        self.llm_executor = ThreadPoolExecutor(self.threads['llm'], thread_name_prefix="chat-llm")
+        self.stage_executor = ThreadPoolExecutor(self.threads['stages'], thread_name_prefix="chat-stage")
+
+    async def run_in(self, executor: Executor, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        asyncio.to_thread on a given pool: func runs in the caller's context, so tracing spans stay linked
+        """
+        call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+    def close(self):
+        # Abandoned LLM calls are not waited for
+        self.llm_executor.shutdown(wait=False, cancel_futures=True)
+        self.stage_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def answer(self, message: str, selected_text: Optional[str] = None, extractive: bool = False,
+                     book: Optional[Book] = None) -> Dict[str, Any]:
+        """
+        Answer a question from the whole book, or only from selected_text when given
+        """
+        book = book or self.books.get()
+        mode = "selected_text" if selected_text else "full_book"
+        key = make_request_key(message, selected_text, f"{book.id}:{mode}:extractive" if extractive else f"{book.id}:{mode}")
+        result = book.answer_cache.get(key)
+        if result is not None:
+            metrics.CHAT_REQUESTS.inc(mode=mode, status="ok")
+            return result
+        try:
+            result = await self.single_flight.do(key, lambda: self._answer(message, selected_text, mode, extractive, book))
+        except Exception:
+            metrics.CHAT_REQUESTS.inc(mode=mode, status="error")
+            raise
+        metrics.CHAT_REQUESTS.inc(mode=mode, status="ok")
+        # Degraded answers are not kept, so the next request tries the LLM again
+        if result.get('fallback_reason') in (None, "requested", "no_match"):
+            book.answer_cache.put(key, result)
+        return result
+
+    async def _answer(self, message: str, selected_text: Optional[str], mode: str, extractive: bool,
+                      book: Book) -> Dict[str, Any]:
+        # One root span per computation; the service spans nest under it
+        with metrics.span("chat", mode=mode, book=book.id):
+            context, sources, passages = await self.prepare_context(message, selected_text, mode, book)
+            if not passages:
+                # Nothing in the book is close enough to the question to be worth an LLM call
+                return self._no_match(mode)
+
+            fallback_reason = self.fallback_reason(extractive)
+            if fallback_reason is None:
+                try:
+                    # Generate response using LLM with the context
+                    generation = await asyncio.wait_for(
+                        self.run_in(
+                            self.llm_executor,
+                            self.services.llm_service.generate,
+                            query=message,
+                            context=context,
+                            mode=mode,
+                            **self.prompt_options(book, mode)
+                        ),
+                        # The worker thread can't be cancelled; a late answer is discarded
+                        timeout=Config.LLM_DEADLINE_SECONDS or None,
+                    )
+                except asyncio.TimeoutError:
+                    fallback_reason = "deadline"
+                except LLMUnavailableError:
+                    fallback_reason = "llm_unavailable"
+
+            if fallback_reason is not None:
+                return await self._extractive(message, passages, mode, fallback_reason)
+
+        return {
+            'response': generation['response'],
+            'sources': sources,
+            'mode': mode,
+            'model': generation.get('model'),
+            'llm_latency_ms': generation.get('latency_ms'),
+        }
+
+    async def prepare_context(self, message: str, selected_text: Optional[str], mode: str, book: Book):
+        """
+        Build the LLM context: the (focused) selection, or retrieved and compressed chunks.
+
+        Returns (context, sources, passages); passages feed the extractive fallback.
+        """
+        sources: List[str] = []
+        if mode == "selected_text":
+            context = selected_text
+            if len(selected_text) > Config.SELECTION_MAX_CHARS:
+                with metrics.timed("selection"):
+                    context = await self.run_in(self.stage_executor, self.with_encoder, focus_selection,
+                                                message, selected_text)
+            passages = [{'text': context, 'source': ''}]
+        else:
+            passages = await self.retrieve_passages(message, book)
+            context, sources = self.build_context(passages)
+            if Config.CONTEXT_COMPRESSION != "false" and len(context) >= Config.CONTEXT_COMPRESSION_MIN_CHARS:
+                context, sources = await self.compress(message, passages, context, sources)
+        return context, sources, passages
+
+    def fallback_reason(self, extractive: bool) -> Optional[str]:
+        """
+        Why the LLM should be skipped up front, if it should
+        """
+        if extractive:
+            return "requested"
+        if not self.llm_available():
+            return "circuit_open"
+        return None
+
+    def prompt_options(self, book: Book, mode: str) -> Dict[str, Any]:
+        """
+        LLM keyword arguments for the book's system prompt (none for the default prompt)
+        """
+        system_message = book.system_prompt(mode)
+        return {'system_message': system_message} if system_message else {}
+
+    async def stream_answer(self, message: str, selected_text: Optional[str] = None,
+                            extractive: bool = False, book: Optional[Book] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Answer as a stream of events: sources, tokens, then done.
+
+        Identical concurrent streams share one computation. When every consumer
+        goes away (a new question, a disconnect) the embed/search/LLM work is
+        cancelled: the remaining stages are skipped, and the LLM stream is
+        closed upstream. A blocking embed or search call already running in a
+        thread finishes, but its result is dropped.
+        """
+        book = book or self.books.get()
+        mode = "selected_text" if selected_text else "full_book"
+        scope = f"{book.id}:{mode}:stream"
+        key = make_request_key(message, selected_text, f"{scope}:extractive" if extractive else scope)
+        completed = failed = False
+        try:
+            async for event in self.single_flight.stream(
+                key, lambda: self._stream_answer(message, selected_text, mode, extractive, book)
+            ):
+                completed = event['type'] == 'done'
+                yield event
+        except Exception:
+            failed = True
+            metrics.CHAT_REQUESTS.inc(mode=mode, status="error")
+            raise
+        finally:
+            # Closed before done without an error: the consumer went away
+            if not completed and not failed:
+                metrics.CHAT_REQUESTS.inc(mode=mode, status="cancelled")
+        if completed:
+            metrics.CHAT_REQUESTS.inc(mode=mode, status="ok")
+
+    async def _stream_answer(self, message: str, selected_text: Optional[str], mode: str,
+                             extractive: bool, book: Book) -> AsyncIterator[Dict[str, Any]]:
+        with metrics.span("chat", mode=mode, book=book.id, streaming=True):
+            context, sources, passages = await self.prepare_context(message, selected_text, mode, book)
+            yield {'type': 'sources', 'sources': sources, 'mode': mode}
+            if not passages:
+                result = self._no_match(mode)
+                yield {'type': 'token', 'text': result['response']}
+                yield {'type': 'done', 'sources': [], 'mode': mode, 'model': None, 'fallback_reason': "no_match"}
+                return
+
+            fallback_reason = self.fallback_reason(extractive)
+            tokens = None
+            if fallback_reason is None:
+                start = time.perf_counter()
+                tokens = self._stream_llm(message, context, mode, book)
+                try:
+                    first = await asyncio.wait_for(tokens.__anext__(), timeout=Config.LLM_DEADLINE_SECONDS or None)
+                except StopAsyncIteration:
+                    first = ""
+                except asyncio.TimeoutError:
+                    fallback_reason = "deadline"
+                except LLMUnavailableError:
+                    fallback_reason = "llm_unavailable"
+
+            if fallback_reason is not None:
+                result = await self._extractive(message, passages, mode, fallback_reason)
+                yield {'type': 'token', 'text': result['response']}
+                yield {'type': 'done', 'sources': result['sources'], 'mode': mode, 'model': 'extractive',
+                       'fallback_reason': fallback_reason}
+                return
+
+            yield {'type': 'token', 'text': first}
+            async for text in tokens:
+                yield {'type': 'token', 'text': text}
+            yield {'type': 'done', 'sources': sources, 'mode': mode,
+                   'llm_latency_ms': round((time.perf_counter() - start) * 1000, 1)}
+
+    def _stream_llm(self, message: str, context: str, mode: str, book: Book) -> AsyncIterator[str]:
+        llm = self.services.llm_service
+        options = self.prompt_options(book, mode)
+        if hasattr(llm, 'stream_response'):
+            return iterate_in_thread(lambda: llm.stream_response(message, context, mode, **options), self.llm_executor)
+        # Services without streaming (e.g. replayed traffic) answer in one piece
+        return iterate_in_thread(lambda: iter([llm.generate(message, context, mode, **options)['response']]),
+                                 self.llm_executor)
+
+    async def compress(self, message: str, passages: List[Dict[str, Any]], context: str, sources: List[str]):
+        """
+        Trim the context to the sentences relevant to the question; keep it whole if that fails
+        """
+        try:
+            with metrics.timed("compress"):
+                compressed, kept_sources = await self.run_in(self.stage_executor, self.with_encoder, self._compress,
+                                                             message, passages)
+        except Exception as e:
+            print(f"Context compression failed, sending the full context: {e}")
+            return context, sources
+        if not compressed:
+            return context, sources
+        metrics.CONTEXT_COMPRESSION_RATIO.observe(len(compressed) / len(context))
+        return compressed, kept_sources
+
+    def with_encoder(self, func, *args):
+        """
+        func(sentence encoder, *args). Call it on a worker thread: the first use loads the model
+        under the service container's lock.
+        """
+        return func(self.services.sentence_encoder, *args)
+
+    @staticmethod
+    def _compress(encoder, message: str, passages: List[Dict[str, Any]]):
+        if Config.CONTEXT_COMPRESSION == "auto" and not encoder.semantic:
+            return None, []  # word-overlap scores would drop sentences that paraphrase the question
+        return compress_context(encoder, message, passages)
+
+    def llm_available(self) -> bool:
+        is_available = getattr(self.services.llm_service, 'is_available', None)
+        return is_available() if is_available else True
+
+    async def _extractive(self, message: str, passages: List[Dict[str, Any]], mode: str, reason: str) -> Dict[str, Any]:
+        """
+        Answer with the context sentences closest to the question, without the LLM
+        """
+        metrics.EXTRACTIVE_ANSWERS.inc(reason=reason)
+        with metrics.timed("extractive"):
+            result = await self.run_in(self.stage_executor, self.with_encoder, extractive_answer, message, passages)
+        return {
+            'response': result['response'] if result else NOT_AVAILABLE,
+            'sources': result['sources'] if result else [],
+            'mode': mode,
+            'model': 'extractive',
+            'llm_latency_ms': None,
+            'fallback_reason': reason,
+        }
+
+    def _no_match(self, mode: str) -> Dict[str, Any]:
+        metrics.EXTRACTIVE_ANSWERS.inc(reason="no_match")
+        return {
+            'response': NOT_AVAILABLE,
+            'sources': [],
+            'mode': mode,
+            'model': None,
+            'llm_latency_ms': None,
+            'fallback_reason': "no_match",
+        }
+
+    async def retrieve_passages(self, message: str, book: Book) -> List[Dict[str, Any]]:
+        """
+        The chunks to answer from: a window of RETRIEVAL_CANDIDATES hits, cut by cut_results()
+        """
+        if not Config.ADAPTIVE_TOP_K:
+            return await self.retrieve(message, book)
+        index = book.index(self.services.qdrant_service)
+        # With slim payloads only the kept hits' texts are read (never while recording or replaying)
+        defer_texts = (Config.SLIM_PAYLOADS and Config.UPSTREAM_CASSETTE_MODE == 'off'
+                       and hasattr(index, 'attach_texts'))
+        candidates = await self.retrieve(message, book, top_k=max(Config.TOP_K, Config.RETRIEVAL_CANDIDATES),
+                                         with_text=not defer_texts)
+        passages = cut_results(candidates)
+        metrics.RETRIEVED_CHUNKS.observe(len(passages))
+        if defer_texts and passages:
+            passages = await self.run_in(self.stage_executor, index.attach_texts, passages)
+        return passages
+
+    async def retrieve(self, message: str, book: Optional[Book] = None, top_k: int = Config.TOP_K,
+                       with_text: bool = True) -> List[Dict[str, Any]]:
+        """
+        Embed the question and search the book's index
+        """
+        book = book or self.books.get()
+        key = " ".join(message.lower().split())
+        query_embedding = book.query_embedding_cache.get(key)
+        if query_embedding is None:
+            query_embedding = await self.query_embeddings.embed(message)
+            book.query_embedding_cache.put(key, query_embedding)
+        return await self.run_in(
+            self.stage_executor,
+            book.index(self.services.qdrant_service).search,
+            query_vector=query_embedding,
+            top_k=top_k,
+            **({} if with_text else {'with_text': False})
+        )
+
+    def build_context(self, search_results: List[Dict[str, Any]]):
+        """
+        Join the retrieved chunks into the prompt context and list their sources
+        """
+        # Combine the retrieved texts as context
+        with metrics.timed("prompt"):
+            context_parts = []
+            sources = []
+            for result in search_results:
+                context_parts.append(result['text'])
+                # A collapsed duplicate chunk cites every page it appeared on
+                sources.extend(s for s in passage_sources(result) if s not in sources)
+            context = "\n\n".join(context_parts)
+
+        return context, sources
+
+    async def retrieve_context(self, message: str, book: Optional[Book] = None):
+        """
+        Embed the question, search the index and join the retrieved chunks
+        """
+        return self.build_context(await self.retrieve(message, book))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'coalescing': self.single_flight.stats(),
+            'query_embedding_batches': self.query_embeddings.stats(),
+            'threads': self.threads,
+        }
@@ -0,0 +1,119 @@
+"""
+WebSocket chat sessions.
+
+One connection is one session. The server keeps the current text selection
+and book, so the client sends only the new question. Like POST /chat, every
+question is answered on its own; the conversation is the client's to keep.
+Each question is a turn whose answer is streamed back as events:
+
+    client -> {"type": "message", "message": "...", "selected_text": "...", "extractive": false, "book": "..."}
+              {"type": "cancel"}
+    server -> {"type": "session", "session_id": "..."}
+              {"type": "sources", "turn": 1, "sources": [...], "mode": "full_book"}
+              {"type": "token", "turn": 1, "text": "..."}
+              {"type": "done", "turn": 1, ...}
+              {"type": "cancelled", "turn": 1} | {"type": "error", "turn": 1, "status": 429, "detail": "..."}
+
+A message without "selected_text" keeps the session's selection; null clears
+it. "book" works the same way and starts as the connection's ?book= query
+parameter (the default book when absent). A new message, a cancel or a disconnect cancels the turn in flight, so
+its embedding, search and LLM work stops instead of running on for nobody.
+A frame that isn't a JSON object gets a 400 error event; the session stays open.
+"""
+import asyncio
+import json
+import math
+import uuid
+from typing import Any, Dict, Optional
+from fastapi import WebSocket, WebSocketDisconnect
+from admission import AdmissionController, AdmissionRejected, request_priority
+from books import UnknownBook
+from chat_pipeline import ChatPipeline
+from service_errors import LLMUnavailableError
+import metrics
+
+class ChatSession:
+    def __init__(self, websocket: WebSocket, pipeline: ChatPipeline, admission: AdmissionController, client: str,
+                 book: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.websocket = websocket
+        self.pipeline = pipeline
+        self.admission = admission
+        self.client = client
+        self.selected_text: Optional[str] = None
+        self.book = book
+        self.turns = 0
+        self.current: Optional[asyncio.Task] = None
+
+    async def send(self, event: Dict[str, Any]):
+        await self.websocket.send_json(event)
+
+    async def run(self):
+        await self.websocket.accept()
+        metrics.CHAT_SESSIONS.inc()
+        try:
+            await self.send({'type': 'session', 'session_id': self.id})
+            while True:
+                try:
+                    data = json.loads(await self.websocket.receive_text())
+                except (json.JSONDecodeError, KeyError):
+                    # KeyError: a binary frame
+                    data = None
+                if not isinstance(data, dict):
+                    await self.send({'type': 'error', 'status': 400, 'detail': "Expected a JSON object"})
+                    continue
+                kind = data.get('type', 'message')
+                if kind == 'cancel':
+                    await self.cancel_turn()
+                elif kind == 'message' and data.get('message'):
+                    await self.cancel_turn()
+                    if 'selected_text' in data:
+                        self.selected_text = data['selected_text'] or None
+                    if 'book' in data:
+                        self.book = data['book'] or None
+                    self.turns += 1
+                    self.current = asyncio.create_task(
+                        self.answer(self.turns, data['message'], bool(data.get('extractive')))
+                    )
+                else:
+                    await self.send({'type': 'error', 'status': 400, 'detail': "Expected a message or cancel event"})
+        except (WebSocketDisconnect, RuntimeError):
+            # RuntimeError: the socket closed while sending
+            pass
+        finally:
+            await self.cancel_turn(notify=False)
+            metrics.CHAT_SESSIONS.dec()
+
+    async def cancel_turn(self, notify: bool = True):
+        task, self.current = self.current, None
+        if task is None or task.done():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        metrics.CANCELLED_TURNS.inc()
+        if notify:
+            await self.send({'type': 'cancelled', 'turn': self.turns})
+
+    async def answer(self, turn: int, message: str, extractive: bool):
+        try:
+            book = self.pipeline.books.get(self.book)
+            async with self.admission.admit(self.client, request_priority(message, self.selected_text), book=book.id):
+                async for event in self.pipeline.stream_answer(message, self.selected_text, extractive, book):
+                    await self.send({**event, 'turn': turn})
+        except UnknownBook as e:
+            await self.send({'type': 'error', 'turn': turn, 'status': 404, 'detail': str(e)})
+        except AdmissionRejected as e:
+            await self.send({'type': 'error', 'turn': turn, 'status': 429, 'detail': str(e),
+                             'retry_after': math.ceil(e.retry_after)})
+        except LLMUnavailableError as e:
+            await self.send({'type': 'error', 'turn': turn, 'status': 503, 'detail': str(e)})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            try:
+                await self.send({'type': 'error', 'turn': turn, 'status': 500, 'detail': str(e)})
+            except Exception:
+                pass
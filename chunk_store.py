@@ -0,0 +1,178 @@
+"""
+Append-only chunk text store, read through mmap.
+
+With SLIM_PAYLOADS on, a Qdrant point keeps only its source, chunk_id and a
+reference {'store', 'chunk'} into one of these stores; the chunk texts and
+the per-file metadata live on local disk instead. There is one store per
+physical collection version, under CHUNK_STORE_DIR/<collection>/:
+
+    texts.bin     chunk texts, UTF-8, back to back
+    chunks.idx    one fixed-size record per chunk: offset, length, file row, chunk index
+    files.jsonl   one {"source", "metadata"} row per source file, shared by its chunks
+
+files.jsonl is written when the store is sealed (just before its version
+goes live), so a store without it is an unfinished or failed build.
+Searches return references only; the pipeline reads the texts of the hits
+it keeps, straight from the page cache.
+"""
+import json
+import mmap
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from config import Config
+
+TEXTS = "texts.bin"
+INDEX = "chunks.idx"
+FILES = "files.jsonl"
+RECORD = np.dtype([('offset', '<u8'), ('length', '<u4'), ('file', '<u4'), ('chunk_index', '<i4')])
+
+def store_path(name: str, root: Optional[str] = None) -> str:
+    return os.path.join(root or Config.CHUNK_STORE_DIR, name)
+
+class ChunkStoreWriter:
+    """
+    Appends chunks to a new store; safe to call from several upload threads
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._texts = open(os.path.join(directory, TEXTS), "wb")
+        self._index = open(os.path.join(directory, INDEX), "wb")
+        self._files: Dict[Tuple[str, str], int] = {}
+        self._rows: List[Dict[str, Any]] = []
+        self._offset = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def append(self, text: str, source: str, metadata: Dict[str, Any]) -> int:
+        """
+        Store one chunk and return its number in the store
+        """
+        metadata = dict(metadata)
+        chunk_index = metadata.pop('chunk_index', -1)
+        data = text.encode("utf-8")
+        # Chunks of one file share a single metadata row
+        key = (source, json.dumps(metadata, sort_keys=True))
+        with self._lock:
+            file_row = self._files.get(key)
+            if file_row is None:
+                file_row = self._files[key] = len(self._rows)
+                self._rows.append({'source': source, 'metadata': metadata})
+            record = np.array([(self._offset, len(data), file_row, chunk_index)], dtype=RECORD)
+            self._texts.write(data)
+            self._index.write(record.tobytes())
+            self._offset += len(data)
+            chunk = self._count
+            self._count += 1
+        return chunk
+
+    def seal(self):
+        """
+        Flush everything to disk and mark the store complete
+        """
+        with self._lock:
+            for f in (self._texts, self._index):
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+            tmp = os.path.join(self.directory, f"{FILES}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                for row in self._rows:
+                    f.write(json.dumps(row) + "\n")
+            os.replace(tmp, os.path.join(self.directory, FILES))
+
+    def abort(self):
+        with self._lock:
+            self._texts.close()
+            self._index.close()
+
+class ChunkStore:
+    """
+    Read-only view of a sealed store; texts are sliced out of an mmap
+    """
+
+    def __init__(self, directory: str):
+        files_path = os.path.join(directory, FILES)
+        if not os.path.exists(files_path):
+            raise FileNotFoundError(
+                f"No sealed chunk store at {directory}; the collection was built with SLIM_PAYLOADS "
+                f"on another host or CHUNK_STORE_DIR points elsewhere"
+            )
+        with open(files_path, encoding="utf-8") as f:
+            self.files = [json.loads(line) for line in f if line.strip()]
+        index_path = os.path.join(directory, INDEX)
+        if os.path.getsize(index_path):
+            self.index = np.memmap(index_path, dtype=RECORD, mode="r")
+        else:
+            self.index = np.zeros(0, dtype=RECORD)
+        with open(os.path.join(directory, TEXTS), "rb") as f:
+            self._texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get(self, chunk: int) -> Dict[str, Any]:
+        """
+        The chunk's text, source and metadata, as they were given to append()
+        """
+        offset, length, file_row, chunk_index = self.index[chunk].tolist()
+        row = self.files[file_row]
+        metadata = dict(row['metadata'])
+        if chunk_index >= 0:
+            metadata['chunk_index'] = chunk_index
+        return {'text': self._texts[offset:offset + length].decode("utf-8"), 'source': row['source'],
+                'metadata': metadata}
+
+    def close(self):
+        if isinstance(self._texts, mmap.mmap):
+            self._texts.close()
+
+# Stores being written and stores open for reading, by collection name
+_writers: Dict[str, ChunkStoreWriter] = {}
+_readers: Dict[str, ChunkStore] = {}
+_lock = threading.Lock()
+
+def writer(name: str) -> ChunkStoreWriter:
+    """
+    The writer for collection name's store, created on first use
+    """
+    with _lock:
+        if name not in _writers:
+            directory = store_path(name)
+            # A leftover from a failed build under the same version name
+            shutil.rmtree(directory, ignore_errors=True)
+            _writers[name] = ChunkStoreWriter(directory)
+        return _writers[name]
+
+def seal(name: str):
+    """
+    Finish collection name's store, if this process wrote one
+    """
+    with _lock:
+        store = _writers.pop(name, None)
+    if store is not None:
+        store.seal()
+
+def reader(name: str) -> ChunkStore:
+    with _lock:
+        store = _readers.get(name)
+        if store is None:
+            store = _readers[name] = ChunkStore(store_path(name))
+        return store
+
+def remove(name: str):
+    """
+    Delete collection name's store from disk, e.g. with a pruned or failed version
+    """
+    with _lock:
+        pending = _writers.pop(name, None)
+        store = _readers.pop(name, None)
+    if pending is not None:
+        pending.abort()
+    if store is not None:
+        store.close()
+    shutil.rmtree(store_path(name), ignore_errors=True)
@@ -7,41 +7,176 @@ load_dotenv()
 class Config:
     # Cohere Configuration
     COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+    COHERE_EMBED_MODEL = os.getenv("COHERE_EMBED_MODEL", "embed-english-v3.0")
 
     # Qdrant Configuration
     QDRANT_URL = os.getenv("QDRANT_URL")  # Cloud instance URL
     QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")  # Cloud instance API key
-    QDRANT_COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "physical_ai_robobook")
+    QDRANT_COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "physical_ai_robobook")  # an alias to <name>_v<n>
+    INDEX_VERSIONS_KEPT = int(os.getenv("INDEX_VERSIONS_KEPT", "2"))  # the live version plus rollback targets
+    INDEX_ALIAS_CHECK_SECONDS = float(os.getenv("INDEX_ALIAS_CHECK_SECONDS", "30"))  # other workers notice a flip within this
+    INDEX_LOCK_DIR = os.getenv("INDEX_LOCK_DIR", "")  # writer lock files; default <LOCAL_QDRANT_PATH>/locks, share it between hosts
+
+    # Books served by this deployment (see books.py); without BOOKS_FILE one book is served from the settings above
+    BOOKS_FILE = os.getenv("BOOKS_FILE", "./books.json")
+    DEFAULT_BOOK = os.getenv("DEFAULT_BOOK", "robobook")  # used when a request names no book
+    BOOK_DOCS_PATH = os.getenv("BOOK_DOCS_PATH", "../physical-ai-humanoid-robotics-ts/docs")
+    BOOK_MAX_SHARE = float(os.getenv("BOOK_MAX_SHARE", "0.5"))  # of chat slots and queue one book may hold while others wait
+    INGEST_MAX_CONCURRENT = int(os.getenv("INGEST_MAX_CONCURRENT", "1"))  # ingestions running at once per process
 
     # Local Qdrant Configuration (fallback when cloud is unavailable)
     LOCAL_QDRANT_PATH = os.getenv("LOCAL_QDRANT_PATH", "./local_qdrant_data")
+    # Slim payloads: points hold a reference, chunk texts live in a local mmap store (see chunk_store.py).
+    # Every process that serves chats must see CHUNK_STORE_DIR, so use it with one host or a shared volume.
+    SLIM_PAYLOADS = os.getenv("SLIM_PAYLOADS", "false").lower() == "true"
+    CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR", "./chunk_store")
 
     # OpenRouter Configuration
     OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
     OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "mistralai/mistral-7b-instruct")
+    OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+    # Ordered fallbacks tried after OPENROUTER_MODEL, comma separated; "model@seconds" sets a per-model timeout
+    OPENROUTER_FALLBACK_MODELS = os.getenv("OPENROUTER_FALLBACK_MODELS", "")
+    LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))  # default per-model timeout
+    LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+    LLM_HEDGE_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DELAY_SECONDS", "8"))  # used until enough latencies are observed
+    LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "1"))
+    LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+    # Graceful degradation: answer extractively from the retrieved context (see text_ranking.py)
+    LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "20"))  # 0 = wait for the LLM however long it takes
+    EXTRACTIVE_MAX_SENTENCES = int(os.getenv("EXTRACTIVE_MAX_SENTENCES", "3"))
+    # Query-aware context compression: send the LLM only the relevant sentences of the retrieved chunks
+    CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "auto").lower()  # "auto" (only with a semantic encoder), "true" or "false"
+    CONTEXT_COMPRESSION_RATIO = float(os.getenv("CONTEXT_COMPRESSION_RATIO", "0.5"))  # keep sentences scoring >= ratio * best
+    CONTEXT_COMPRESSION_NEIGHBOURS = int(os.getenv("CONTEXT_COMPRESSION_NEIGHBOURS", "1"))  # sentences kept around each hit
+    CONTEXT_COMPRESSION_MIN_SENTENCES = int(os.getenv("CONTEXT_COMPRESSION_MIN_SENTENCES", "4"))
+    CONTEXT_COMPRESSION_MIN_CHARS = int(os.getenv("CONTEXT_COMPRESSION_MIN_CHARS", "1200"))  # shorter contexts are sent whole
+    # Large text selections are cut down to their parts most relevant to the question
+    SELECTION_MAX_CHARS = int(os.getenv("SELECTION_MAX_CHARS", "4000"))  # selections up to this size are sent whole
+    SELECTION_CHUNK_CHARS = int(os.getenv("SELECTION_CHUNK_CHARS", "600"))
+    SELECTION_CACHE_SIZE = int(os.getenv("SELECTION_CACHE_SIZE", "64"))  # selections whose chunk embeddings are kept
+    SENTENCE_ENCODER = os.getenv("SENTENCE_ENCODER", "auto")  # "auto", "local" (sentence-transformers) or "hashed"
+    SENTENCE_ENCODER_MODEL = os.getenv("SENTENCE_ENCODER_MODEL", "all-MiniLM-L6-v2")
+
+    # Caches (see caches.py); both are cleared when the collection alias moves to a new index version
+    QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+    ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))  # generated /chat answers; 0 = off
+
+    # Concurrent questions are embedded together (see embedding_batcher.py); off while recording or replaying
+    QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "5"))  # 0 = one embed call per question
+    QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "96"))  # sent at once when this many wait; at most 96
+
+    # LLM backend: "openrouter" or "local" (see local_llm_service.py)
+    LLM_BACKEND = os.getenv("LLM_BACKEND", "openrouter")
+    LOCAL_LLM_MODE = os.getenv("LOCAL_LLM_MODE", "server")  # "server" (llama.cpp/Ollama) or "gguf" (in-process)
+    LOCAL_LLM_URL = os.getenv("LOCAL_LLM_URL", "http://127.0.0.1:8080/v1")  # Ollama: http://127.0.0.1:11434/v1
+    LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "local-model")
+    LOCAL_LLM_GGUF_PATH = os.getenv("LOCAL_LLM_GGUF_PATH", "./models/model.gguf")
+    LOCAL_LLM_CONTEXT_TOKENS = int(os.getenv("LOCAL_LLM_CONTEXT_TOKENS", "4096"))
+    LOCAL_LLM_THREADS = int(os.getenv("LOCAL_LLM_THREADS", "0"))  # 0 = let the runtime decide
+    LOCAL_LLM_PARALLEL = int(os.getenv("LOCAL_LLM_PARALLEL", "4"))  # match the server's --parallel slots
+    LOCAL_LLM_TIMEOUT_SECONDS = float(os.getenv("LOCAL_LLM_TIMEOUT_SECONDS", "120"))
 
     # Application Configuration
     APP_HOST = os.getenv("APP_HOST", "0.0.0.0")
-    APP_PORT = int(os.getenv("APP_PORT", "8000"))
+    APP_PORT = int(os.getenv("PORT", os.getenv("APP_PORT", "8000")))  # Railway injects $PORT
+
+    # Server process settings (see run_server.py)
+    WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0"))  # 0 = one worker per CPU core
+    MAX_WORKERS = int(os.getenv("MAX_WORKERS", "8"))
+    KEEP_ALIVE_SECONDS = int(os.getenv("KEEP_ALIVE_SECONDS", "75"))  # longer than the proxy's idle timeout
+    SOCKET_BACKLOG = int(os.getenv("SOCKET_BACKLOG", "2048"))
+    GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30"))  # time to drain in-flight chats
+    WORKER_RESTART_LIMIT = int(os.getenv("WORKER_RESTART_LIMIT", "5"))  # crashes within a minute before the server gives up
+
+    # Admission control for /chat (see admission.py)
+    ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "32"))  # chats in flight per worker
+    ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))  # waiting beyond this gets a 429
+    ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+    ADMISSION_SHORT_REQUEST_CHARS = int(os.getenv("ADMISSION_SHORT_REQUEST_CHARS", "2000"))  # selected-text chats up to this size go first
+    # Chat pipeline threads per worker. An LLM call holds its thread for the whole generation, and past the
+    # LLM deadline until the abandoned call returns, so it has its own pool apart from embed/search/ranking
+    LLM_EXECUTOR_THREADS = int(os.getenv("LLM_EXECUTOR_THREADS", "0"))  # 0 = 2 x ADMISSION_MAX_CONCURRENT
+    STAGE_EXECUTOR_THREADS = int(os.getenv("STAGE_EXECUTOR_THREADS", "0"))  # 0 = ADMISSION_MAX_CONCURRENT
+    CLIENT_RATE_LIMIT_PER_SECOND = float(os.getenv("CLIENT_RATE_LIMIT_PER_SECOND", "1"))  # per client IP; 0 = unlimited
+    CLIENT_RATE_LIMIT_BURST = float(os.getenv("CLIENT_RATE_LIMIT_BURST", "10"))
+    # Behind a proxy, the client is the rightmost X-Forwarded-For entry that isn't a trusted proxy
+    TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+    TRUSTED_PROXIES = os.getenv("TRUSTED_PROXIES", "*")  # proxy IPs/CIDRs, comma-separated; "*" = whatever peer connects (Railway)
 
     # Document processing
     CHUNK_SIZE = 500  # tokens
     OVERLAP_SIZE = 50  # tokens
-    TOP_K = 5  # number of chunks to retrieve
+    TOP_K = 5  # number of chunks to retrieve (at most, with ADAPTIVE_TOP_K)
+    # Adaptive top-k for chats: fetch a candidate window and keep only the hits that stand out (see cut_results)
+    ADAPTIVE_TOP_K = os.getenv("ADAPTIVE_TOP_K", "true").lower() == "true"
+    RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "10"))
+    RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.2"))  # best hit below this -> "not available", no LLM call
+    RETRIEVAL_RELATIVE_SCORE = float(os.getenv("RETRIEVAL_RELATIVE_SCORE", "0.75"))  # keep hits scoring >= ratio * best
+    RETRIEVAL_MIN_GAP = float(os.getenv("RETRIEVAL_MIN_GAP", "0.1"))  # cut after the largest score drop if at least this; 0 = off
+    # Coarse-to-fine search: find the closest documents by their mean chunk vector, then search only their chunks
+    # "auto" = only against a Qdrant server; the embedded store filters in Python, which is slower than a flat scan
+    HIERARCHICAL_SEARCH = os.getenv("HIERARCHICAL_SEARCH", "auto")  # "auto", "on" or "off"
+    HIERARCHICAL_TOP_SECTIONS = int(os.getenv("HIERARCHICAL_TOP_SECTIONS", "8"))  # documents whose chunks are searched
+    HIERARCHICAL_MIN_SECTIONS = int(os.getenv("HIERARCHICAL_MIN_SECTIONS", "200"))  # smaller indexes are searched flat
+    HIERARCHICAL_MIN_SCORE = float(os.getenv("HIERARCHICAL_MIN_SCORE", "0.2"))  # weaker best document -> flat search
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5"))  # chunks per embedding call during ingestion
+    INGEST_BATCH_DELAY_SECONDS = float(os.getenv("INGEST_BATCH_DELAY_SECONDS", "2"))  # pause between batches (rate limits)
+    PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "1"))  # processes that parse and chunk files; 1 = in-process, 0 = one per CPU core
+    PARSE_PARALLEL_MIN_FILES = int(os.getenv("PARSE_PARALLEL_MIN_FILES", "200"))  # smaller trees are parsed in-process
+    # Near-duplicate chunks (see near_duplicates.py) are stored once, listing every source they appear in
+    DEDUP_CHUNKS = os.getenv("DEDUP_CHUNKS", "true").lower() == "true"
+    DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))  # estimated Jaccard similarity of word shingles
+    DEDUP_SHINGLE_WORDS = int(os.getenv("DEDUP_SHINGLE_WORDS", "5"))
+    DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "128"))  # MinHash signature length
+    DEDUP_BANDS = int(os.getenv("DEDUP_BANDS", "16"))  # LSH bands; DEDUP_NUM_PERM / DEDUP_BANDS rows each
+    # Related-sections graph (see related_sections.py), served by GET /related
+    RELATED_AFTER_INGEST = os.getenv("RELATED_AFTER_INGEST", "true").lower() == "true"  # update it when POST /ingest finishes
+    RELATED_DIR = os.getenv("RELATED_DIR", "./related_graph")
+    RELATED_TOP_N = int(os.getenv("RELATED_TOP_N", "10"))  # neighbours kept per chunk and per document
+    RELATED_CACHE_SECONDS = int(os.getenv("RELATED_CACHE_SECONDS", "300"))  # Cache-Control max-age of /related
+
+    # Observability
+    METRICS_DIR = os.getenv("METRICS_DIR", "")  # shared by workers so /metrics sums all of them; run_server sets one
+    METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))  # how stale other workers' values may be
+    OTEL_ENABLED = os.getenv("OTEL_ENABLED", "false").lower() == "true"  # needs opentelemetry-api/sdk installed
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # enables the /admin endpoints and the X-Profile header; empty = disabled
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # share of /chat requests profiled automatically
+    PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+    PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))  # oldest profiles are deleted beyond this
+
+    # Record/replay of upstream calls (see upstream_cassette.py): "off", "record" or "replay"
+    UPSTREAM_CASSETTE_MODE = os.getenv("UPSTREAM_CASSETTE_MODE", "off")
+    UPSTREAM_CASSETTE_PATH = os.getenv("UPSTREAM_CASSETTE_PATH", "./cassettes/upstream.jsonl.gz")
+    UPSTREAM_REPLAY_SPEED = float(os.getenv("UPSTREAM_REPLAY_SPEED", "1.0"))  # 2 = twice as fast, 0 = no delay
+
+    # Startup / warm-up
+    STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "5.0"))  # warn when cold start exceeds this
+    WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "20.0"))  # give up waiting on slow backends
 
     # Validation
     @classmethod
-    def validate(cls):
+    def required_vars(cls):
+        """
+        The credentials the server needs; replaying recorded upstream traffic needs none
+        """
+        if cls.UPSTREAM_CASSETTE_MODE == 'replay':
+            return []
         required_vars = [
             'COHERE_API_KEY',
             'QDRANT_URL',
             'QDRANT_API_KEY',
-            'OPENROUTER_API_KEY'
         ]
+        if cls.LLM_BACKEND != "local":
+            required_vars.append('OPENROUTER_API_KEY')
+        return required_vars
 
-        missing_vars = [var for var in required_vars if not getattr(cls, var)]
+    @classmethod
+    def validate(cls):
+        missing_vars = [var for var in cls.required_vars() if not getattr(cls, var)]
         if missing_vars:
-            raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
-
-# Validate configuration on import
-Config.validate()
\ No newline at end of file
+            raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
\ No newline at end of file
@@ -0,0 +1,26 @@
+"""
+Shared pytest fixtures.
+"""
+import pytest
+from config import Config
+
+@pytest.fixture
+def config(monkeypatch):
+    """
+    Override Config settings for one test: config(NAME=value, ...); all are restored afterwards
+    """
+    def override(**settings):
+        for name, value in settings.items():
+            if not hasattr(Config, name):
+                raise AttributeError(f"Config has no setting {name}")
+            monkeypatch.setattr(Config, name, value)
+    return override
+
+@pytest.fixture
+def local_index(tmp_path, config):
+    """
+    A scratch directory with an embedded Qdrant store in it; ingestion runs without batch delays
+    """
+    config(QDRANT_URL=None, LOCAL_QDRANT_PATH=str(tmp_path / "qdrant"), INGEST_BATCH_DELAY_SECONDS=0,
+           RELATED_DIR=str(tmp_path / "related"))
+    return tmp_path
@@ -0,0 +1,141 @@
+"""
+Parse and chunk a docs tree, across CPU cores for large trees.
+
+Nothing here touches a service client, so process-pool workers import only
+this module and config. A file is the unit of work. Results come back in
+sorted path order whatever the worker count, so chunk ids and embedding
+batches are the same on every run.
+"""
+import multiprocessing
+import os
+import re
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+from config import Config
+
+def chunk_text(text: str, chunk_size: int = Config.CHUNK_SIZE, overlap: int = Config.OVERLAP_SIZE) -> List[str]:
+    """
+    Split text into overlapping chunks
+
+    A plain function (not a method) so it can be used without any service
+    clients, e.g. by the retrieval evaluation and the parse workers.
+    """
+    # Simple sentence-based chunking
+    sentences = re.split(r'(?<=[.!?])\s+', text)
+    chunks = []
+    current_chunk = ""
+
+    for sentence in sentences:
+        if len(current_chunk + " " + sentence) <= chunk_size:
+            current_chunk += " " + sentence if current_chunk else sentence
+        else:
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+
+            # Handle sentences that are longer than chunk_size by splitting them
+            if len(sentence) > chunk_size:
+                # Split long sentence into smaller parts
+                parts = [sentence[i:i+chunk_size] for i in range(0, len(sentence), chunk_size)]
+                chunks.extend(parts[:-1])  # Add all but the last part to chunks
+                current_chunk = parts[-1]  # Keep the last part as the start of the next chunk
+            else:
+                current_chunk = sentence
+
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+
+    # Add overlap between chunks
+    if overlap > 0 and len(chunks) > 1:
+        overlapped_chunks = []
+        for i, chunk in enumerate(chunks):
+            if i > 0:
+                # Add overlap from the previous chunk
+                prev_chunk_words = chunks[i-1].split()
+                overlap_text = ' '.join(prev_chunk_words[-overlap:])
+                chunk = overlap_text + ' ' + chunk
+            overlapped_chunks.append(chunk)
+        return overlapped_chunks
+
+    return chunks
+
+def list_markdown_files(directory_path: str) -> List[Path]:
+    return sorted(Path(directory_path).rglob("*.md"))
+
+def read_document(file_path: Path, root: Path) -> Dict[str, Any]:
+    """
+    Read one markdown file into a document
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        content = file.read()
+    return {
+        'id': str(file_path),
+        'text': content,
+        'source': str(file_path.relative_to(root)),
+        'metadata': {
+            'filename': file_path.name,
+            'relative_path': str(file_path.relative_to(root)),
+            'size': len(content)
+        }
+    }
+
+def parse_file(task: Tuple[str, str, int, int]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Read and chunk one file; the document comes back without its text to keep results small
+    """
+    file_path, root, chunk_size, overlap = task
+    doc = read_document(Path(file_path), Path(root))
+    chunks = chunk_text(doc.pop('text'), chunk_size, overlap)
+    return doc, chunks
+
+def parse_batch(tasks: List[Tuple[str, str, int, int]]) -> List[Tuple[Dict[str, Any], List[str]]]:
+    return [parse_file(task) for task in tasks]
+
+def ordered_map(pool: Executor, func: Callable[[Any], Any], items: Iterable[Any], window: int) -> Iterator[Any]:
+    """
+    pool.map that keeps at most `window` items submitted ahead of the consumer.
+
+    Executor.map submits everything at once, so a slow consumer (the embedding
+    stage) would let parsed results pile up in memory.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def parse_directory(directory_path: str, workers: int = Config.PARSE_WORKERS,
+                    chunk_size: int = Config.CHUNK_SIZE, overlap: int = Config.OVERLAP_SIZE,
+                    min_files: int = Config.PARSE_PARALLEL_MIN_FILES) -> Iterator[Tuple[Dict[str, Any], List[str]]]:
+    """
+    Yield (document, chunks) for every markdown file under directory_path, in path order.
+
+    Trees with at least min_files files are parsed by a pool of `workers`
+    processes (0 = one per CPU core, never more than the cores there are).
+    Results are yielded as soon as they are ready and in order, so the caller
+    can embed the first files while later ones are still being parsed. At most
+    two batches per worker are parsed ahead of the caller. On a single core the
+    pool only adds spawn and pickling costs, so parsing stays in-process.
+    """
+    files = list_markdown_files(directory_path)
+    tasks = [(str(path), directory_path, chunk_size, overlap) for path in files]
+    cores = os.cpu_count() or 1
+    workers = min(workers or cores, cores)
+    if workers <= 1 or len(tasks) < max(2, min_files):
+        for task in tasks:
+            yield parse_file(task)
+        return
+
+    # spawn, not fork: the server process has client threads that a forked child would inherit
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        # Several files per round trip keeps IPC overhead low without delaying the first results much
+        size = max(1, min(64, len(tasks) // (workers * 8)))
+        batches = (tasks[start:start + size] for start in range(0, len(tasks), size))
+        for results in ordered_map(pool, parse_batch, batches, window=workers * 2):
+            yield from results
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
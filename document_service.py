@@ -1,159 +1,214 @@
-import os
-import re
 import time
-from typing import List, Dict, Any
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
 from pathlib import Path
+import numpy as np
 from config import Config
+from doc_parsing import chunk_text, list_markdown_files, parse_directory, read_document
 from embedding_service import EmbeddingService
+from index_artifact import chunk_id, chunk_point_id
+from near_duplicates import NearDuplicateIndex
 from qdrant_service import QdrantService
+import metrics
+import related_sections
+
+class SectionCentroids:
+    """
+    Running mean of the chunk embeddings of each source document
+    """
 
-class DocumentService:
     def __init__(self):
-        self.embedding_service = EmbeddingService()
-        self.qdrant_service = QdrantService()
+        self.sums: Dict[str, np.ndarray] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, source: str, embedding: List[float]):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector = vector / norm
+        if source in self.sums:
+            self.sums[source] += vector
+            self.counts[source] += 1
+        else:
+            self.sums[source] = vector.copy()
+            self.counts[source] = 1
+
+    def centroids(self) -> Dict[str, np.ndarray]:
+        return {source: total / self.counts[source] for source, total in self.sums.items()}
+
+class DocumentService:
+    def __init__(self, embedding_service: EmbeddingService = None, qdrant_service: QdrantService = None):
+        # Reuse the caller's clients when given so the app holds one Cohere and one Qdrant client
+        self.embedding_service = embedding_service or EmbeddingService()
+        self.qdrant_service = qdrant_service or QdrantService()
 
     def read_documents_from_directory(self, directory_path: str) -> List[Dict[str, Any]]:
         """
         Read all markdown documents from the specified directory
         """
-        documents = []
-        path = Path(directory_path)
-
-        for file_path in path.rglob("*.md"):
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-
-                # Create document object
-                doc = {
-                    'id': str(file_path),
-                    'text': content,
-                    'source': str(file_path.relative_to(path)),
-                    'metadata': {
-                        'filename': file_path.name,
-                        'relative_path': str(file_path.relative_to(path)),
-                        'size': len(content)
-                    }
-                }
-                documents.append(doc)
+        root = Path(directory_path)
+        return [read_document(file_path, root) for file_path in list_markdown_files(directory_path)]
 
-        return documents
+    def parse_documents(self, directory_path: str) -> Iterator[Tuple[Dict[str, Any], List[str]]]:
+        """
+        Yield (document without text, chunks) per file, parsed in parallel for large trees
+        """
+        return parse_directory(directory_path)
 
     def chunk_text(self, text: str, chunk_size: int = Config.CHUNK_SIZE, overlap: int = Config.OVERLAP_SIZE) -> List[str]:
         """
         Split text into overlapping chunks
         """
-        # Simple sentence-based chunking
-        sentences = re.split(r'(?<=[.!?])\s+', text)
-        chunks = []
-        current_chunk = ""
-
-        for sentence in sentences:
-            if len(current_chunk + " " + sentence) <= chunk_size:
-                current_chunk += " " + sentence if current_chunk else sentence
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-
-                # Handle sentences that are longer than chunk_size by splitting them
-                if len(sentence) > chunk_size:
-                    # Split long sentence into smaller parts
-                    parts = [sentence[i:i+chunk_size] for i in range(0, len(sentence), chunk_size)]
-                    chunks.extend(parts[:-1])  # Add all but the last part to chunks
-                    current_chunk = parts[-1]  # Keep the last part as the start of the next chunk
-                else:
-                    current_chunk = sentence
-
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-
-        # Add overlap between chunks
-        if overlap > 0 and len(chunks) > 1:
-            overlapped_chunks = []
-            for i, chunk in enumerate(chunks):
-                if i > 0:
-                    # Add overlap from the previous chunk
-                    prev_chunk_words = chunks[i-1].split()
-                    overlap_text = ' '.join(prev_chunk_words[-overlap:])
-                    chunk = overlap_text + ' ' + chunk
-                overlapped_chunks.append(chunk)
-            return overlapped_chunks
-
-        return chunks
-
-    def ingest_documents(self, documents_directory: str):
+        return chunk_text(text, chunk_size, overlap)
+
+    def ingest_documents(self, documents_directory: str, update_related: bool = False):
         """
         Ingest documents from the specified directory into the vector database
+
+        Files are parsed and chunked by a process pool (see doc_parsing.py),
+        and chunk batches go to the embedding stage as soon as they fill up.
+        Each document's mean chunk embedding is stored as a section vector for
+        coarse-to-fine search (see QdrantService.search). With DEDUP_CHUNKS, a
+        chunk that nearly repeats an earlier one is not embedded; its source is
+        added to the earlier chunk's point (see near_duplicates.py). With
+        update_related, the related-sections graph is rebuilt once the new
+        version is live; POST /ingest passes RELATED_AFTER_INGEST.
         """
-        # Read documents
-        documents = self.read_documents_from_directory(documents_directory)
+        # Build a new collection version while readers keep using the live one
+        # (stand-in services without versioning are written in place)
+        versioned = hasattr(self.qdrant_service, 'new_version')
+        target = self.qdrant_service.new_version() if versioned else self.qdrant_service
 
         # Create collection in Qdrant
         # Note: We need to determine the embedding dimension, which for Cohere is typically 1024
-        self.qdrant_service.create_collection(vector_size=1024)
-
-        all_doc_chunks = []
-
-        for doc in documents:
-            # Chunk the document
-            chunks = self.chunk_text(doc['text'])
-
-            for i, chunk in enumerate(chunks):
-                chunk_doc = {
-                    'id': f"{doc['id']}_chunk_{i}",
-                    'text': chunk,
-                    'source': doc['source'],
-                    'metadata': {
-                        **doc['metadata'],
-                        'chunk_index': i,
-                        'total_chunks': len(chunks)
+        target.create_collection(vector_size=1024)
+
+        documents = 0
+        metrics.INGEST_DOCUMENTS.set(0)
+        metrics.INGEST_DUPLICATE_CHUNKS.set(0)
+        # Point ids must be known up front to add a duplicate's source to its point later
+        dedup = NearDuplicateIndex() if Config.DEDUP_CHUNKS and hasattr(target, 'add_sources') else None
+        extra_sources: Dict[str, List[str]] = {}
+        collection = getattr(self.qdrant_service, 'alias', self.qdrant_service.collection_name)
+
+        def chunk_docs() -> Iterator[Dict[str, Any]]:
+            nonlocal documents
+            for doc, chunks in self.parse_documents(documents_directory):
+                documents += 1
+                metrics.INGEST_DOCUMENTS.set(documents)
+                for i, chunk in enumerate(chunks):
+                    point_id = chunk_point_id(collection, doc['source'], i)
+                    if dedup is not None:
+                        original = dedup.check(point_id, chunk)
+                        if original is not None:
+                            extra_sources.setdefault(original, []).append(doc['source'])
+                            metrics.INGEST_DUPLICATE_CHUNKS.set(dedup.duplicates)
+                            continue
+                    yield {
+                        'id': point_id,
+                        'text': chunk,
+                        'source': doc['source'],
+                        'chunk_id': chunk_id(doc['source'], i),
+                        'metadata': {
+                            **doc['metadata'],
+                            'chunk_index': i,
+                            'total_chunks': len(chunks)
+                        }
                     }
-                }
-                all_doc_chunks.append(chunk_doc)
 
-        # Process in batches to avoid timeout
-        batch_size = 5  # Process 5 chunks at a time to avoid timeout
-        total_chunks = len(all_doc_chunks)
-
-        print(f"Processing {total_chunks} chunks in batches of {batch_size}...")
-
-        for batch_start in range(0, total_chunks, batch_size):
-            batch_end = min(batch_start + batch_size, total_chunks)
-            batch_chunks = all_doc_chunks[batch_start:batch_end]
-
-            print(f"Processing batch {batch_start//batch_size + 1}/{(total_chunks + batch_size - 1)//batch_size} (chunks {batch_start+1}-{batch_end})...")
-
-            # Generate embeddings for batch
-            chunk_texts = [chunk['text'] for chunk in batch_chunks]
-            embeddings = self.embedding_service.embed_texts(chunk_texts)
-
-            # Prepare documents with embeddings for upsert
-            documents_with_embeddings = []
-            for i, chunk_doc in enumerate(batch_chunks):
-                chunk_doc['embedding'] = embeddings[i]
-                documents_with_embeddings.append(chunk_doc)
-
-            # Upsert batch to Qdrant with retry logic
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    self.qdrant_service.upsert_documents(documents_with_embeddings)
-                    print(f"Batch {batch_start//batch_size + 1} uploaded successfully!")
-                    break
-                except Exception as e:
-                    if attempt < max_retries - 1:
-                        print(f"Error uploading batch (attempt {attempt + 1}/{max_retries}): {e}")
-                        print("Waiting 5 seconds before retry...")
-                        time.sleep(5)
-                    else:
-                        print(f"Failed to upload batch after {max_retries} attempts")
-                        raise
-
-            # Add delay between batches to avoid rate limiting
-            time.sleep(2)
+        sections = SectionCentroids()
+        try:
+            total_chunks = self._upload_chunks(target, chunk_docs(), sections)
+            if extra_sources:
+                for point_id, vector in target.add_sources(extra_sources).items():
+                    for source in extra_sources[point_id]:
+                        sections.add(source, vector)
+            if hasattr(target, 'upsert_sections'):
+                target.upsert_sections(sections.centroids(), sections.counts)
+        except Exception:
+            if versioned:
+                # Nobody reads a version before it is published, so drop the partial build
+                target.delete_collection()
+            raise
+        switch = self.qdrant_service.publish(target.collection_name) if versioned else None
+
+        related = None
+        if versioned and update_related:
+            # The new version is already live; a failed graph update leaves the previous graph in place
+            try:
+                related = related_sections.update(self.qdrant_service)
+            except Exception as e:
+                print(f"Related sections were not updated: {e}")
 
         return {
             'status': 'success',
-            'documents_processed': len(documents),
-            'chunks_created': len(all_doc_chunks),
-            'collection_name': self.qdrant_service.collection_name
-        }
\ No newline at end of file
+            'documents_processed': documents,
+            'chunks_created': total_chunks,
+            'duplicate_chunks': dedup.duplicates if dedup else 0,
+            'collection_name': target.collection_name,
+            'previous_collection': switch['previous'] if switch else None,
+            'related_sections': related,
+        }
+
+    def _upload_chunks(self, target, chunk_docs: Iterable[Dict[str, Any]], sections: SectionCentroids) -> int:
+        """
+        Embed and upsert chunks into target in small batches with retries; returns the chunk count
+        """
+        # Process in batches to avoid timeout
+        batch_size = Config.INGEST_BATCH_SIZE  # Small batches to avoid timeouts
+
+        print(f"Processing chunks in batches of {batch_size}...")
+        ingest_start = time.perf_counter()
+        metrics.INGEST_CHUNKS.set(0)
+
+        total_chunks = 0
+        batch_chunks: List[Dict[str, Any]] = []
+        for chunk_doc in chunk_docs:
+            batch_chunks.append(chunk_doc)
+            if len(batch_chunks) == batch_size:
+                self._upload_batch(target, batch_chunks, total_chunks, batch_size, ingest_start, sections)
+                total_chunks += len(batch_chunks)
+                batch_chunks = []
+        if batch_chunks:
+            self._upload_batch(target, batch_chunks, total_chunks, batch_size, ingest_start, sections)
+            total_chunks += len(batch_chunks)
+        return total_chunks
+
+    def _upload_batch(self, target, batch_chunks: List[Dict[str, Any]], batch_start: int, batch_size: int,
+                      ingest_start: float, sections: SectionCentroids):
+        batch_end = batch_start + len(batch_chunks)
+        print(f"Processing batch {batch_start//batch_size + 1} (chunks {batch_start+1}-{batch_end})...")
+
+        # Generate embeddings for batch
+        chunk_texts = [chunk['text'] for chunk in batch_chunks]
+        embeddings = self.embedding_service.embed_texts(chunk_texts)
+
+        # Prepare documents with embeddings for upsert
+        documents_with_embeddings = []
+        for i, chunk_doc in enumerate(batch_chunks):
+            chunk_doc['embedding'] = embeddings[i]
+            documents_with_embeddings.append(chunk_doc)
+            sections.add(chunk_doc['source'], embeddings[i])
+
+        # Upsert batch to Qdrant with retry logic
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                target.upsert_documents(documents_with_embeddings)
+                print(f"Batch {batch_start//batch_size + 1} uploaded successfully!")
+                break
+            except Exception as e:
+                if attempt < max_retries - 1:
+                    metrics.RETRIES.inc(upstream="qdrant")
+                    print(f"Error uploading batch (attempt {attempt + 1}/{max_retries}): {e}")
+                    print("Waiting 5 seconds before retry...")
+                    time.sleep(5)
+                else:
+                    print(f"Failed to upload batch after {max_retries} attempts")
+                    raise
+
+        metrics.INGEST_CHUNKS.set(batch_end)
+        metrics.INGEST_CHUNKS_PER_SECOND.set(batch_end / (time.perf_counter() - ingest_start))
+
+        # Add delay between batches to avoid rate limiting
+        if Config.INGEST_BATCH_DELAY_SECONDS:
+            time.sleep(Config.INGEST_BATCH_DELAY_SECONDS)
@@ -0,0 +1,105 @@
+"""
+Cross-request micro-batching of query embeddings.
+
+Each chat embeds one short question. Under concurrency, those single-text
+calls queue up against the embedding API's rate limit, although one call
+accepts up to 96 texts. The batcher holds a question for at most
+QUERY_BATCH_MAX_WAIT_MS, or until QUERY_BATCH_MAX_SIZE questions are
+waiting, then embeds them all in one call and hands each caller its vector.
+A question that arrives alone is embedded on its own, after the wait.
+"""
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from config import Config
+import metrics
+
+# Cohere's limit on texts per embed request
+MAX_TEXTS_PER_CALL = 96
+
+class QueryEmbeddingBatcher:
+    """
+    Coalesces concurrent embed_query calls on one event loop into embed_texts batches
+    """
+
+    def __init__(self, get_service: Callable[[], Any], max_batch: int = Config.QUERY_BATCH_MAX_SIZE,
+                 max_wait: float = Config.QUERY_BATCH_MAX_WAIT_MS / 1000):
+        # The service is looked up per batch, so building the batcher doesn't build the client
+        self.get_service = get_service
+        self.max_batch = max(1, min(max_batch, MAX_TEXTS_PER_CALL))
+        self.max_wait = max_wait
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: List[Tuple[str, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sending: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.queries = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_wait > 0 and self.max_batch > 1
+
+    async def embed(self, query: str) -> List[float]:
+        if not self.enabled:
+            return await asyncio.to_thread(self.get_service().embed_query, query)
+
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Futures belong to one loop (tests run several loops in turn)
+            self._loop, self._pending, self._timer = loop, [], None
+        future = loop.create_future()
+        self._pending.append((query, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        # Callers that went away (cancelled chats) don't need a vector
+        batch = [entry for entry in batch if not entry[1].done()]
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future, float]]):
+        sent = time.perf_counter()
+        for _, _, queued in batch:
+            metrics.QUERY_BATCH_WAIT_SECONDS.observe(sent - queued)
+        # The same question asked twice in one window is embedded once
+        texts = list(dict.fromkeys(query for query, _, _ in batch))
+        metrics.QUERY_BATCH_SIZE.observe(len(texts))
+        self.batches += 1
+        self.queries += len(batch)
+
+        service = self.get_service()
+        try:
+            if len(texts) == 1:
+                vectors = [await asyncio.to_thread(service.embed_query, texts[0])]
+            else:
+                vectors = await asyncio.to_thread(service.embed_texts, texts, input_type="search_query")
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text: Dict[str, List[float]] = dict(zip(texts, vectors))
+        for query, future, _ in batch:
+            if not future.done():
+                future.set_result(by_text[query])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000,
+            'batches': self.batches,
+            'queries': self.queries,
+            'pending': len(self._pending),
+        }
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Retrieval quality vs. latency evaluation
+
+Sweeps chunking and search settings over a local index built from the
+textbook and scores each configuration against a golden set of questions:
+
+    {"question": "What is ROS 2?", "expected_sources": ["module-1-ros2/intro.md"]}
+
+For every configuration it reports recall@k (share of expected sources found
+in the top k), MRR, context tokens sent per query and search latency, then
+picks the cheapest configuration that meets --min-recall.
+
+    python evaluate_retrieval.py golden_set.jsonl --chunk-sizes 300,500,800 --top-k 3,5,8
+    python evaluate_retrieval.py golden_set.jsonl --embedder hashed                    # fully offline
+    python evaluate_retrieval.py golden_set.jsonl --qdrant-url http://localhost:6333 --hnsw-ef 16,64,128 \\
+        --quantization none,int8,binary
+
+By default the index is exact NumPy search, with int8 and binary quantization
+simulated (oversampled, then rescored with full vectors). HNSW `ef` only
+applies to a Qdrant server (--qdrant-url): embedded Qdrant (--qdrant-path)
+searches exhaustively, so its results don't change with `ef`. Embeddings are
+cached on disk by text hash, so re-running a sweep costs no embedding calls.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from doc_parsing import chunk_text
+
+def approx_tokens(text: str) -> int:
+    # ~4 characters per token for English prose
+    return math.ceil(len(text) / 4)
+
+class CachedEmbedder:
+    """
+    Embeds texts through the chosen backend, remembering vectors by text hash
+    """
+
+    def __init__(self, backend: str, cache_dir: str):
+        self.backend = backend
+        if backend == "cohere":
+            from embedding_service import EmbeddingService
+            self.service = EmbeddingService()
+        elif backend == "local":
+            from local_embedding_service import LocalEmbeddingService
+            self.service = LocalEmbeddingService()
+        else:
+            from stand_in_services import StandInEmbeddingService
+            self.service = StandInEmbeddingService()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_path = os.path.join(cache_dir, f"embeddings-{backend}.npz")
+        self.cache: Dict[str, np.ndarray] = {}
+        if os.path.exists(self.cache_path):
+            stored = np.load(self.cache_path)
+            self.cache = dict(zip(stored["keys"].tolist(), stored["vectors"]))
+        self.embedding_calls = 0
+
+    @staticmethod
+    def _key(text: str, input_type: str) -> str:
+        return hashlib.sha1(f"{input_type}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed(self, texts: List[str], input_type: str, batch_size: int = 96) -> np.ndarray:
+        missing = list(dict.fromkeys(t for t in texts if self._key(t, input_type) not in self.cache))
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            vectors = self.service.embed_texts(batch, input_type=input_type)
+            self.embedding_calls += 1
+            for text, vector in zip(batch, vectors):
+                self.cache[self._key(text, input_type)] = np.asarray(vector, dtype=np.float32)
+        return np.stack([self.cache[self._key(t, input_type)] for t in texts])
+
+    def save(self):
+        if self.cache:
+            keys = list(self.cache)
+            np.savez(self.cache_path, keys=np.array(keys), vectors=np.stack([self.cache[k] for k in keys]))
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+class NumpyIndex:
+    """
+    Exact cosine search, optionally over int8 or binary quantized vectors
+    with full-precision rescoring of an oversampled candidate set
+    """
+
+    def __init__(self, vectors: np.ndarray, quantization: str = "none", oversampling: int = 3):
+        self.vectors = normalize(vectors.astype(np.float32))
+        self.quantization = quantization
+        self.oversampling = oversampling
+        if quantization == "int8":
+            self.scale = np.abs(self.vectors).max() / 127.0 or 1.0
+            self.quantized = np.round(self.vectors / self.scale).astype(np.int8)
+        elif quantization == "binary":
+            self.quantized = np.packbits(self.vectors > 0, axis=1)
+
+    def search(self, query: np.ndarray, top_k: int, hnsw_ef: Optional[int] = None) -> List[int]:
+        query = normalize(query.astype(np.float32))
+        if self.quantization == "none":
+            scores = self.vectors @ query
+        else:
+            if self.quantization == "int8":
+                approx = self.quantized.astype(np.int32) @ np.round(query / self.scale).astype(np.int32)
+            else:
+                # Hamming similarity between sign bits
+                query_bits = np.packbits(query > 0)
+                approx = -np.unpackbits(np.bitwise_xor(self.quantized, query_bits), axis=1).sum(axis=1)
+            candidates = np.argsort(-approx)[:top_k * self.oversampling]
+            scores = np.full(len(self.vectors), -np.inf, dtype=np.float32)
+            scores[candidates] = self.vectors[candidates] @ query
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        return best[np.argsort(-scores[best])].tolist()
+
+class QdrantIndex:
+    """
+    A throwaway Qdrant collection, so native quantization (and on a server, HNSW ef) is measured for real
+    """
+
+    def __init__(self, client, vectors: np.ndarray, quantization: str, name: str):
+        from qdrant_client.http import models
+
+        self.models = models
+        self.client = client
+        self.collection = name
+        quantization_config = None
+        if quantization == "int8":
+            quantization_config = models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, always_ram=True))
+        elif quantization == "binary":
+            quantization_config = models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+
+        if self.client.collection_exists(name):
+            self.client.delete_collection(name)
+        self.client.create_collection(
+            collection_name=name,
+            vectors_config=models.VectorParams(size=vectors.shape[1], distance=models.Distance.COSINE),
+            quantization_config=quantization_config,
+        )
+        for start in range(0, len(vectors), 256):
+            batch = vectors[start:start + 256]
+            self.client.upsert(name, points=[
+                models.PointStruct(id=start + i, vector=v.tolist()) for i, v in enumerate(batch)
+            ])
+
+    def search(self, query: np.ndarray, top_k: int, hnsw_ef: Optional[int] = None) -> List[int]:
+        params = self.models.SearchParams(
+            hnsw_ef=hnsw_ef,
+            quantization=self.models.QuantizationSearchParams(rescore=True, oversampling=3.0),
+        )
+        result = self.client.query_points(self.collection, query=query.tolist(), limit=top_k, search_params=params)
+        return [point.id for point in result.points]
+
+    def close(self):
+        self.client.delete_collection(self.collection)
+
+def load_golden_set(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def load_documents(directory: str) -> List[Dict[str, str]]:
+    from pathlib import Path
+
+    root = Path(directory)
+    return [
+        {'source': str(p.relative_to(root)), 'text': p.read_text(encoding="utf-8")}
+        for p in sorted(root.rglob("*.md"))
+    ]
+
+def score_ranking(retrieved_sources: List[str], expected: List[str], k: int) -> Dict[str, float]:
+    expected_set = set(expected)
+    found = expected_set & set(retrieved_sources[:k])
+    reciprocal_rank = 0.0
+    for rank, source in enumerate(retrieved_sources[:k], start=1):
+        if source in expected_set:
+            reciprocal_rank = 1.0 / rank
+            break
+    return {'recall': len(found) / len(expected_set) if expected_set else 0.0, 'rr': reciprocal_rank}
+
+def evaluate(args) -> Dict[str, Any]:
+    golden = load_golden_set(args.golden_set)
+    documents = load_documents(args.docs)
+    embedder = CachedEmbedder(args.embedder, args.cache_dir)
+    query_vectors = embedder.embed([g['question'] for g in golden], input_type="search_query")
+
+    client = None
+    if args.qdrant_url or args.qdrant_path:
+        from qdrant_client import QdrantClient
+        # One client for the whole sweep; embedded storage allows a single client per path
+        if args.qdrant_url:
+            client = QdrantClient(url=args.qdrant_url, api_key=Config.QDRANT_API_KEY)
+        else:
+            client = QdrantClient(path=args.qdrant_path)
+
+    results = []
+    for chunk_size, overlap in itertools.product(args.chunk_sizes, args.overlaps):
+        chunks, sources = [], []
+        for doc in documents:
+            for chunk in chunk_text(doc['text'], chunk_size, overlap):
+                chunks.append(chunk)
+                sources.append(doc['source'])
+        if not chunks:
+            continue
+        chunk_vectors = embedder.embed(chunks, input_type="search_document")
+        chunk_tokens = [approx_tokens(c) for c in chunks]
+
+        for quantization in args.quantization:
+            if client is not None:
+                index = QdrantIndex(client, chunk_vectors, quantization, f"eval_{chunk_size}_{overlap}_{quantization}")
+            else:
+                index = NumpyIndex(chunk_vectors, quantization)
+
+            for top_k, hnsw_ef in itertools.product(args.top_k, args.hnsw_ef):
+                latencies, recalls, reciprocal_ranks, tokens = [], [], [], []
+                for item, query in zip(golden, query_vectors):
+                    start = time.perf_counter()
+                    hits = index.search(query, top_k, hnsw_ef)
+                    latencies.append(time.perf_counter() - start)
+
+                    ranked_sources = list(dict.fromkeys(sources[i] for i in hits))
+                    scores = score_ranking(ranked_sources, item['expected_sources'], top_k)
+                    recalls.append(scores['recall'])
+                    reciprocal_ranks.append(scores['rr'])
+                    tokens.append(sum(chunk_tokens[i] for i in hits))
+
+                latency_ms = np.asarray(latencies) * 1000
+                results.append({
+                    'chunk_size': chunk_size,
+                    'overlap': overlap,
+                    'quantization': quantization,
+                    'top_k': top_k,
+                    'hnsw_ef': hnsw_ef,
+                    'chunks': len(chunks),
+                    'recall_at_k': round(float(np.mean(recalls)), 4),
+                    'mrr': round(float(np.mean(reciprocal_ranks)), 4),
+                    'context_tokens': round(float(np.mean(tokens)), 1),
+                    'search_p50_ms': round(float(np.percentile(latency_ms, 50)), 3),
+                    'search_p95_ms': round(float(np.percentile(latency_ms, 95)), 3),
+                })
+
+            if isinstance(index, QdrantIndex):
+                index.close()
+
+    embedder.save()
+
+    passing = [r for r in results if r['recall_at_k'] >= args.min_recall]
+    best = min(passing, key=lambda r: (r['context_tokens'], r['search_p95_ms'])) if passing else None
+    return {
+        'questions': len(golden),
+        'embedder': args.embedder,
+        'embedding_calls': embedder.embedding_calls,
+        'min_recall': args.min_recall,
+        'recommended': best,
+        'configurations': results,
+    }
+
+def print_table(report: Dict[str, Any]):
+    columns = ['chunk_size', 'overlap', 'quantization', 'top_k', 'hnsw_ef', 'recall_at_k', 'mrr',
+               'context_tokens', 'search_p50_ms', 'search_p95_ms']
+    print("  ".join(f"{c:>14}" for c in columns))
+    for row in sorted(report['configurations'], key=lambda r: (-r['recall_at_k'], r['context_tokens'])):
+        marker = " *" if row is report['recommended'] else ""
+        print("  ".join(f"{str(row[c]):>14}" for c in columns) + marker)
+    if report['recommended']:
+        print(f"\n* cheapest configuration with recall@k >= {report['min_recall']}")
+    else:
+        print(f"\nNo configuration reached recall@k >= {report['min_recall']}")
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality against latency and context size")
+    parser.add_argument("golden_set", help="JSONL file of {question, expected_sources}")
+    parser.add_argument("--docs", default="../physical-ai-humanoid-robotics-ts/docs")
+    parser.add_argument("--embedder", choices=["cohere", "local", "hashed"], default="cohere")
+    parser.add_argument("--chunk-sizes", type=int_list, default=[Config.CHUNK_SIZE])
+    parser.add_argument("--overlaps", type=int_list, default=[Config.OVERLAP_SIZE])
+    parser.add_argument("--top-k", type=int_list, default=[Config.TOP_K])
+    parser.add_argument("--hnsw-ef", type=lambda v: [int(x) if x != "default" else None for x in v.split(",")],
+                        default=[None], help="HNSW ef values (Qdrant server only)")
+    parser.add_argument("--quantization", type=lambda v: v.split(","), default=["none"],
+                        help="comma separated: none, int8, binary")
+    parser.add_argument("--qdrant-url", help="evaluate on a Qdrant server instead of NumPy")
+    parser.add_argument("--qdrant-path", help="evaluate on an embedded Qdrant at this path")
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    parser.add_argument("--cache-dir", default=".eval_cache")
+    parser.add_argument("--output", help="write the full report as JSON")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = evaluate(args)
+    print_table(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+A minimal OpenAI-compatible chat completion server for tests.
+
+It answers every request by echoing the question back, optionally sleeping
+per token to simulate generation speed. Models named in failing_models get
+a 500, and model_delays adds a pause before a model's answer. Usage:
+
+    with FakeLLMServer(token_delay=0.01) as server:
+        os.environ["LOCAL_LLM_URL"] = server.url
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests.append(request)
+
+        user_message = request["messages"][-1]["content"]
+        match = re.search(r"Question:\s*(.*?)\s*\n", user_message)
+        question = match.group(1) if match else user_message.strip()
+        tokens = f"Echo: {question}".split(" ")
+        model = request.get("model", "fake-model")
+        if model in server.failing_models:
+            self._send_json(500, {"error": {"message": f"{model} is down"}})
+            return
+        time.sleep(server.model_delays.get(model, 0.0))
+
+        if not request.get("stream"):
+            time.sleep(server.token_delay * len(tokens))
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": len(user_message.split()), "completion_tokens": len(tokens)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for i, token in enumerate(tokens):
+                time.sleep(server.token_delay)
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": token if i == 0 else " " + token}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading (a cancelled answer)
+            with server.lock:
+                server.disconnects += 1
+
+class FakeLLMServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, token_delay: float = 0.0,
+                 failing_models=(), model_delays=None):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.token_delay = token_delay
+        self.httpd.failing_models = set(failing_models)
+        self.httpd.model_delays = dict(model_delays or {})
+        self.httpd.requests = []
+        self.httpd.disconnects = 0
+        self.httpd.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    @property
+    def disconnects(self) -> int:
+        """
+        Streams the client closed before the answer was complete
+        """
+        return self.httpd.disconnects
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+if __name__ == "__main__":
+    server = FakeLLMServer(port=8080, token_delay=0.02)
+    print(f"Fake LLM server listening on {server.url}")
+    server.thread.start()
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.httpd.shutdown()
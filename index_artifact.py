@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Portable prebuilt index artifact: build once, bulk-load on deploy.
+
+An artifact is a directory holding:
+
+    manifest.json   format version, embedding model, dimension, point count and SHA-256 hashes
+    vectors.npy     float32 matrix, one row per chunk
+    chunks.jsonl    one {"id", "text", "source", "metadata", "chunk_id"} record per row, plus
+                    "sources" for a near-duplicate chunk found in several pages
+
+Loading it into Qdrant (cloud or the embedded store at LOCAL_QDRANT_PATH) needs
+no embedding calls. Point ids are kept. Each import fills a new collection
+version and then moves the collection alias to it (see QdrantService.publish).
+
+    python index_artifact.py export ./artifacts/robobook                # from the live collection
+    python index_artifact.py export ./artifacts/robobook --from-docs ../physical-ai-humanoid-robotics-ts/docs
+    python index_artifact.py import ./artifacts/robobook --workers 8
+    python index_artifact.py import ./artifacts/controls --book controls  # another registered book
+    python index_artifact.py verify ./artifacts/robobook
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from near_duplicates import NearDuplicateIndex
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+VECTORS = "vectors.npy"
+CHUNKS = "chunks.jsonl"
+
+class ArtifactError(Exception):
+    """Raised for a missing, corrupt or incompatible artifact"""
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def content_hash(records: Iterable[Dict[str, Any]]) -> str:
+    """
+    Hash of the chunk sources and texts, independent of point order (a Qdrant scroll returns id order)
+    """
+    chunk_hashes = sorted(
+        hashlib.sha256(record['source'].encode("utf-8") + b"\0" + record['text'].encode("utf-8")).digest()
+        for record in records
+    )
+    return hashlib.sha256(b"".join(chunk_hashes)).hexdigest()
+
+def chunk_id(source: str, chunk_index: int) -> str:
+    """
+    A chunk's name in its payload, the same whether it was ingested live or loaded from an artifact
+    """
+    return f"{source}#{chunk_index}"
+
+def chunk_point_id(collection: str, source: str, chunk_index: int) -> str:
+    """
+    Stable point id for a chunk of a book's collection (its alias), so rebuilding and
+    re-importing the same book replaces points, and two books never share ids
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{collection}:{chunk_id(source, chunk_index)}"))
+
+def write_artifact(directory: str, ids: List[str], vectors: np.ndarray, payloads: List[Dict[str, Any]],
+                   embedding_model: str, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    if len(ids) != len(vectors) or len(ids) != len(payloads):
+        raise ArtifactError("ids, vectors and payloads must have the same length")
+    os.makedirs(directory, exist_ok=True)
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    np.save(os.path.join(directory, VECTORS), vectors)
+    records = []
+    with open(os.path.join(directory, CHUNKS), "w", encoding="utf-8") as f:
+        for point_id, payload in zip(ids, payloads):
+            record = {
+                'id': point_id,
+                'text': payload.get('text', ''),
+                'source': payload.get('source', ''),
+                'metadata': payload.get('metadata', {}),
+                'chunk_id': payload.get('chunk_id', ''),
+            }
+            if payload.get('sources'):
+                record['sources'] = payload['sources']
+            records.append(record)
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'created_at': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'embedding_model': embedding_model,
+        'dimension': int(vectors.shape[1]) if len(vectors) else 0,
+        'distance': "cosine",
+        'count': len(ids),
+        'chunk_size': Config.CHUNK_SIZE,
+        'overlap_size': Config.OVERLAP_SIZE,
+        'content_sha256': content_hash(records),
+        'files': {name: file_sha256(os.path.join(directory, name)) for name in (VECTORS, CHUNKS)},
+        **(extra or {}),
+    }
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def read_artifact(directory: str, verify: bool = True) -> Tuple[Dict[str, Any], np.ndarray, List[Dict[str, Any]]]:
+    """
+    Load an artifact; vectors are memory-mapped, not copied
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise ArtifactError(f"No {MANIFEST} in {directory}")
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ArtifactError(f"Unsupported artifact format {manifest.get('format_version')}")
+
+    if verify:
+        for name, expected in manifest['files'].items():
+            if file_sha256(os.path.join(directory, name)) != expected:
+                raise ArtifactError(f"{name} does not match its manifest hash")
+
+    vectors = np.load(os.path.join(directory, VECTORS), mmap_mode="r")
+    with open(os.path.join(directory, CHUNKS), encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    if len(records) != manifest['count'] or vectors.shape[0] != manifest['count']:
+        raise ArtifactError("Point count does not match the manifest")
+    if manifest['count'] and vectors.shape[1] != manifest['dimension']:
+        raise ArtifactError("Vector dimension does not match the manifest")
+    return manifest, vectors, records
+
+def export_collection(qdrant_service, directory: str, embedding_model: str = Config.COHERE_EMBED_MODEL) -> Dict[str, Any]:
+    """
+    Write every point of a Qdrant collection to an artifact
+    """
+    ids, vectors, payloads = [], [], []
+    for point in qdrant_service.iter_points():
+        ids.append(point['id'])
+        vectors.append(point['vector'])
+        payloads.append(point['payload'])
+    return write_artifact(directory, ids, np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1), payloads,
+                          embedding_model, {'collection': qdrant_service.collection_name})
+
+def build_from_documents(embedding_service, docs_directory: str, directory: str,
+                         collection: str = Config.QDRANT_COLLECTION_NAME, batch_size: int = 96) -> Dict[str, Any]:
+    """
+    Chunk and embed a docs tree straight into an artifact, without touching Qdrant.
+
+    Point ids are derived from collection, the alias of the book the artifact
+    is for. Embedding calls go in batches of up to 96 texts, Cohere's limit per
+    request. Near-duplicate chunks are collapsed as in
+    DocumentService.ingest_documents.
+    """
+    from doc_parsing import parse_directory
+
+    dedup = NearDuplicateIndex() if Config.DEDUP_CHUNKS else None
+    ids, texts, payloads = [], [], []
+    rows: Dict[str, int] = {}
+    for doc, chunks in parse_directory(docs_directory):
+        for i, chunk in enumerate(chunks):
+            point_id = chunk_point_id(collection, doc['source'], i)
+            original = dedup.check(point_id, chunk) if dedup else None
+            if original is not None:
+                payload = payloads[rows[original]]
+                payload['sources'] = list(dict.fromkeys([*payload.get('sources', [payload['source']]), doc['source']]))
+                continue
+            rows[point_id] = len(ids)
+            ids.append(point_id)
+            texts.append(chunk)
+            payloads.append({
+                'text': chunk,
+                'source': doc['source'],
+                'metadata': {**doc['metadata'], 'chunk_index': i, 'total_chunks': len(chunks)},
+                'chunk_id': chunk_id(doc['source'], i),
+            })
+
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(embedding_service.embed_texts(texts[start:start + batch_size]))
+        print(f"Embedded {min(start + batch_size, len(texts))}/{len(texts)} chunks")
+    return write_artifact(directory, ids, np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1), payloads,
+                          embedding_model_name(embedding_service))
+
+def embedding_model_name(embedding_service) -> str:
+    """
+    The model an embedding service embeds with, as recorded in the manifest
+    """
+    # LocalEmbeddingService's .model is the model object; it names it in .model_name
+    for name in (getattr(embedding_service, 'model_name', None), getattr(embedding_service, 'model', None)):
+        if isinstance(name, str):
+            return name
+    return type(embedding_service).__name__
+
+def section_centroids(records: List[Dict[str, Any]], vectors: np.ndarray) -> Tuple[Dict[str, np.ndarray], Dict[str, int]]:
+    """
+    Mean normalized vector and chunk count per source, for coarse-to-fine search
+
+    A collapsed duplicate chunk counts for every one of its sources.
+    """
+    rows: Dict[str, List[int]] = {}
+    for i, record in enumerate(records):
+        for source in record.get('sources') or [record['source']]:
+            rows.setdefault(source, []).append(i)
+    centroids = {}
+    for source, indices in rows.items():
+        block = np.asarray(vectors[indices], dtype=np.float32)
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        centroids[source] = (block / np.where(norms == 0, 1, norms)).mean(axis=0)
+    return centroids, {source: len(indices) for source, indices in rows.items()}
+
+def import_artifact(directory: str, target, batch_size: int = 256, workers: int = 4,
+                    expected_model: Optional[str] = Config.COHERE_EMBED_MODEL, verify: bool = True) -> Dict[str, Any]:
+    """
+    Bulk-load an artifact into a QdrantService (or anything with upsert_documents).
+
+    Batches are uploaded from a thread pool. The embedded local store allows
+    one writer, so it is loaded from a single thread. A QdrantService is
+    loaded into a new collection version, which goes live only once complete.
+    """
+    manifest, vectors, records = read_artifact(directory, verify=verify)
+    if expected_model and manifest['embedding_model'] != expected_model:
+        raise ArtifactError(
+            f"Artifact was embedded with {manifest['embedding_model']}, but queries use {expected_model} "
+            f"(--allow-model-mismatch loads it anyway)"
+        )
+
+    start = time.perf_counter()
+    live = target
+    versioned = hasattr(live, 'new_version')
+    if versioned:
+        target = live.new_version()
+    target.create_collection(vector_size=manifest['dimension'])
+    if getattr(target, 'is_local', False):
+        workers = 1
+
+    def upload(batch_start: int) -> int:
+        batch = records[batch_start:batch_start + batch_size]
+        rows = np.asarray(vectors[batch_start:batch_start + len(batch)])
+        if hasattr(target, 'upsert_batch'):
+            payloads = [{k: r[k] for k in ('text', 'source', 'metadata', 'chunk_id', 'sources') if k in r}
+                        for r in batch]
+            target.upsert_batch([r['id'] for r in batch], rows, payloads)
+        else:
+            target.upsert_documents([{**r, 'embedding': row.tolist()} for r, row in zip(batch, rows)])
+        return len(batch)
+
+    loaded = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for count in pool.map(upload, range(0, len(records), batch_size)):
+                loaded += count
+                print(f"Loaded {loaded}/{len(records)} points")
+        if hasattr(target, 'upsert_sections'):
+            target.upsert_sections(*section_centroids(records, vectors))
+    except Exception:
+        if versioned:
+            target.delete_collection()
+        raise
+    switch = live.publish(target.collection_name) if versioned else None
+
+    seconds = time.perf_counter() - start
+    return {
+        'status': 'success',
+        'points_loaded': loaded,
+        'seconds': round(seconds, 2),
+        'points_per_second': round(loaded / seconds, 1) if seconds else None,
+        'collection_name': getattr(target, 'collection_name', None),
+        'previous_collection': switch['previous'] if switch else None,
+        'content_sha256': manifest['content_sha256'],
+    }
+
+def book_index(book_id: Optional[str]):
+    """
+    A QdrantService bound to a registered book's collection alias
+    """
+    from books import BookRegistry
+    from qdrant_service import QdrantService
+    return BookRegistry().get(book_id).index(QdrantService())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import a prebuilt index artifact")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="write an artifact from the collection or a docs tree")
+    export.add_argument("directory")
+    export.add_argument("--book", help="registered book id (default: DEFAULT_BOOK)")
+    export.add_argument("--from-docs", help="chunk and embed this docs directory instead of reading Qdrant")
+
+    load = commands.add_parser("import", help="bulk-load an artifact into Qdrant")
+    load.add_argument("directory")
+    load.add_argument("--book", help="registered book id (default: DEFAULT_BOOK)")
+    load.add_argument("--batch-size", type=int, default=256)
+    load.add_argument("--workers", type=int, default=4)
+    load.add_argument("--allow-model-mismatch", action="store_true",
+                      help="load even if the artifact's embedding model differs from COHERE_EMBED_MODEL")
+
+    verify = commands.add_parser("verify", help="check an artifact against its manifest")
+    verify.add_argument("directory")
+
+    args = parser.parse_args(argv)
+    if args.command == "verify":
+        manifest, _, _ = read_artifact(args.directory)
+        print(json.dumps(manifest, indent=2))
+    elif args.command == "export":
+        if args.from_docs:
+            # Only embedding calls; Qdrant isn't needed (or locked) to build from docs
+            from books import BookRegistry
+            from embedding_service import EmbeddingService
+            manifest = build_from_documents(EmbeddingService(), args.from_docs, args.directory,
+                                            BookRegistry().get(args.book).collection)
+        else:
+            manifest = export_collection(book_index(args.book), args.directory)
+        print(f"Wrote {manifest['count']} points to {args.directory}")
+    else:
+        index = book_index(args.book)
+        with index.writer_lock():  # not while a server worker ingests the same book
+            result = import_artifact(args.directory, index, args.batch_size, args.workers,
+                                     expected_model=None if args.allow_model_mismatch else Config.COHERE_EMBED_MODEL)
+        print("Import result:", result)
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,272 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import httpx
 from openai import OpenAI
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from config import Config
+from circuit_breaker import CircuitBreaker
+from service_errors import LLMUnavailableError
+from prompts import build_messages
+import metrics
+
+def parse_model_pool(primary: str, fallbacks: str, default_timeout: float) -> List[Tuple[str, float]]:
+    """
+    Turn OPENROUTER_MODEL and OPENROUTER_FALLBACK_MODELS into an ordered
+    list of (model, timeout) pairs
+    """
+    pool = []
+    for entry in [primary] + fallbacks.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        model, _, timeout = entry.partition("@")
+        model = model.strip()
+        if model and model not in [m for m, _ in pool]:
+            pool.append((model, float(timeout) if timeout else default_timeout))
+    return pool
+
+class LatencyTracker:
+    """
+    Keeps a window of recent successful latencies for one model
+    """
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q: float):
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
 
 class LLMService:
     def __init__(self):
-        # Configure OpenRouter client
+        # One keep-alive connection pool shared by every model and request
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=Config.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.LLM_MAX_CONNECTIONS,
+                keepalive_expiry=60.0,
+            ),
+            timeout=Config.LLM_TIMEOUT_SECONDS,
+        )
+
+        # Configure OpenRouter client; failover is handled here, so no client-side retries
         self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=Config.OPENROUTER_API_KEY
+            base_url=Config.OPENROUTER_BASE_URL,
+            api_key=Config.OPENROUTER_API_KEY,
+            http_client=self.http_client,
+            max_retries=0,
+        )
+
+        self.model_pool = parse_model_pool(
+            Config.OPENROUTER_MODEL, Config.OPENROUTER_FALLBACK_MODELS, Config.LLM_TIMEOUT_SECONDS
         )
+        self.breakers = {
+            model: CircuitBreaker(model, Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RESET_SECONDS)
+            for model, _ in self.model_pool
+        }
+        self.latencies = {model: LatencyTracker() for model, _ in self.model_pool}
+        self.executor = ThreadPoolExecutor(max_workers=Config.LLM_MAX_CONNECTIONS, thread_name_prefix="llm")
+
+    def build_messages(self, query: str, context: str, mode: str = "full_book", system_message: Optional[str] = None) -> List[Dict[str, str]]:
+        return build_messages(query, context, mode, system_message)
+
+    def _call_model(self, model: str, timeout: float, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            with metrics.timed("llm"):
+                response = self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.1,  # Low temperature for more consistent, factual responses
+                    max_tokens=1000,
+                    timeout=timeout,
+                )
+            content = response.choices[0].message.content
+            if not content:
+                raise ValueError(f"Empty completion from {model}")
+        except Exception:
+            self.breakers[model].record_failure()
+            metrics.UPSTREAM_ERRORS.inc(upstream="openrouter")
+            raise
+
+        metrics.record_usage(model, getattr(response, 'usage', None))
+
+        latency = time.perf_counter() - start
+        self.breakers[model].record_success()
+        self.latencies[model].record(latency)
+        return {'response': content, 'model': model, 'latency_ms': round(latency * 1000, 1)}
+
+    def hedge_delay(self, model: str) -> float:
+        """
+        How long to wait on a model before also asking the next one (its p95 latency)
+        """
+        p95 = self.latencies[model].percentile(0.95)
+        if p95 is None:
+            return Config.LLM_HEDGE_DELAY_SECONDS
+        return max(Config.LLM_HEDGE_MIN_DELAY_SECONDS, p95)
+
+    def is_available(self) -> bool:
+        """
+        False when every model's circuit is open
+        """
+        return any(not breaker.is_open() for breaker in self.breakers.values())
 
-    def generate_response(self, query: str, context: str, mode: str = "full_book") -> str:
+    def generate(self, query: str, context: str, mode: str = "full_book", system_message: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Generate a response, failing over through the model pool.
+
+        Returns the answer together with the model that produced it and its
+        latency. Raises LLMUnavailableError when every model failed or has an
+        open circuit, instead of returning a canned answer.
+        """
+        messages = self.build_messages(query, context, mode, system_message)
+        remaining = list(self.model_pool)
+        pending = {}
+        errors = []
+        hedged = False
+
+        def launch_next() -> Optional[Tuple[str, float]]:
+            # Circuits are checked only when a model is about to be used, so a
+            # half-open trial slot isn't taken by a model that never gets called
+            while remaining:
+                model, timeout = remaining.pop(0)
+                if self.breakers[model].allow_request():
+                    if pending or errors:
+                        metrics.RETRIES.inc(upstream="openrouter")
+                    # Run in a copy of the caller's context so tracing spans stay linked
+                    context = contextvars.copy_context()
+                    pending[self.executor.submit(context.run, self._call_model, model, timeout, messages)] = model
+                    return (model, time.perf_counter())
+                errors.append(f"{model}: circuit open")
+            return None
+
+        lead = launch_next()  # (model, started) of the most recently launched call
+        if lead is None:
+            raise LLMUnavailableError("All LLM circuits are open")
+
+        while pending:
+            # Hedge once: if the lead model is slower than its usual p95, race the next one
+            wait_for = None
+            if Config.LLM_HEDGE_ENABLED and not hedged and remaining:
+                wait_for = max(0.0, self.hedge_delay(lead[0]) - (time.perf_counter() - lead[1]))
+            done, _ = wait(list(pending), timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            if not done:
+                hedged = True
+                lead = launch_next() or lead
+                continue
+
+            for future in done:
+                model = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Failover to the next model in the pool
+                    print(f"LLM Error from {model}: {e}")
+                    errors.append(f"{model}: {e}")
+                    if not pending:
+                        lead = launch_next() or lead
+                    continue
+
+                result['hedged'] = hedged
+                return result
+
+        raise LLMUnavailableError("; ".join(errors))
+
+    def generate_response(self, query: str, context: str, mode: str = "full_book", system_message: Optional[str] = None) -> str:
         """
         Generate a response using the LLM with the provided context
         """
-        # Create the system message that enforces the constitution rules
-        if mode == "selected_text":
-            system_message = """You are a helpful assistant for the Physical AI & Humanoid Robotics textbook.
-            Answer the user's question using ONLY the provided selected text context.
-            Do NOT use any external knowledge or your general training.
-            If the answer is not available in the provided text, respond with:
-            'The answer is not available in the provided content.'"""
-        else:
-            system_message = """You are a helpful assistant for the Physical AI & Humanoid Robotics textbook.
-            Answer the user's question using ONLY the provided textbook content.
-            Do NOT use any external knowledge or your general training.
-            If the answer is not available in the provided content, respond with:
-            'The answer is not available in the provided content.'"""
-
-        # Create the user message with context
-        user_message = f"""
-        Context: {context}
-
-        Question: {query}
-
-        Please provide a clear, educational response based only on the context provided.
+        return self.generate(query, context, mode, system_message)['response']
+
+    def stream_response(self, query: str, context: str, mode: str = "full_book", system_message: Optional[str] = None) -> Iterator[str]:
         """
+        Yield the response text as it is generated.
 
-        try:
-            response = self.client.chat.completions.create(
-                model=Config.OPENROUTER_MODEL,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.1,  # Low temperature for more consistent, factual responses
-                max_tokens=1000,
-            )
-
-            return response.choices[0].message.content
-
-        except Exception as e:
-            # If there's an error with the LLM, return a safe response
-            print(f"LLM Error: {e}")
-            return "The answer is not available in the provided content."
+        Fails over to the next model only until the first token arrives; after
+        that the answer is committed to one model. Closing the generator closes
+        the upstream stream, so an abandoned answer stops generating tokens.
+        """
+        messages = self.build_messages(query, context, mode, system_message)
+        errors = []
+        for model, timeout in self.model_pool:
+            if not self.breakers[model].allow_request():
+                errors.append(f"{model}: circuit open")
+                continue
+            if errors:
+                metrics.RETRIES.inc(upstream="openrouter")
+
+            start = time.perf_counter()
+            started = False
+            finished = False
+            stream = None
+            try:
+                with metrics.timed("llm"):
+                    stream = self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=0.1,
+                        max_tokens=1000,
+                        timeout=timeout,
+                        stream=True,
+                    )
+                    for chunk in stream:
+                        text = chunk.choices[0].delta.content if chunk.choices else None
+                        if not text:
+                            continue
+                        if not started:
+                            metrics.TIME_TO_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                            started = True
+                        yield text
+                finished = True
+            except Exception as e:
+                finished = True
+                self.breakers[model].record_failure()
+                metrics.UPSTREAM_ERRORS.inc(upstream="openrouter")
+                if started:
+                    raise
+                print(f"LLM Error from {model}: {e}")
+                errors.append(f"{model}: {e}")
+                continue
+            finally:
+                if stream is not None:
+                    stream.close()
+                if not finished:
+                    # The caller closed the generator (a cancelled answer). A model that was
+                    # streaming tokens is healthy; one closed before any token gets its trial slot back
+                    if started:
+                        self.breakers[model].record_success()
+                    else:
+                        self.breakers[model].release_trial()
+
+            if started:
+                self.breakers[model].record_success()
+                self.latencies[model].record(time.perf_counter() - start)
+                return
+            errors.append(f"{model}: empty completion")
+
+        raise LLMUnavailableError("; ".join(errors) or "No LLM models configured")
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            model: {
+                'timeout_seconds': timeout,
+                'p95_seconds': self.latencies[model].percentile(0.95),
+                'circuit': self.breakers[model].status(),
+            }
+            for model, timeout in self.model_pool
+        }
 
     def validate_response(self, response: str, context: str) -> bool:
         """
@@ -72,4 +285,4 @@ class LLMService:
             if indicator.lower() in response.lower():
                 return False
 
-        return True
\ No newline at end of file
+        return True
@@ -1,12 +1,16 @@
 from typing import List
 from config import Config
-from sentence_transformers import SentenceTransformer
-import numpy as np
 
 class LocalEmbeddingService:
+    # Using a lightweight but effective sentence transformer model
+    MODEL_NAME = 'all-MiniLM-L6-v2'
+
     def __init__(self):
-        # Using a lightweight but effective sentence transformer model
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        # Imported here so that importing this module doesn't pull in torch
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(self.MODEL_NAME)
+        self.model_name = self.MODEL_NAME  # recorded in index artifacts; self.model is the model itself
 
     def embed_texts(self, texts: List[str], input_type: str = "search_document") -> List[List[float]]:
         """
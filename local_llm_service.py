@@ -1,48 +1,155 @@
-from typing import List, Dict, Any
+import os
+import threading
+import time
+from typing import List, Dict, Any, Iterator, Optional
 from config import Config
-import subprocess
-import sys
+from prompts import build_messages
+from service_errors import LLMUnavailableError
+import metrics
 
 class LocalLLMService:
+    """
+    Generates answers without any hosted API.
+
+    Two modes, selected with LOCAL_LLM_MODE:
+
+    server -- an OpenAI-compatible inference server on this machine
+              (llama.cpp `llama-server`, Ollama, vLLM). One persistent
+              keep-alive client is used; the server does continuous batching
+              across its parallel slots and reuses the KV cache for the shared
+              system-prompt prefix (`cache_prompt`).
+    gguf   -- a GGUF model loaded in-process with llama-cpp-python on CPU.
+              A RAM prompt cache keeps the KV state of the fixed system
+              prompt; requests take turns on the single model instance.
+    """
+
     def __init__(self):
-        # Try to initialize a local LLM - using Ollama as a fallback
+        self.mode = Config.LOCAL_LLM_MODE
+        self.model_name = Config.LOCAL_LLM_MODEL
+        if self.mode == "gguf":
+            self._init_gguf()
+        else:
+            self._init_server()
+
+    def _init_server(self):
+        import httpx
+        from openai import OpenAI
+
+        self.client = OpenAI(
+            base_url=Config.LOCAL_LLM_URL,
+            api_key=os.getenv("LOCAL_LLM_API_KEY", "local"),
+            http_client=httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=Config.LOCAL_LLM_PARALLEL,
+                    max_keepalive_connections=Config.LOCAL_LLM_PARALLEL,
+                ),
+                timeout=Config.LOCAL_LLM_TIMEOUT_SECONDS,
+            ),
+            max_retries=1,
+        )
+        # Don't send more concurrent requests than the server has slots;
+        # extra requests wait here instead of being rejected by the server
+        self._slots = threading.BoundedSemaphore(Config.LOCAL_LLM_PARALLEL)
+
+    def _init_gguf(self):
+        # Imported here so the server mode doesn't need llama-cpp-python installed
+        from llama_cpp import Llama, LlamaRAMCache
+
+        self.model_name = os.path.basename(Config.LOCAL_LLM_GGUF_PATH)
+        self.llm = Llama(
+            model_path=Config.LOCAL_LLM_GGUF_PATH,
+            n_ctx=Config.LOCAL_LLM_CONTEXT_TOKENS,
+            n_threads=Config.LOCAL_LLM_THREADS or None,
+            verbose=False,
+        )
+        self.llm.set_cache(LlamaRAMCache())
+        # A llama.cpp context can only decode one sequence at a time
+        self._slots = threading.BoundedSemaphore(1)
+
+        # Evaluate both system prompts once so their KV state is cached
+        for mode in ("full_book", "selected_text"):
+            self.llm.create_chat_completion(messages=build_messages("", "", mode)[:1], max_tokens=1)
+
+    def _complete(self, messages: List[Dict[str, str]], stream: bool):
+        if self.mode == "gguf":
+            return self.llm.create_chat_completion(
+                messages=messages,
+                temperature=0.1,
+                max_tokens=1000,
+                stream=stream,
+            )
+
+        return self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=0.1,
+            max_tokens=1000,
+            stream=stream,
+            extra_body={"cache_prompt": True},
+        )
+
+    def generate(self, query: str, context: str, mode: str = "full_book", system_message: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Generate a response with the local model
+        """
+        messages = build_messages(query, context, mode, system_message)
+        start = time.perf_counter()
         try:
-            import requests
-            self.requests = requests
-            self.has_local_llm = True
-        except ImportError:
-            self.has_local_llm = False
-
-    def generate_response(self, query: str, context: str, mode: str = "full_book") -> str:
-        """
-        Generate a response using local LLM or a fallback method
-        """
-        # Create the system message that enforces the constitution rules
-        if mode == "selected_text":
-            system_message = """You are a helpful assistant for the Physical AI & Humanoid Robotics textbook.
-            Answer the user's question using ONLY the provided selected text context.
-            Do NOT use any external knowledge or your general training.
-            If the answer is not available in the provided text, respond with:
-            'The answer is not available in the provided content.'"""
+            with self._slots, metrics.timed("llm"):
+                response = self._complete(messages, stream=False)
+        except Exception as e:
+            metrics.UPSTREAM_ERRORS.inc(upstream="local_llm")
+            raise LLMUnavailableError(f"Local LLM error: {e}") from e
+
+        if self.mode == "gguf":
+            content = response["choices"][0]["message"]["content"]
+            metrics.record_usage(self.model_name, response.get("usage"))
         else:
-            system_message = """You are a helpful assistant for the Physical AI & Humanoid Robotics textbook.
-            Answer the user's question using ONLY the provided textbook content.
-            Do NOT use any external knowledge or your general training.
-            If the answer is not available in the provided content, respond with:
-            'The answer is not available in the provided content.'"""
+            content = response.choices[0].message.content
+            metrics.record_usage(self.model_name, response.usage)
 
-        # Create the user message with context
-        user_message = f"""
-        Context: {context}
+        return {
+            'response': content,
+            'model': self.model_name,
+            'latency_ms': round((time.perf_counter() - start) * 1000, 1),
+        }
 
-        Question: {query}
+    def generate_response(self, query: str, context: str, mode: str = "full_book", system_message: Optional[str] = None) -> str:
+        """
+        Generate a response using the local LLM
+        """
+        return self.generate(query, context, mode, system_message)['response']
 
-        Please provide a clear, educational response based only on the context provided.
+    def stream_response(self, query: str, context: str, mode: str = "full_book", system_message: Optional[str] = None) -> Iterator[str]:
+        """
+        Yield the response text piece by piece as the model produces it
         """
+        messages = build_messages(query, context, mode, system_message)
+        start = time.perf_counter()
+        first_token = True
+        with self._slots, metrics.timed("llm"):
+            try:
+                chunks = self._complete(messages, stream=True)
+            except Exception as e:
+                metrics.UPSTREAM_ERRORS.inc(upstream="local_llm")
+                raise LLMUnavailableError(f"Local LLM error: {e}") from e
+
+            for chunk in chunks:
+                if self.mode == "gguf":
+                    text = chunk["choices"][0]["delta"].get("content")
+                else:
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    if first_token:
+                        metrics.TIME_TO_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                        first_token = False
+                    yield text
+
+    def is_available(self) -> bool:
+        return True
 
-        # For now, return a fallback response - in a real implementation,
-        # you would connect to a local LLM like Ollama
-        return f"Context: {context}\n\nQuestion: {query}\n\n[Local LLM response would appear here once properly configured]"
+    def status(self) -> Dict[str, Any]:
+        return {self.model_name: {'mode': self.mode}}
 
     def validate_response(self, response: str, context: str) -> bool:
         """
@@ -60,4 +167,4 @@ class LocalLLMService:
             if indicator.lower() in response.lower():
                 return False
 
-        return True
\ No newline at end of file
+        return True
@@ -1,23 +1,83 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager, nullcontext
+from fastapi import Depends, FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response
+from starlette.requests import HTTPConnection
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import hmac
+import ipaddress
+import math
 import os
 from dotenv import load_dotenv
 from config import Config
-from document_service import DocumentService
-from embedding_service import EmbeddingService
-from qdrant_service import QdrantService
-from llm_service import LLMService
+from service_container import ServiceContainer
+from books import Book, BookRegistry, UnknownBook
+from chat_pipeline import ChatPipeline
+from service_errors import IndexBusyError, LLMUnavailableError
+import caches
+from request_profiler import RequestProfiler
+from admission import AdmissionController, AdmissionRejected, request_priority
+from chat_sessions import ChatSession
+from related_sections import RelatedGraphs, follow_live_collection
+import metrics
 
 # Load environment variables
 load_dotenv()  # Load .env file
 load_dotenv('.env.local')  # Load .env.local file (overrides .env if present)
 
+# Ingestion gets its own threads, so a long rebuild never holds the pool chat stages run in
+ingest_executor = ThreadPoolExecutor(max_workers=max(1, Config.INGEST_MAX_CONCURRENT), thread_name_prefix="ingest")
+
+def live_collections(services: ServiceContainer, books: BookRegistry) -> Dict[str, Optional[str]]:
+    """
+    Each book's collection alias and the versioned collection it points at
+    """
+    qdrant = services.qdrant_service
+    if not hasattr(qdrant, 'live_collection'):
+        return {}
+    return {book.collection: book.index(qdrant).live_collection() for book in books.list()}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Build the shared services once per process and warm them up concurrently
+    """
+    # A container may be injected before startup (e.g. with mock services)
+    if getattr(app.state, 'services', None) is None:
+        # Replaying recorded upstream traffic needs no credentials
+        if Config.UPSTREAM_CASSETTE_MODE != 'replay':
+            Config.validate()
+        app.state.services = ServiceContainer()
+    if getattr(app.state, 'books', None) is None:
+        app.state.books = BookRegistry()
+    app.state.pipeline = ChatPipeline(app.state.services, app.state.books)
+    if getattr(app.state, 'admission', None) is None:
+        app.state.admission = AdmissionController()
+    if getattr(app.state, 'related', None) is None:
+        app.state.related = RelatedGraphs()
+
+    await app.state.services.warm_up()
+    watcher = None
+    if Config.INDEX_ALIAS_CHECK_SECONDS > 0 and Config.UPSTREAM_CASSETTE_MODE == 'off':
+        # Drop a book's cached embeddings and answers when any process publishes a new version of it
+        watcher = asyncio.create_task(caches.watch_index_versions(
+            lambda: live_collections(app.state.services, app.state.books),
+            Config.INDEX_ALIAS_CHECK_SECONDS,
+        ))
+    yield
+    if watcher:
+        watcher.cancel()
+    app.state.pipeline.close()
+
 app = FastAPI(
     title="Physical AI & Humanoid Robotics RAG Chatbot",
     description="A retrieval-augmented generation chatbot for the Physical AI & Humanoid Robotics textbook",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -29,11 +89,96 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services
-document_service = DocumentService()
-embedding_service = EmbeddingService()
-qdrant_service = QdrantService()
-llm_service = LLMService()
+profiler = RequestProfiler()
+
+def is_admin(request: Request) -> bool:
+    token = request.headers.get("X-Admin-Token", "")
+    return bool(Config.ADMIN_TOKEN) and hmac.compare_digest(token, Config.ADMIN_TOKEN)
+
+def require_admin(request: Request):
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.middleware("http")
+async def profile_chat_requests(request: Request, call_next):
+    """
+    Profile a chat request end to end when an admin asks for it (X-Profile: 1) or it is sampled
+    """
+    if not request.url.path.startswith("/chat"):
+        return await call_next(request)
+    requested = request.headers.get("X-Profile") == "1" and is_admin(request)
+    sampler = profiler.begin() if profiler.should_profile(requested) else None
+    if sampler is None:
+        return await call_next(request)
+
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        # Joining the sampler and writing the profile block; keep them off the event loop
+        profile_id = await asyncio.to_thread(profiler.finish, sampler,
+                                             {'path': request.url.path, 'status': status, 'requested': requested})
+    response.headers["X-Profile-Id"] = profile_id
+    return response
+
+def get_services(request: Request) -> ServiceContainer:
+    return request.app.state.services
+
+def get_pipeline(request: Request) -> ChatPipeline:
+    return request.app.state.pipeline
+
+def get_admission(request: Request) -> AdmissionController:
+    return request.app.state.admission
+
+def writer_lock(index):
+    """
+    The index's cross-process writer lock; stand-in indexes live in one process and have none
+    """
+    return index.writer_lock() if hasattr(index, 'writer_lock') else nullcontext()
+
+def get_book(request: HTTPConnection, book_id: Optional[str]) -> Book:
+    """
+    The registered book with this id (the default book for None), or a 404
+    """
+    try:
+        return request.app.state.books.get(book_id)
+    except UnknownBook as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@functools.lru_cache(maxsize=8)
+def proxy_networks(spec: str) -> Tuple[ipaddress._BaseNetwork, ...]:
+    return tuple(ipaddress.ip_network(entry.strip(), strict=False)
+                 for entry in spec.split(",") if entry.strip() and entry.strip() != "*")
+
+def is_proxy(host: str, spec: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in proxy_networks(spec))
+
+def client_id(request: HTTPConnection) -> str:
+    """
+    The caller's IP, taken from X-Forwarded-For when running behind a trusted proxy
+
+    Each proxy appends the address it received the request from, so entries
+    left of the last proxy's are whatever the client sent and can't be
+    trusted. The client is the rightmost entry that isn't one of
+    TRUSTED_PROXIES ("*" trusts the connecting peer, i.e. a single proxy).
+    """
+    peer = request.client.host if request.client else "unknown"
+    spec = Config.TRUSTED_PROXIES
+    if not Config.TRUST_FORWARDED_FOR or not ("*" in spec.split(",") or is_proxy(peer, spec)):
+        return peer
+    hops = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not is_proxy(hop, spec):
+            return hop
+    return hops[0] if hops else peer
+
+def too_busy(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
 
 # Request/Response models
 class ChatMessage(BaseModel):
@@ -44,100 +189,249 @@ class ChatRequest(BaseModel):
     message: str
     selected_text: Optional[str] = None  # For selected text mode
     history: List[ChatMessage] = []
+    extractive: bool = False  # answer from the retrieved sentences without calling the LLM
+    book: Optional[str] = None  # registered book id; the default book when omitted
 
 class ChatResponse(BaseModel):
     response: str
     sources: List[str] = []
     mode: str  # "full_book" or "selected_text"
+    book: Optional[str] = None
+    model: Optional[str] = None  # LLM that produced the answer
+    llm_latency_ms: Optional[float] = None
+    fallback_reason: Optional[str] = None  # why the LLM didn't answer (extractive fallback, or no_match)
+
+class SearchRequest(BaseModel):
+    query: str
+    book: Optional[str] = None
+    top_k: int = Config.TOP_K
+
+class BookSpec(BaseModel):
+    title: Optional[str] = None
+    collection: Optional[str] = None  # Qdrant collection alias; defaults to "<id>_book"
+    docs_path: Optional[str] = None
+    system_prompt: Optional[str] = None  # replaces the prompt generated from the title
 
 @app.get("/")
 async def root():
     return {"message": "Physical AI & Humanoid Robotics RAG Chatbot API"}
 
+@app.get("/health")
+async def health(request: Request, services: ServiceContainer = Depends(get_services), pipeline: ChatPipeline = Depends(get_pipeline)):
+    """
+    Report which services are ready, how long startup took and how many chats were coalesced
+    """
+    status = {
+        **services.status(),
+        **pipeline.stats(),
+        'admission': request.app.state.admission.stats(),
+        'caches': caches.stats(),
+    }
+    if services.is_ready('llm_service') and hasattr(services.llm_service, 'status'):
+        status['llm'] = services.llm_service.status()
+    return status
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Prometheus scrape endpoint: stage latencies, tokens, cache hits, retries, errors, ingestion throughput
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """
+    Recent request profiles, newest first, with their hottest functions
+    """
+    return {'profiles': profiler.store.list()}
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str, format: str = "json"):
+    """
+    One profile: the JSON summary, or format=collapsed for flamegraph.pl / speedscope input
+    """
+    if format == "collapsed":
+        path = profiler.store.collapsed_path(profile_id)
+        if path:
+            return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.collapsed")
+    else:
+        summary = profiler.store.get(profile_id)
+        if summary:
+            return summary
+    raise HTTPException(status_code=404, detail="Profile not found")
+
+@app.get("/admin/index", dependencies=[Depends(require_admin)])
+async def index_status(request: Request, book: Optional[str] = None, services: ServiceContainer = Depends(get_services)):
+    """
+    A book's collection alias, the version it points at and the versions kept for rollback
+    """
+    return await asyncio.to_thread(get_book(request, book).index(services.qdrant_service).index_status)
+
+@app.post("/admin/index/rollback", dependencies=[Depends(require_admin)])
+async def rollback_index(request: Request, book: Optional[str] = None, services: ServiceContainer = Depends(get_services)):
+    """
+    Point a book's alias back at its previous index version, and its related-sections graph with it
+    """
+    index = get_book(request, book).index(services.qdrant_service)
+
+    def roll_back():
+        switch = index.rollback()
+        try:
+            switch['related_sections'] = follow_live_collection(index)
+        except Exception as e:
+            print(f"Related sections were not rolled back: {e}")
+        return switch
+
+    try:
+        with writer_lock(index):
+            return await asyncio.to_thread(roll_back)
+    except (IndexBusyError, ValueError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/books")
+async def list_books(request: Request):
+    """
+    The books this deployment serves; pass an id as "book" to the chat, search and ingest endpoints
+    """
+    books = request.app.state.books
+    return {
+        'default': books.default_id,
+        'books': [{'id': book.id, 'title': book.title} for book in books.list()],
+    }
+
+@app.put("/admin/books/{book_id}", dependencies=[Depends(require_admin)])
+async def register_book(book_id: str, spec: BookSpec, request: Request):
+    """
+    Register a book, or update its title, collection, docs path or prompt
+    """
+    try:
+        book = Book.from_dict({'id': book_id, **spec.model_dump()})
+        await asyncio.to_thread(request.app.state.books.register, book)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return book.to_dict()
+
+@app.post("/search")
+async def search(request: SearchRequest, http_request: Request, pipeline: ChatPipeline = Depends(get_pipeline),
+                 admission: AdmissionController = Depends(get_admission)):
+    """
+    The chunks of a book most similar to the query, without generating an answer
+    """
+    book = get_book(http_request, request.book)
+    top_k = min(max(1, request.top_k), 50)
+    try:
+        async with admission.admit(client_id(http_request), book=book.id):
+            results = await pipeline.retrieve(request.query, book, top_k=top_k)
+    except AdmissionRejected as e:
+        raise too_busy(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {'book': book.id, 'results': results}
+
+@app.get("/related")
+async def related(request: Request, source: str, book: Optional[str] = None, limit: int = 5, chunks: bool = False):
+    """
+    The pages most related to one page, and optionally the closest passages to each of its chunks.
+
+    Read from the precomputed graph (see related_sections.py): no embedding
+    or search per page view. Responses carry an ETag per graph generation.
+    """
+    target = get_book(request, book)
+    current = await asyncio.to_thread(request.app.state.related.get, target.collection)
+    if current is None:
+        raise HTTPException(status_code=404, detail=f"No related-sections graph for book {target.id} yet")
+    generation, graph = current
+    headers = {'ETag': f'"{target.collection}-{generation}"', 'Cache-Control': f"public, max-age={Config.RELATED_CACHE_SECONDS}"}
+    if request.headers.get('if-none-match') == headers['ETag']:
+        return Response(status_code=304, headers=headers)
+    result = graph.related(source, min(max(1, limit), graph.meta['top_n']), chunks)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Unknown page {source} in book {target.id}")
+    return JSONResponse({**result, 'book': target.id}, headers=headers)
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request, pipeline: ChatPipeline = Depends(get_pipeline),
+               admission: AdmissionController = Depends(get_admission)):
     """
     Main chat endpoint that handles both full-book and selected-text modes
     """
+    book = get_book(http_request, request.book)
     try:
-        # Determine mode based on selected_text
-        if request.selected_text:
-            mode = "selected_text"
-            context = request.selected_text
-        else:
-            mode = "full_book"
-            # Perform vector search to retrieve relevant context
-            query_embedding = embedding_service.embed_query(request.message)
-            search_results = qdrant_service.search(
-                query_vector=query_embedding,
-                top_k=Config.TOP_K
-            )
-
-            # Combine the retrieved texts as context
-            context_parts = []
-            sources = []
-            for result in search_results:
-                context_parts.append(result['text'])
-                if result['source'] not in sources:
-                    sources.append(result['source'])
-
-            context = "\n\n".join(context_parts)
-
-        # Generate response using LLM with the context
-        response = llm_service.generate_response(
-            query=request.message,
-            context=context,
-            mode=mode
-        )
-
-        return ChatResponse(
-            response=response,
-            sources=sources if mode == "full_book" else [],
-            mode=mode
-        )
+        async with admission.admit(client_id(http_request), request_priority(request.message, request.selected_text),
+                                   book=book.id):
+            result = await pipeline.answer(request.message, selected_text=request.selected_text,
+                                           extractive=request.extractive, book=book)
+        return ChatResponse(**result, book=book.id)
+    except AdmissionRejected as e:
+        raise too_busy(e)
+    except LLMUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(Config.CIRCUIT_RESET_SECONDS))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/chat-with-selection", response_model=ChatResponse)
-async def chat_with_selection(request: ChatRequest):
+async def chat_with_selection(request: ChatRequest, http_request: Request, pipeline: ChatPipeline = Depends(get_pipeline),
+                              admission: AdmissionController = Depends(get_admission)):
     """
     Chat endpoint specifically for selected text mode
     """
     if not request.selected_text:
         raise HTTPException(status_code=400, detail="selected_text is required for this endpoint")
 
+    book = get_book(http_request, request.book)
     try:
         # Process using only the selected text
-        response = llm_service.generate_response(
-            query=request.message,
-            context=request.selected_text,
-            mode="selected_text"
-        )
-
-        return ChatResponse(
-            response=response,
-            sources=[],
-            mode="selected_text"
-        )
+        async with admission.admit(client_id(http_request), request_priority(request.message, request.selected_text),
+                                   book=book.id):
+            result = await pipeline.answer(request.message, selected_text=request.selected_text,
+                                           extractive=request.extractive, book=book)
+        return ChatResponse(**result, book=book.id)
+    except AdmissionRejected as e:
+        raise too_busy(e)
+    except LLMUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(Config.CIRCUIT_RESET_SECONDS))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket):
+    """
+    Streaming chat over a persistent connection; see chat_sessions.py for the protocol
+    """
+    state = websocket.app.state
+    await ChatSession(websocket, state.pipeline, state.admission, client_id(websocket),
+                      websocket.query_params.get("book")).run()
+
 @app.post("/ingest")
-async def ingest_documents():
+async def ingest_documents(request: Request, book: Optional[str] = None, services: ServiceContainer = Depends(get_services)):
     """
-    Endpoint to ingest textbook documents into the vector database
+    Endpoint to ingest a book's documents into the vector database
+
+    The book is indexed into a new collection version on the ingestion threads
+    while chats keep reading the live one; the alias moves only once it is
+    complete. The index's writer lock, a file lock shared by every worker
+    process, lets one request at a time ingest a book; the others get 409.
     """
+    target = get_book(request, book)
+    if not target.docs_path:
+        raise HTTPException(status_code=400, detail=f"Book {target.id} has no docs_path to ingest from")
+    index = target.index(services.qdrant_service)
     try:
-        # Get the path to the textbook documents
-        textbook_path = "../physical-ai-humanoid-robotics-ts/docs"
+        with writer_lock(index):
+            from document_service import DocumentService
+            document_service = DocumentService(embedding_service=services.embedding_service, qdrant_service=index)
 
-        # Ingest documents from the textbook
-        result = document_service.ingest_documents(textbook_path)
+            # Ingest documents from the book's docs directory
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(ingest_executor, document_service.ingest_documents, target.docs_path,
+                                                Config.RELATED_AFTER_INGEST)
 
-        return result
+        return {**result, 'book': target.id}
+    except IndexBusyError:
+        raise HTTPException(status_code=409, detail=f"Book {target.id} is already being ingested")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host=Config.APP_HOST, port=Config.APP_PORT)
\ No newline at end of file
@@ -0,0 +1,328 @@
+"""
+In-process metrics with a Prometheus text endpoint, plus optional OpenTelemetry spans.
+
+Recording a value is a lock and a bisect, so instrumentation can stay on in
+production. Each server worker keeps its own registry. With METRICS_DIR set
+(run_server.py sets it when it forks several workers), every worker writes
+a snapshot of its registry there every METRICS_FLUSH_SECONDS, and a scrape
+of any worker returns the sum over all of them. Counters and histograms
+include workers that have exited, so they never go backwards. Gauges are
+summed over live workers only.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from config import Config
+
+# Latency buckets in seconds, from a fast local search up to a slow LLM answer
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(labels.get(n, "") for n in self.label_names), 0.0)
+
+    def items(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            return list(self._values.items())
+
+    @staticmethod
+    def combine(total: Optional[float], value: float) -> float:
+        return value if total is None else total + value
+
+    def render(self, items: Optional[Sequence[Tuple[Tuple[str, ...], float]]] = None) -> List[str]:
+        items = self.items() if items is None else items
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, k)} {v}" for k, v in items]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with self._lock:
+            self._values[key] = float(value)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, **labels: str) -> int:
+        series = self._values.get(tuple(labels.get(n, "") for n in self.label_names))
+        return int(sum(series[:-1])) if series else 0
+
+    def items(self) -> List[Tuple[Tuple[str, ...], List[float]]]:
+        with self._lock:
+            return [(k, list(v)) for k, v in self._values.items()]
+
+    @staticmethod
+    def combine(total: Optional[List[float]], series: List[float]) -> List[float]:
+        return list(series) if total is None else [a + b for a, b in zip(total, series)]
+
+    def render(self, items: Optional[Sequence[Tuple[Tuple[str, ...], List[float]]]] = None) -> List[str]:
+        items = self.items() if items is None else items
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.label_names + ("le",), key + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> Dict[str, List[Tuple[Tuple[str, ...], Any]]]:
+        return {metric.name: metric.items() for metric in self.metrics}
+
+    def flush(self, directory: str):
+        """
+        Write this process's snapshot to directory/<pid>.json for the other workers' scrapes
+        """
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def render(self) -> str:
+        directory = Config.METRICS_DIR
+        if directory:
+            self.flush(directory)
+            snapshots = read_snapshots(directory)
+        else:
+            snapshots = [(os.getpid(), True, self.snapshot())]
+
+        lines = ["# TYPE rag_worker_info gauge"]
+        lines.extend(f'rag_worker_info{{pid="{pid}"}} 1' for pid, alive, _ in snapshots if alive)
+        for metric in self.metrics:
+            merged: Dict[Tuple[str, ...], Any] = {}
+            for _, alive, snapshot in snapshots:
+                if isinstance(metric, Gauge) and not alive:
+                    continue  # an exited worker has nothing in flight
+                for key, value in snapshot.get(metric.name, ()):
+                    key = tuple(key)
+                    merged[key] = metric.combine(merged.get(key), value)
+            lines.extend(metric.render(list(merged.items())))
+        return "\n".join(lines) + "\n"
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def read_snapshots(directory: str) -> List[Tuple[int, bool, Dict[str, Any]]]:
+    """
+    (pid, alive, snapshot) for every worker that has written to directory
+    """
+    snapshots = []
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        if ext != ".json" or not stem.isdigit():
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        pid = int(stem)
+        snapshots.append((pid, pid == os.getpid() or _alive(pid), snapshot))
+    return snapshots
+
+REGISTRY = Registry()
+
+def share(directory: Optional[str] = None, interval: Optional[float] = None):
+    """
+    Start writing this worker's snapshot to the shared metrics directory in the background
+    """
+    directory = directory or Config.METRICS_DIR
+    interval = interval or Config.METRICS_FLUSH_SECONDS
+    if not directory:
+        return
+
+    def loop():
+        while True:
+            try:
+                REGISTRY.flush(directory)
+            except OSError as e:
+                print(f"Could not write metrics to {directory}: {e}")
+            time.sleep(interval)
+
+    threading.Thread(target=loop, name="metrics-flush", daemon=True).start()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "rag_stage_seconds", "Latency of each chat pipeline stage (embed, search, selection, prompt, compress, llm, extractive)", ["stage"]))
+TIME_TO_FIRST_TOKEN_SECONDS = REGISTRY.register(Histogram(
+    "rag_time_to_first_token_seconds", "Time from sending a streamed LLM request to its first token"))
+CHAT_REQUESTS = REGISTRY.register(Counter(
+    "rag_chat_requests_total", "Chat requests by mode and outcome", ["mode", "status"]))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "rag_llm_tokens_total", "LLM tokens by direction (in = prompt, out = completion)", ["direction", "model"]))
+CACHE_HITS = REGISTRY.register(Counter(
+    "rag_cache_hits_total", "Cache lookups served from cache", ["cache"]))
+CACHE_MISSES = REGISTRY.register(Counter(
+    "rag_cache_misses_total", "Cache lookups that had to compute the value", ["cache"]))
+CHAT_SESSIONS = REGISTRY.register(Gauge(
+    "rag_chat_sessions", "Open WebSocket chat sessions"))
+CANCELLED_TURNS = REGISTRY.register(Counter(
+    "rag_cancelled_turns_total", "Chat turns cancelled by a newer message, a cancel or a disconnect"))
+COALESCED_REQUESTS = REGISTRY.register(Counter(
+    "rag_coalesced_requests_total", "Chat requests that joined an identical in-flight request"))
+RETRIES = REGISTRY.register(Counter(
+    "rag_retries_total", "Retried or failed-over upstream calls", ["upstream"]))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    "rag_upstream_errors_total", "Errors returned by upstream services", ["upstream"]))
+CONTEXT_COMPRESSION_RATIO = REGISTRY.register(Histogram(
+    "rag_context_compression_ratio", "Compressed context length as a fraction of the retrieved context",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)))
+EXTRACTIVE_ANSWERS = REGISTRY.register(Counter(
+    "rag_extractive_answers_total", "Answers given without the LLM (extracted, or no_match), by reason", ["reason"]))
+ADMISSION_IN_FLIGHT = REGISTRY.register(Gauge(
+    "rag_admission_in_flight", "Chat requests holding a concurrency slot"))
+ADMISSION_QUEUED = REGISTRY.register(Gauge(
+    "rag_admission_queued", "Chat requests waiting for a concurrency slot"))
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    "rag_admission_rejected_total", "Chat requests rejected with 429 (rate_limit, queue_full, deadline)", ["reason"]))
+ADMISSION_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "rag_admission_wait_seconds", "Time admitted chat requests spent queued", ["priority"]))
+INGEST_CHUNKS = REGISTRY.register(Gauge(
+    "rag_ingest_chunks", "Chunks embedded and stored by the current or last ingestion"))
+INGEST_CHUNKS_PER_SECOND = REGISTRY.register(Gauge(
+    "rag_ingest_chunks_per_second", "Throughput of the current or last ingestion"))
+INGEST_DOCUMENTS = REGISTRY.register(Gauge(
+    "rag_ingest_documents", "Documents read by the current or last ingestion"))
+INGEST_DUPLICATE_CHUNKS = REGISTRY.register(Gauge(
+    "rag_ingest_duplicate_chunks", "Near-duplicate chunks folded into an earlier point by the current or last ingestion"))
+RETRIEVED_CHUNKS = REGISTRY.register(Histogram(
+    "rag_retrieved_chunks", "Chunks kept for the LLM by adaptive top-k (0 = answered \"not available\" without it)",
+    buckets=(0, 1, 2, 3, 4, 5, 10, 20)))
+HIERARCHICAL_SEARCHES = REGISTRY.register(Counter(
+    "rag_hierarchical_searches_total", "Searches over large indexes by path (sections, flat_low_confidence, flat_few_hits)",
+    ["path"]))
+QUERY_BATCH_SIZE = REGISTRY.register(Histogram(
+    "rag_query_embed_batch_size", "Distinct questions per batched query-embedding call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 96)))
+QUERY_BATCH_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "rag_query_embed_batch_wait_seconds", "Time a question waited for its embedding batch to be sent",
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1)))
+
+# Optional OpenTelemetry tracing; spans nest through contextvars, so one chat
+# request links the embedding, search and LLM spans under a single trace
+_tracer = None
+if Config.OTEL_ENABLED:
+    try:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer("rag_chatbot")
+    except ImportError:
+        print("OTEL_ENABLED is set but opentelemetry is not installed; tracing disabled")
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[None]:
+    if _tracer is None:
+        yield
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes):
+        yield
+
+class timed:
+    """
+    Context manager that records a stage's duration (and a span when tracing is on)
+
+        with metrics.timed("search"):
+            ...
+    """
+    __slots__ = ("stage", "start", "_span")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self._span = span(self.stage) if _tracer is not None else None
+        if self._span is not None:
+            self._span.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, stage=self.stage)
+        if self._span is not None:
+            self._span.__exit__(exc_type, exc, tb)
+        return False
+
+def record_usage(model: str, usage: Optional[object]):
+    """
+    Count prompt/completion tokens from an OpenAI-style usage object or dict
+    """
+    if usage is None:
+        return
+    get = usage.get if isinstance(usage, dict) else lambda k: getattr(usage, k, None)
+    if get("prompt_tokens"):
+        LLM_TOKENS.inc(get("prompt_tokens"), direction="in", model=model)
+    if get("completion_tokens"):
+        LLM_TOKENS.inc(get("completion_tokens"), direction="out", model=model)
+
+def render() -> str:
+    return REGISTRY.render()
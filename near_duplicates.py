@@ -0,0 +1,96 @@
+"""
+Near-duplicate chunk detection with MinHash and LSH banding.
+
+Textbooks repeat boilerplate (admonitions, setup steps, license footers)
+across many pages. Ingestion would otherwise embed and store every copy, and
+a search would return several hits with the same text. Each chunk gets a
+MinHash signature over its word shingles. Signatures are split into bands,
+and a chunk that shares a whole band with an earlier chunk is a candidate
+duplicate. A candidate counts as a duplicate only when the two signatures
+agree on at least DEDUP_THRESHOLD of their positions, which estimates the
+Jaccard similarity of the shingle sets. A duplicate is not embedded: its
+source is added to the first copy's point instead.
+"""
+import re
+import zlib
+from typing import Dict, Hashable, List, Optional, Tuple
+import numpy as np
+from config import Config
+
+# Hash values are 32-bit; (a * x + b) stays below 2**64 for 32-bit a, b and x
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+def shingles(text: str, size: int = Config.DEDUP_SHINGLE_WORDS) -> np.ndarray:
+    """
+    32-bit hashes of the text's overlapping word n-grams, ignoring case and whitespace
+    """
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.uint64, count=len(grams))
+
+class NearDuplicateIndex:
+    """
+    Finds earlier chunks whose text is nearly the same as a new one's
+    """
+
+    def __init__(self, threshold: float = Config.DEDUP_THRESHOLD, num_perm: int = Config.DEDUP_NUM_PERM,
+                 bands: int = Config.DEDUP_BANDS, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError(f"DEDUP_NUM_PERM ({num_perm}) must be a multiple of DEDUP_BANDS ({bands})")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self._keys: List[Hashable] = []
+        self._signatures: List[np.ndarray] = []
+        self.checked = 0
+        self.duplicates = 0
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingles(text)[:, None]
+        permuted = ((self._a * hashes + self._b) % MERSENNE_PRIME) & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _bands(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def find(self, signature: np.ndarray) -> Optional[Tuple[Hashable, float]]:
+        """
+        (key, estimated Jaccard similarity) of the closest indexed chunk above the threshold, or None
+        """
+        candidates = set()
+        for bucket, band in zip(self._buckets, self._bands(signature)):
+            candidates.update(bucket.get(band, ()))
+        best, best_similarity = None, self.threshold
+        for row in candidates:
+            similarity = float(np.mean(self._signatures[row] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = row, similarity
+        return None if best is None else (self._keys[best], best_similarity)
+
+    def add(self, key: Hashable, signature: np.ndarray):
+        row = len(self._keys)
+        self._keys.append(key)
+        self._signatures.append(signature)
+        for bucket, band in zip(self._buckets, self._bands(signature)):
+            bucket.setdefault(band, []).append(row)
+
+    def check(self, key: Hashable, text: str) -> Optional[Hashable]:
+        """
+        The key of an earlier near-duplicate of text; otherwise index text under key and return None
+        """
+        self.checked += 1
+        signature = self.signature(text)
+        match = self.find(signature)
+        if match is not None:
+            self.duplicates += 1
+            return match[0]
+        self.add(key, signature)
+        return None
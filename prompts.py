@@ -0,0 +1,52 @@
+"""
+Chat prompts shared by the LLM backends.
+
+Kept free of client libraries so the book registry can build prompts without
+importing openai or httpx.
+"""
+from typing import Dict, List, Optional
+
+DEFAULT_BOOK_TITLE = "Physical AI & Humanoid Robotics textbook"
+
+def system_prompt(mode: str = "full_book", title: str = DEFAULT_BOOK_TITLE) -> str:
+    """
+    The system message that enforces the constitution rules for one book
+    """
+    if mode == "selected_text":
+        return f"""You are a helpful assistant for the {title}.
+        Answer the user's question using ONLY the provided selected text context.
+        Do NOT use any external knowledge or your general training.
+        If the answer is not available in the provided text, respond with:
+        'The answer is not available in the provided content.'"""
+    return f"""You are a helpful assistant for the {title}.
+        Answer the user's question using ONLY the provided textbook content.
+        Do NOT use any external knowledge or your general training.
+        If the answer is not available in the provided content, respond with:
+        'The answer is not available in the provided content.'"""
+
+def build_messages(query: str, context: str, mode: str = "full_book",
+                   system_message: Optional[str] = None) -> List[Dict[str, str]]:
+    """
+    Build the chat messages that enforce the constitution rules.
+
+    The system message comes first and never varies within a mode (and book),
+    so servers that cache prompt prefixes can reuse it across requests.
+    system_message replaces the default book's prompt, e.g. for another book.
+    """
+    # Create the system message that enforces the constitution rules
+    if system_message is None:
+        system_message = system_prompt(mode)
+
+    # Create the user message with context
+    user_message = f"""
+    Context: {context}
+
+    Question: {query}
+
+    Please provide a clear, educational response based only on the context provided.
+    """
+
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_message}
+    ]
@@ -1,12 +1,44 @@
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
-from typing import List, Dict, Any
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterator, Optional, Sequence
 from config import Config
+from service_errors import IndexBusyError
+import caches
+import chunk_store
+import metrics
+import copy
+import re
+import threading
 import uuid
 import os
 
+SECTIONS_SUFFIX = "_sections"
+
+# Section count of each alias's live index, cleared with the alias's other caches when it flips
+_section_counts: Dict[str, caches.LRUCache] = {}
+_section_counts_lock = threading.Lock()
+
+def section_count_cache(alias: str) -> caches.LRUCache:
+    with _section_counts_lock:
+        if alias not in _section_counts:
+            _section_counts[alias] = caches.LRUCache(f"section_counts:{alias}", 1, index=alias)
+        return _section_counts[alias]
+
+def _try_lock(lock_file) -> bool:
+    try:
+        if os.name == "nt":
+            import msvcrt
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
 class QdrantService:
-    def __init__(self):
+    def __init__(self, collection_name: Optional[str] = None):
         # Try to use cloud Qdrant first, fall back to local if cloud is unavailable
         if Config.QDRANT_URL and Config.QDRANT_API_KEY:
             try:
@@ -15,18 +47,22 @@ class QdrantService:
                     api_key=Config.QDRANT_API_KEY,
                     timeout=60.0,  # Increase timeout to 60 seconds
                 )
-                self.collection_name = Config.QDRANT_COLLECTION_NAME
+                self.collection_name = collection_name or Config.QDRANT_COLLECTION_NAME
+                self.is_local = False
                 print("Using cloud Qdrant instance")
             except Exception as e:
                 print(f"Failed to connect to cloud Qdrant: {e}")
                 print("Falling back to local Qdrant instance")
                 self.client = QdrantClient(path=Config.LOCAL_QDRANT_PATH)
-                self.collection_name = Config.QDRANT_COLLECTION_NAME
+                self.collection_name = collection_name or Config.QDRANT_COLLECTION_NAME
+                self.is_local = True
         else:
             # Use local Qdrant instance
             self.client = QdrantClient(path=Config.LOCAL_QDRANT_PATH)
-            self.collection_name = Config.QDRANT_COLLECTION_NAME
+            self.collection_name = collection_name or Config.QDRANT_COLLECTION_NAME
+            self.is_local = True  # embedded storage: one client per path, no concurrent writers
             print("Using local Qdrant instance")
+        self.alias = self.collection_name
 
     def create_collection(self, vector_size: int = 1024):
         """
@@ -46,6 +82,63 @@ class QdrantService:
                 ),
             )
             print(f"Created collection {self.collection_name}")
+            if not self.is_local:  # the embedded store has no payload indexes
+                # Hierarchical search restricts chunk search to a few sources
+                # ("sources" lists every page of a collapsed duplicate chunk)
+                for field in ('source', 'sources'):
+                    try:
+                        self.client.create_payload_index(self.collection_name, field_name=field,
+                                                         field_schema=models.PayloadSchemaType.KEYWORD)
+                    except Exception as e:
+                        print(f"Could not index the {field} field of {self.collection_name}: {e}")
+
+    def upsert_sections(self, centroids: Dict[str, Any], chunk_counts: Dict[str, int]):
+        """
+        Store one centroid vector per source document, for coarse-to-fine search.
+
+        They go to "<collection>_sections", which is published, rolled back
+        and pruned together with the chunk collection.
+        """
+        if not centroids:
+            return
+        name = self.collection_name + SECTIONS_SUFFIX
+        if self.client.collection_exists(name):
+            self.client.delete_collection(name)
+        vectors = [list(map(float, v)) for v in centroids.values()]
+        self.client.create_collection(
+            collection_name=name,
+            vectors_config=models.VectorParams(size=len(vectors[0]), distance=models.Distance.COSINE),
+        )
+        sources = list(centroids)
+        for start in range(0, len(sources), 256):
+            batch = sources[start:start + 256]
+            self.client.upsert(
+                collection_name=name,
+                points=models.Batch(
+                    ids=[str(uuid.uuid5(uuid.NAMESPACE_URL, source)) for source in batch],
+                    vectors=vectors[start:start + len(batch)],
+                    payloads=[{'source': source, 'chunks': chunk_counts.get(source, 0)} for source in batch],
+                ),
+                wait=True,
+            )
+        print(f"Stored {len(sources)} section centroids in {name}")
+
+    def _payload(self, text: str, source: str, metadata: Dict[str, Any], chunk_id: str,
+                 sources: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        A point's payload: the full chunk, or with SLIM_PAYLOADS a reference into the version's chunk store
+
+        sources, when given, lists every page a collapsed duplicate chunk appears in.
+        """
+        if Config.SLIM_PAYLOADS and self.collection_name != self.alias:
+            # Only new versions go slim; their store is sealed when they are published
+            chunk = chunk_store.writer(self.collection_name).append(text, source, metadata)
+            payload = {'source': source, 'chunk_id': chunk_id, 'store': self.collection_name, 'chunk': chunk}
+        else:
+            payload = {'text': text, 'source': source, 'metadata': metadata, 'chunk_id': chunk_id}
+        if sources:
+            payload['sources'] = list(sources)
+        return payload
 
     def upsert_documents(self, documents: List[Dict[str, Any]]):
         """
@@ -62,12 +155,8 @@ class QdrantService:
             point = models.PointStruct(
                 id=doc_id,
                 vector=doc['embedding'],
-                payload={
-                    'text': doc['text'],
-                    'source': doc.get('source', ''),
-                    'metadata': doc.get('metadata', {}),
-                    'chunk_id': doc.get('chunk_id', ''),
-                }
+                payload=self._payload(doc['text'], doc.get('source', ''), doc.get('metadata', {}),
+                                      doc.get('chunk_id', ''), doc.get('sources'))
             )
             points.append(point)
 
@@ -76,6 +165,69 @@ class QdrantService:
             points=points
         )
 
+    def upsert_batch(self, ids: Sequence[str], vectors, payloads: Sequence[Dict[str, Any]]):
+        """
+        Upsert pre-embedded points in columnar form (e.g. from an index artifact)
+        """
+        self.client.upsert(
+            collection_name=self.collection_name,
+            points=models.Batch(
+                ids=list(ids),
+                vectors=vectors.tolist() if hasattr(vectors, 'tolist') else [list(v) for v in vectors],
+                payloads=[self._payload(p.get('text', ''), p.get('source', ''), p.get('metadata', {}),
+                                        p.get('chunk_id', ''), p.get('sources')) for p in payloads],
+            ),
+            wait=True,
+        )
+
+    def add_sources(self, extra_sources: Dict[str, List[str]]) -> Dict[str, List[float]]:
+        """
+        Add sources to existing points, whose chunks were also found in those pages.
+
+        The payload's "sources" lists the point's own source first. Returns
+        the points' vectors by id, so their other pages can count them too.
+        """
+        vectors: Dict[str, List[float]] = {}
+        ids = list(extra_sources)
+        for start in range(0, len(ids), 256):
+            records = self.client.retrieve(self.collection_name, ids[start:start + 256],
+                                           with_payload=['source', 'sources'], with_vectors=True)
+            operations = []
+            for record in records:
+                point_id = str(record.id)
+                sources = list(dict.fromkeys([record.payload['source'], *record.payload.get('sources', []),
+                                              *extra_sources[point_id]]))
+                operations.append(models.SetPayloadOperation(
+                    set_payload=models.SetPayload(payload={'sources': sources}, points=[record.id])
+                ))
+                vectors[point_id] = record.vector
+            if operations:
+                self.client.batch_update_points(self.collection_name, operations, wait=True)
+        return vectors
+
+    def iter_points(self, batch_size: int = 256) -> Iterator[Dict[str, Any]]:
+        """
+        Yield every point in the collection with its vector and full payload
+        """
+        offset: Optional[Any] = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            for point in points:
+                payload = point.payload
+                if 'store' in payload:
+                    stored = chunk_store.reader(payload['store']).get(payload['chunk'])
+                    payload = {**stored, 'chunk_id': payload.get('chunk_id', ''),
+                               **({'sources': payload['sources']} if 'sources' in payload else {})}
+                yield {'id': str(point.id), 'vector': point.vector, 'payload': payload}
+            if offset is None:
+                break
+
     def _is_valid_qdrant_id(self, id_val):
         """
         Check if the ID is a valid Qdrant ID (unsigned integer or UUID)
@@ -94,31 +246,284 @@ class QdrantService:
         except ValueError:
             return False
 
-    def search(self, query_vector: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
+    def search(self, query_vector: List[float], top_k: int = 5, with_text: bool = True) -> List[Dict[str, Any]]:
         """
         Search for similar documents based on the query vector
+
+        Hits from a slim-payload collection carry a chunk store reference
+        instead of their text; with_text=False leaves it to attach_texts(),
+        so a caller that drops some hits never reads their texts.
         """
-        search_results = self.client.query_points(
-            collection_name=self.collection_name,
-            query=query_vector,
-            limit=top_k,
-            with_payload=True,
-        )
+        with metrics.timed("search"):
+            try:
+                sources = self._top_sections(query_vector)
+                search_results = None
+                if sources:
+                    search_results = self.client.query_points(
+                        collection_name=self.collection_name,
+                        query=query_vector,
+                        query_filter=models.Filter(should=[
+                            models.FieldCondition(key='source', match=models.MatchAny(any=sources)),
+                            models.FieldCondition(key='sources', match=models.MatchAny(any=sources)),
+                        ]),
+                        limit=top_k,
+                        with_payload=True,
+                    )
+                    if len(search_results.points) < top_k:
+                        # The chosen sections are too small to fill top_k
+                        metrics.HIERARCHICAL_SEARCHES.inc(path="flat_few_hits")
+                        search_results = None
+                if search_results is None:
+                    search_results = self.client.query_points(
+                        collection_name=self.collection_name,
+                        query=query_vector,
+                        limit=top_k,
+                        with_payload=True,
+                    )
+            except Exception:
+                metrics.UPSTREAM_ERRORS.inc(upstream="qdrant")
+                raise
 
         results = []
         for result in search_results.points:
-            results.append({
-                'text': result.payload['text'],
-                'source': result.payload['source'],
-                'metadata': result.payload['metadata'],
-                'score': result.score,
-                'chunk_id': result.payload.get('chunk_id', ''),
-            })
+            payload = result.payload
+            if 'store' in payload:
+                hit = {
+                    'source': payload['source'],
+                    'score': result.score,
+                    'chunk_id': payload.get('chunk_id', ''),
+                    'store': payload['store'],
+                    'chunk': payload['chunk'],
+                }
+            else:
+                hit = {
+                    'text': payload['text'],
+                    'source': payload['source'],
+                    'metadata': payload['metadata'],
+                    'score': result.score,
+                    'chunk_id': payload.get('chunk_id', ''),
+                }
+            if 'sources' in payload:
+                hit['sources'] = payload['sources']
+            results.append(hit)
 
+        return self.attach_texts(results) if with_text else results
+
+    def _top_sections(self, query_vector: List[float]) -> Optional[List[str]]:
+        """
+        The sources of the HIERARCHICAL_TOP_SECTIONS sections closest to the query.
+
+        None means search every chunk: the feature is off, the index has no
+        sections or too few to be worth it, or the best section is too weak a
+        match to trust the shortlist.
+        """
+        mode = Config.HIERARCHICAL_SEARCH
+        top_sections = Config.HIERARCHICAL_TOP_SECTIONS
+        if mode == "off" or (mode == "auto" and self.is_local) or top_sections <= 0:
+            return None
+        counts = section_count_cache(self.alias)
+        count = counts.get(self.collection_name)
+        if count is None:
+            try:
+                count = self.client.count(self.collection_name + SECTIONS_SUFFIX, exact=True).count
+            except Exception:
+                count = 0  # built before sections existed, or from an artifact without them
+            counts.put(self.collection_name, count)
+        if count <= max(top_sections, Config.HIERARCHICAL_MIN_SECTIONS):
+            return None
+
+        hits = self.client.query_points(
+            collection_name=self.collection_name + SECTIONS_SUFFIX,
+            query=query_vector,
+            limit=top_sections,
+            with_payload=['source'],
+        ).points
+        if not hits or hits[0].score < Config.HIERARCHICAL_MIN_SCORE:
+            metrics.HIERARCHICAL_SEARCHES.inc(path="flat_low_confidence")
+            return None
+        metrics.HIERARCHICAL_SEARCHES.inc(path="sections")
+        return [hit.payload['source'] for hit in hits]
+
+    def attach_texts(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Fill in the text and metadata of hits that only reference the chunk store
+        """
+        for result in results:
+            if 'store' in result:
+                stored = chunk_store.reader(result.pop('store')).get(result.pop('chunk'))
+                result['text'], result['metadata'] = stored['text'], stored['metadata']
         return results
 
     def delete_collection(self):
         """
         Delete the entire collection (useful for re-indexing)
         """
-        self.client.delete_collection(self.collection_name)
\ No newline at end of file
+        self.client.delete_collection(self.collection_name)
+        if self.client.collection_exists(self.collection_name + SECTIONS_SUFFIX):
+            self.client.delete_collection(self.collection_name + SECTIONS_SUFFIX)
+        chunk_store.remove(self.collection_name)
+
+    # Versioned collections. The app always reads through an alias (by default
+    # QDRANT_COLLECTION_NAME) that points at one physical collection
+    # "<alias>_v<n>". A rebuild fills the next version while readers keep using
+    # the current one, then the alias is moved in a single atomic call.
+
+    def for_collection(self, alias: str) -> "QdrantService":
+        """
+        A service for another collection alias (e.g. another book) that shares this client
+        """
+        view = copy.copy(self)
+        view.alias = view.collection_name = alias
+        return view
+
+    def version_name(self, version: int) -> str:
+        return f"{self.alias}_v{version}"
+
+    def list_versions(self) -> List[int]:
+        pattern = re.compile(re.escape(self.alias) + r"_v(\d+)$")
+        versions = []
+        for collection in self.client.get_collections().collections:
+            match = pattern.match(collection.name)
+            if match:
+                versions.append(int(match.group(1)))
+        return sorted(versions)
+
+    def live_collection(self, alias: Optional[str] = None) -> Optional[str]:
+        """
+        The collection the alias points at (None before the first versioned build)
+        """
+        alias = alias or self.alias
+        for entry in self.client.get_aliases().aliases:
+            if entry.alias_name == alias:
+                return entry.collection_name
+        return None
+
+    def live_version(self) -> Optional[int]:
+        live = self.live_collection()
+        prefix = f"{self.alias}_v"
+        if live and live.startswith(prefix) and live[len(prefix):].isdigit():
+            return int(live[len(prefix):])
+        return None
+
+    def new_version(self) -> "QdrantService":
+        """
+        A service bound to a fresh, not yet live version; it shares this client
+        """
+        versions = self.list_versions()
+        builder = copy.copy(self)
+        builder.collection_name = self.version_name(versions[-1] + 1 if versions else 1)
+        return builder
+
+    def publish(self, collection_name: str) -> Dict[str, Any]:
+        """
+        Point the alias at collection_name, then drop versions older than the rollback target.
+
+        The first publish over an unversioned collection of the alias's name copies it to
+        version 0, then deletes it just before the alias call (see README for the brief gap).
+        """
+        chunk_store.seal(collection_name)
+        previous = self.live_collection()
+        alias = self.alias
+        sections_alias = alias + SECTIONS_SUFFIX
+        unversioned = []
+        if previous is None and self.client.collection_exists(alias):
+            # One-time migration: an alias can't share its name with a real collection. Keep the
+            # old data as version 0 (a rollback target) before the real collection makes way
+            unversioned.append(alias)
+            self._copy_collection(alias, self.version_name(0))
+            if self.live_collection(sections_alias) is None and self.client.collection_exists(sections_alias):
+                unversioned.append(sections_alias)
+                self._copy_collection(sections_alias, self.version_name(0) + SECTIONS_SUFFIX)
+        operations = []
+        if previous is not None:
+            operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+        operations.append(models.CreateAliasOperation(
+            create_alias=models.CreateAlias(collection_name=collection_name, alias_name=alias)
+        ))
+        # The section centroids move with their chunks, in the same atomic call
+        if self.live_collection(sections_alias) is not None:
+            operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=sections_alias)))
+        if self.client.collection_exists(collection_name + SECTIONS_SUFFIX):
+            operations.append(models.CreateAliasOperation(
+                create_alias=models.CreateAlias(collection_name=collection_name + SECTIONS_SUFFIX,
+                                                alias_name=sections_alias)
+            ))
+        # Qdrant's alias call can't delete a collection, so the migration has a short gap: searches
+        # between these deletes and the alias call fail. Everything else is prepared beforehand
+        for name in unversioned:
+            print(f"Replacing the unversioned collection {name} with an alias")
+            self.client.delete_collection(name)
+        self.client.update_collection_aliases(change_aliases_operations=operations)
+        caches.clear_index_caches(self.alias)
+        print(f"Alias {alias} now points at {collection_name} (was {previous})")
+
+        self.prune_versions()
+        return {'alias': alias, 'collection_name': collection_name, 'previous': previous}
+
+    def _copy_collection(self, source: str, target: str, batch_size: int = 256):
+        """
+        Copy every point of collection source into a new collection target
+        """
+        builder = copy.copy(self)
+        builder.collection_name = target
+        builder.create_collection(vector_size=self.client.get_collection(source).config.params.vectors.size)
+        offset: Optional[Any] = None
+        while True:
+            points, offset = self.client.scroll(collection_name=source, limit=batch_size, offset=offset,
+                                                with_payload=True, with_vectors=True)
+            if points:
+                self.client.upsert(target, points=[
+                    models.PointStruct(id=point.id, vector=point.vector, payload=point.payload) for point in points
+                ])
+            if offset is None:
+                break
+        print(f"Copied {source} to {target}")
+
+    @contextmanager
+    def writer_lock(self) -> Iterator[None]:
+        """
+        Hold the right to build or publish a version of this alias, across all worker processes.
+
+        A file lock in INDEX_LOCK_DIR, which the OS releases if the holder dies.
+        Raises IndexBusyError at once when another request or process holds it.
+        """
+        directory = Config.INDEX_LOCK_DIR or os.path.join(Config.LOCAL_QDRANT_PATH, "locks")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{self.alias}.lock"), "a") as lock_file:
+            if not _try_lock(lock_file):
+                raise IndexBusyError(f"Index {self.alias} is already being written")
+            yield  # closing the file releases the lock
+
+    def rollback(self) -> Dict[str, Any]:
+        """
+        Point the alias back at the newest version older than the live one
+        """
+        live = self.live_version()
+        older = [v for v in self.list_versions() if live is not None and v < live]
+        if not older:
+            raise ValueError("No previous index version to roll back to")
+        return self.publish(self.version_name(older[-1]))
+
+    def prune_versions(self, keep: int = Config.INDEX_VERSIONS_KEPT):
+        """
+        Delete versions older than the live one and the keep - 1 before it.
+
+        Versions newer than the live one are left alone: they may be builds in progress.
+        """
+        live = self.live_version()
+        if live is None:
+            return
+        older = [v for v in self.list_versions() if v < live]
+        for version in older[:max(0, len(older) - (keep - 1))]:
+            self.client.delete_collection(self.version_name(version))
+            if self.client.collection_exists(self.version_name(version) + SECTIONS_SUFFIX):
+                self.client.delete_collection(self.version_name(version) + SECTIONS_SUFFIX)
+            chunk_store.remove(self.version_name(version))
+            print(f"Deleted old index version {self.version_name(version)}")
+
+    def index_status(self) -> Dict[str, Any]:
+        return {
+            'alias': self.alias,
+            'live_collection': self.live_collection(),
+            'versions': [self.version_name(v) for v in self.list_versions()],
+        }
\ No newline at end of file
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Precomputed "related sections" graph, served without any query-time search.
+
+After an ingestion, every chunk vector of a book is compared with every other
+one in blocked NumPy matmuls. The N closest chunks from other documents are
+kept for each chunk, and the N closest documents (by mean chunk vector) for
+each document. The graph is stored under RELATED_DIR/<collection alias>/ as:
+
+    g<n>/chunk_neighbors.npy   int32  [chunks, N], -1 = no neighbour
+    g<n>/chunk_scores.npy      float16 [chunks, N]
+    g<n>/doc_neighbors.npy     int32  [documents, N]
+    g<n>/doc_scores.npy        float16 [documents, N]
+    g<n>/meta.json             sources, chunk keys and vector hashes, chunk -> document
+    CURRENT                    the live generation n
+
+A rebuild reuses the previous generation. Only rows that involve a new,
+changed or removed chunk are recomputed. The arrays are memory-mapped by
+GET /related. Each generation records the collection version it was built
+from. The two newest are kept, so an index rollback can make the previous
+graph current again (see follow_live_collection).
+
+    python related_sections.py build                 # the default book
+    python related_sections.py build --book controls --full
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+
+ARRAYS = ('chunk_neighbors', 'chunk_scores', 'doc_neighbors', 'doc_scores')
+
+def chunk_key(payload: Dict[str, Any], point_id: str) -> str:
+    """
+    A name for a chunk that survives re-indexing (point ids may not)
+    """
+    if payload.get('chunk_id'):
+        return payload['chunk_id']
+    index = payload.get('metadata', {}).get('chunk_index')
+    return f"{payload.get('source', '')}#{index}" if index is not None else point_id
+
+def vector_hash(vector: np.ndarray) -> str:
+    return hashlib.blake2b(np.ascontiguousarray(vector, dtype=np.float32).tobytes(), digest_size=8).hexdigest()
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def block_rows(columns: int, budget_bytes: int = 64 << 20) -> int:
+    """
+    Rows per matmul block so one float32 score block stays within budget_bytes
+    """
+    return max(1, min(4096, budget_bytes // max(1, columns * 4)))
+
+def nearest(candidates: np.ndarray, candidate_groups: np.ndarray, queries: np.ndarray, query_groups: np.ndarray,
+            rows: np.ndarray, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    For each of queries[rows], the top_n closest candidates outside its own group, best first.
+
+    Returns (candidate indices, scores), padded with -1 / 0 when there are
+    fewer than top_n candidates in other groups.
+    """
+    neighbors = np.full((len(rows), top_n), -1, dtype=np.int32)
+    scores = np.zeros((len(rows), top_n), dtype=np.float16)
+    k = min(top_n, len(candidates))
+    if not len(rows) or not k:
+        return neighbors, scores
+    step = block_rows(len(candidates))
+    for start in range(0, len(rows), step):
+        block = rows[start:start + step]
+        similarity = queries[block] @ candidates.T
+        # Chunks of the same document (or the document itself) are not "related"
+        similarity[query_groups[block][:, None] == candidate_groups[None, :]] = -np.inf
+        best = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(similarity, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best, best_scores = np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+        valid = np.isfinite(best_scores)
+        neighbors[start:start + len(block), :k] = np.where(valid, best, -1)
+        scores[start:start + len(block), :k] = np.where(valid, best_scores, 0)
+    return neighbors, scores
+
+def merge_neighbors(neighbors: np.ndarray, scores: np.ndarray, extra_neighbors: np.ndarray,
+                    extra_scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Row-wise union of two neighbour lists, keeping the best of both
+    """
+    top_n = neighbors.shape[1]
+    all_neighbors = np.concatenate([neighbors, extra_neighbors], axis=1)
+    all_scores = np.concatenate([scores, extra_scores], axis=1).astype(np.float32)
+    all_scores[all_neighbors < 0] = -np.inf
+    order = np.argsort(-all_scores, axis=1)[:, :top_n]
+    merged = np.take_along_axis(all_neighbors, order, axis=1)
+    merged_scores = np.take_along_axis(all_scores, order, axis=1)
+    missing = ~np.isfinite(merged_scores)
+    return np.where(missing, -1, merged).astype(np.int32), np.where(missing, 0, merged_scores).astype(np.float16)
+
+def document_graph(vectors: np.ndarray, chunk_docs: np.ndarray, documents: int, top_n: int):
+    centroids = np.zeros((documents, vectors.shape[1]), dtype=np.float32)
+    np.add.at(centroids, chunk_docs, vectors)
+    centroids = normalize(centroids)
+    documents_range = np.arange(documents)
+    return nearest(centroids, documents_range, centroids, documents_range, documents_range, top_n)
+
+class RelatedGraph:
+    """
+    One generation of the graph, memory-mapped read-only
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        for name in ARRAYS + ('chunk_docs',):
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+        self.sources: List[str] = self.meta['sources']
+        self.keys: List[str] = self.meta['keys']
+        self._doc_index = {source: i for i, source in enumerate(self.sources)}
+
+    def related(self, source: str, limit: int = 5, chunks: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        The documents closest to source and, optionally, the closest passages to each of its chunks
+        """
+        doc = self._doc_index.get(source)
+        if doc is None:
+            return None
+        result: Dict[str, Any] = {'source': source, 'related': [
+            {'source': self.sources[n], 'score': round(float(s), 3)}
+            for n, s in zip(self.doc_neighbors[doc][:limit], self.doc_scores[doc][:limit]) if n >= 0
+        ]}
+        if chunks:
+            rows = np.flatnonzero(np.asarray(self.chunk_docs) == doc)
+            result['chunks'] = [{
+                'chunk_id': self.keys[row],
+                'related': [
+                    {'chunk_id': self.keys[n], 'source': self.sources[self.chunk_docs[n]], 'score': round(float(s), 3)}
+                    for n, s in zip(self.chunk_neighbors[row][:limit], self.chunk_scores[row][:limit]) if n >= 0
+                ],
+            } for row in rows]
+        return result
+
+def graph_root(alias: str, root: Optional[str] = None) -> str:
+    return os.path.join(root or Config.RELATED_DIR, alias)
+
+def current_generation(alias: str, root: Optional[str] = None) -> Optional[int]:
+    try:
+        with open(os.path.join(graph_root(alias, root), "CURRENT"), encoding="utf-8") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def generations(alias: str, root: Optional[str] = None) -> List[int]:
+    try:
+        names = os.listdir(graph_root(alias, root))
+    except OSError:
+        return []
+    return sorted(int(name[1:]) for name in names if name.startswith("g") and name[1:].isdigit())
+
+def set_current(alias: str, generation: int, root: Optional[str] = None):
+    base = graph_root(alias, root)
+    tmp = os.path.join(base, "CURRENT.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(str(generation))
+    os.replace(tmp, os.path.join(base, "CURRENT"))
+
+def load(alias: str, root: Optional[str] = None) -> Optional[RelatedGraph]:
+    generation = current_generation(alias, root)
+    if generation is None:
+        return None
+    return RelatedGraph(os.path.join(graph_root(alias, root), f"g{generation}"))
+
+def read_points(qdrant_service) -> Tuple[List[str], List[str], np.ndarray]:
+    """
+    (chunk keys, sources, vectors) of every point in the live collection, in a stable order
+    """
+    rows = []
+    for point in qdrant_service.iter_points():
+        payload = point['payload']
+        rows.append((chunk_key(payload, point['id']), payload.get('source', ''), point['vector']))
+    rows.sort(key=lambda row: (row[1], row[0]))
+    vectors = np.asarray([row[2] for row in rows], dtype=np.float32).reshape(len(rows), -1)
+    return [row[0] for row in rows], [row[1] for row in rows], vectors
+
+def build(keys: List[str], sources: List[str], vectors: np.ndarray, previous: Optional[RelatedGraph] = None,
+          top_n: int = Config.RELATED_TOP_N) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    The graph arrays and metadata for these chunks, reusing previous where nothing changed
+    """
+    vectors = normalize(np.asarray(vectors, dtype=np.float32))
+    hashes = [vector_hash(v) for v in vectors]
+    doc_sources = sorted(set(sources))
+    doc_index = {source: i for i, source in enumerate(doc_sources)}
+    chunk_docs = np.asarray([doc_index[s] for s in sources], dtype=np.int32)
+    everything = np.arange(len(keys))
+
+    # Old row -> new row for chunks whose key and vector are unchanged
+    reused = None
+    if previous is not None and previous.meta.get('top_n') == top_n:
+        old_rows = {(k, h): i for i, (k, h) in enumerate(zip(previous.keys, previous.meta['hashes']))}
+        old_to_new = np.full(len(previous.keys) + 1, -1, dtype=np.int64)  # the extra slot maps -1 to -1
+        for new_row, pair in enumerate(zip(keys, hashes)):
+            if pair in old_rows:
+                old_to_new[old_rows[pair]] = new_row
+        kept_new = old_to_new[:-1][old_to_new[:-1] >= 0]
+        if len(kept_new) >= len(keys) / 2:
+            reused = (old_to_new, kept_new)
+
+    if reused is None:
+        chunk_neighbors, chunk_scores = nearest(vectors, chunk_docs, vectors, chunk_docs, everything, top_n)
+        recomputed = len(keys)
+    else:
+        old_to_new, kept_new = reused
+        chunk_neighbors = np.full((len(keys), top_n), -1, dtype=np.int32)
+        chunk_scores = np.zeros((len(keys), top_n), dtype=np.float16)
+        kept_old = np.flatnonzero(old_to_new[:-1] >= 0)
+        mapped = old_to_new[np.asarray(previous.chunk_neighbors)[kept_old]]
+        # A kept row whose list lost a neighbour (removed or changed) is recomputed in full
+        lost = ((mapped < 0) & (np.asarray(previous.chunk_neighbors)[kept_old] >= 0)).any(axis=1)
+        clean_new, clean_old = kept_new[~lost], kept_old[~lost]
+        chunk_neighbors[clean_new] = old_to_new[np.asarray(previous.chunk_neighbors)[clean_old]]
+        chunk_scores[clean_new] = np.asarray(previous.chunk_scores)[clean_old]
+
+        is_clean = np.zeros(len(keys), dtype=bool)
+        is_clean[clean_new] = True
+        fresh = np.flatnonzero(~is_clean)
+        is_new = np.ones(len(keys), dtype=bool)
+        is_new[kept_new] = False
+        added = np.flatnonzero(is_new)
+        # Clean rows only need the added chunks as new candidates
+        if len(added) and len(clean_new):
+            sub_neighbors, sub_scores = nearest(vectors[added], chunk_docs[added], vectors, chunk_docs, clean_new, top_n)
+            sub_neighbors = np.where(sub_neighbors >= 0, added[np.maximum(sub_neighbors, 0)], -1).astype(np.int32)
+            chunk_neighbors[clean_new], chunk_scores[clean_new] = merge_neighbors(
+                chunk_neighbors[clean_new], chunk_scores[clean_new], sub_neighbors, sub_scores)
+        chunk_neighbors[fresh], chunk_scores[fresh] = nearest(vectors, chunk_docs, vectors, chunk_docs, fresh, top_n)
+        recomputed = len(fresh)
+
+    doc_neighbors, doc_scores = document_graph(vectors, chunk_docs, len(doc_sources), top_n)
+    arrays = {'chunk_neighbors': chunk_neighbors, 'chunk_scores': chunk_scores,
+              'doc_neighbors': doc_neighbors, 'doc_scores': doc_scores, 'chunk_docs': chunk_docs}
+    meta = {'top_n': top_n, 'sources': doc_sources, 'keys': keys, 'hashes': hashes,
+            'chunks': len(keys), 'recomputed_rows': recomputed}
+    return arrays, meta
+
+def save(alias: str, arrays: Dict[str, np.ndarray], meta: Dict[str, Any], root: Optional[str] = None) -> int:
+    """
+    Write a new generation and make it current; all but the newest older one are removed
+    """
+    base = graph_root(alias, root)
+    os.makedirs(base, exist_ok=True)
+    # Numbers are never reused (after a rollback CURRENT is not the newest), so ETags stay unique
+    existing = generations(alias, root)
+    generation = max(existing + [current_generation(alias, root) or 0]) + 1
+    directory = os.path.join(base, f"g{generation}")
+    os.makedirs(directory)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), array)
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    set_current(alias, generation, root)
+    # Readers that still map an older generation keep their (unlinked) files
+    for old in existing[:-1]:
+        shutil.rmtree(os.path.join(base, f"g{old}"), ignore_errors=True)
+    return generation
+
+def update(qdrant_service, full: bool = False, top_n: int = Config.RELATED_TOP_N,
+           root: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Rebuild the related-sections graph of qdrant_service's collection alias
+    """
+    start = time.perf_counter()
+    alias = qdrant_service.alias
+    keys, sources, vectors = read_points(qdrant_service)
+    previous = None if full else load(alias, root)
+    arrays, meta = build(keys, sources, vectors, previous, top_n)
+    meta['collection'] = qdrant_service.live_collection() if hasattr(qdrant_service, 'live_collection') else None
+    generation = save(alias, arrays, meta, root)
+    summary = {'alias': alias, 'generation': generation, 'chunks': meta['chunks'], 'documents': len(meta['sources']),
+               'recomputed_rows': meta['recomputed_rows'], 'seconds': round(time.perf_counter() - start, 2)}
+    print(f"Related sections for {alias}: {summary}")
+    return summary
+
+def follow_live_collection(qdrant_service, root: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    After an index rollback, make the graph of the collection the alias now points at current.
+
+    Reuses a kept generation built from that collection, otherwise rebuilds.
+    Aliases that never had a graph are left without one.
+    """
+    alias = qdrant_service.alias
+    current = current_generation(alias, root)
+    if current is None:
+        return None
+    live = qdrant_service.live_collection()
+    for generation in reversed(generations(alias, root)):
+        try:
+            with open(os.path.join(graph_root(alias, root), f"g{generation}", "meta.json"), encoding="utf-8") as f:
+                collection = json.load(f).get('collection')
+        except (OSError, ValueError):
+            continue
+        if collection == live:
+            if generation != current:
+                set_current(alias, generation, root)
+                print(f"Related sections for {alias}: back to generation {generation} ({live})")
+            return {'alias': alias, 'generation': generation, 'rebuilt': False}
+    return {**update(qdrant_service, root=root), 'rebuilt': True}
+
+class RelatedGraphs:
+    """
+    The current graph of each alias, reloaded when a rebuild makes a new generation current
+    """
+
+    def __init__(self, root: Optional[str] = None, check_seconds: float = 1.0):
+        self.root = root
+        self.check_seconds = check_seconds
+        self._graphs: Dict[str, Tuple[int, RelatedGraph]] = {}
+        self._checked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, alias: str) -> Optional[Tuple[int, RelatedGraph]]:
+        """
+        (generation, graph) for alias, or None before the first build
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._graphs.get(alias)
+            if cached is not None and now - self._checked.get(alias, 0) < self.check_seconds:
+                return cached
+            self._checked[alias] = now
+        generation = current_generation(alias, self.root)
+        if generation is None:
+            return None
+        if cached is None or cached[0] != generation:
+            cached = (generation, RelatedGraph(os.path.join(graph_root(alias, self.root), f"g{generation}")))
+            with self._lock:
+                self._graphs[alias] = cached
+        return cached
+
+def main(argv: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Precompute the related-sections graph of a book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_command = commands.add_parser("build", help="rebuild from the live collection")
+    build_command.add_argument("--book", help="registered book id (default: DEFAULT_BOOK)")
+    build_command.add_argument("--full", action="store_true", help="recompute every row instead of reusing the last graph")
+    build_command.add_argument("--top-n", type=int, default=Config.RELATED_TOP_N)
+    args = parser.parse_args(argv)
+
+    from index_artifact import book_index
+    update(book_index(args.book), full=args.full, top_n=args.top_n)
+
+if __name__ == "__main__":
+    main()
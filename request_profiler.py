@@ -0,0 +1,200 @@
+"""
+On-demand sampling profiler for single requests.
+
+While a profiled request runs, a background thread samples the stack of every
+thread every few milliseconds. Pipeline stages run in worker threads
+(asyncio.to_thread), so sampling all threads catches Pydantic validation and
+JSON encoding on the event loop as well as the Cohere/Qdrant/OpenRouter client
+code. Concurrent requests on the same worker show up too, so profile a quiet
+replica when the numbers matter. Only one request is profiled at a time.
+
+Each profile is written to PROFILE_DIR as two files:
+
+    <id>.collapsed   "frame;frame;frame count" lines for flamegraph.pl / speedscope
+    <id>.json        duration, sample count and a pstats-style top-functions table
+
+and the directory is kept to the newest PROFILE_MAX_FILES profiles.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from config import Config
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """
+    Samples every thread's stack on an interval until stopped
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self.started = 0.0
+        self.duration = 0.0
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                # Idle worker threads and the idle loop waiting on selectors are noise
+                if stack and stack[0].startswith(("wait (threading.py", "_worker (thread.py", "select (selectors.py")):
+                    continue
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit: int = 25) -> List[Dict[str, Any]]:
+        """
+        Self and cumulative sample counts per function, like pstats sorted by tottime
+        """
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]  # drop the thread name
+            if not frames:
+                continue
+            self_counts[frames[-1]] += count
+            for label in set(frames):
+                total_counts[label] += count
+        seconds = self.interval
+        return [
+            {
+                'function': label,
+                'self_samples': count,
+                'total_samples': total_counts[label],
+                'self_seconds': round(count * seconds, 4),
+                'total_seconds': round(total_counts[label] * seconds, 4),
+            }
+            for label, count in self_counts.most_common(limit)
+        ]
+
+class ProfileStore:
+    """
+    A bounded ring of profiles on disk: the oldest are deleted beyond max_profiles
+    """
+
+    def __init__(self, directory: str = Config.PROFILE_DIR, max_profiles: int = Config.PROFILE_MAX_FILES):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def save(self, profiler: SamplingProfiler, info: Dict[str, Any]) -> str:
+        now = time.time()
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(now))}.{int(now % 1 * 1e6):06d}-{uuid.uuid4().hex[:6]}"
+        summary = {
+            'id': profile_id,
+            **info,
+            'duration_ms': round(profiler.duration * 1000, 1),
+            'samples': profiler.samples,
+            'interval_ms': profiler.interval * 1000,
+            'top_functions': profiler.top_functions(),
+        }
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f"{profile_id}.collapsed"), "w", encoding="utf-8") as f:
+                f.write(profiler.collapsed())
+            with open(os.path.join(self.directory, f"{profile_id}.json"), "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2)
+            self._trim()
+        return profile_id
+
+    def _trim(self):
+        ids = self._ids()
+        for stale in ids[:-self.max_profiles] if self.max_profiles > 0 else ids:
+            for suffix in (".collapsed", ".json"):
+                try:
+                    os.remove(os.path.join(self.directory, stale + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def _ids(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        # Ids start with a timestamp, so name order is age order
+        return sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith(".json"))
+
+    def list(self) -> List[Dict[str, Any]]:
+        profiles = []
+        for profile_id in reversed(self._ids()):
+            summary = self.get(profile_id)
+            if summary:
+                summary['top_functions'] = summary['top_functions'][:5]
+                profiles.append(summary)
+        return profiles
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self.directory, f"{os.path.basename(profile_id)}.json")
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def collapsed_path(self, profile_id: str) -> Optional[str]:
+        path = os.path.join(self.directory, f"{os.path.basename(profile_id)}.collapsed")
+        return path if os.path.exists(path) else None
+
+class RequestProfiler:
+    """
+    Decides which requests to profile and runs the sampler around them
+    """
+
+    def __init__(self, sample_rate: float = Config.PROFILE_SAMPLE_RATE, store: Optional[ProfileStore] = None,
+                 interval: float = Config.PROFILE_INTERVAL_MS / 1000.0):
+        self.sample_rate = sample_rate
+        self.store = store or ProfileStore()
+        self.interval = interval
+        self._busy = threading.Lock()
+
+    def should_profile(self, requested: bool) -> bool:
+        return requested or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def begin(self) -> Optional[SamplingProfiler]:
+        """
+        Start a profile, or return None if another request is being profiled
+        """
+        if not self._busy.acquire(blocking=False):
+            return None
+        profiler = SamplingProfiler(self.interval)
+        profiler.start()
+        return profiler
+
+    def finish(self, profiler: SamplingProfiler, info: Dict[str, Any]) -> str:
+        try:
+            profiler.stop()
+        finally:
+            self._busy.release()
+        return self.store.save(profiler, info)
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark and load-test suite
+
+Runs without network access: Cohere, Qdrant and OpenRouter are replaced by the
+stand-ins in stand_in_services.py, with configurable latency distributions and
+rate limits. Results are written as JSON so runs can be compared across commits.
+
+    python run_benchmarks.py                                   # all benchmarks
+    python run_benchmarks.py chunking retrieval                # a subset
+    python run_benchmarks.py parsing --parse-workers 8         # process-pool parsing of a 10k-file tree
+    python run_benchmarks.py load --concurrency 32 --requests 500 --llm-latency lognormal:800:4000
+    python run_benchmarks.py load --url http://localhost:8000  # against a running server
+    python run_benchmarks.py load --cassette cassettes/upstream.jsonl.gz --replay-speed 0   # recorded traffic
+    python run_benchmarks.py --compare bench_results/old.json  # print deltas against an earlier run
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from stand_in_services import StandInEmbeddingService, StandInLLMService, StandInQdrantService
+
+TOPICS = ["humanoid", "actuator", "ROS 2", "perception", "locomotion", "gripper", "simulation",
+          "reinforcement learning", "kinematics", "sensor fusion", "Isaac Sim", "navigation"]
+VERBS = ["controls", "estimates", "publishes", "simulates", "stabilizes", "plans", "detects", "calibrates"]
+OBJECTS = ["joint torques", "the center of mass", "camera frames", "a lidar scan", "the walking gait",
+           "contact forces", "the robot's pose", "a URDF model", "motor commands", "the policy network"]
+
+QUESTIONS = [f"How does the {topic} module work?" for topic in TOPICS] + \
+            [f"What {verb} {obj}?" for verb in VERBS[:4] for obj in OBJECTS[:4]]
+
+def synthetic_sentence(rng: random.Random) -> str:
+    return f"The {rng.choice(TOPICS)} node {rng.choice(VERBS)} {rng.choice(OBJECTS)} in real time."
+
+def synthetic_markdown(rng: random.Random, paragraphs: int = 6) -> str:
+    lines = [f"# {rng.choice(TOPICS).title()}", ""]
+    for _ in range(paragraphs):
+        lines.append(" ".join(synthetic_sentence(rng) for _ in range(rng.randint(3, 8))))
+        lines.append("")
+    return "\n".join(lines)
+
+def write_synthetic_corpus(directory: str, files: int, seed: int = 0) -> str:
+    """
+    Write `files` markdown files into nested chapter folders
+    """
+    rng = random.Random(seed)
+    root = Path(directory)
+    for i in range(files):
+        chapter = root / f"chapter-{i // 50:03d}"
+        chapter.mkdir(parents=True, exist_ok=True)
+        (chapter / f"section-{i:05d}.md").write_text(synthetic_markdown(rng), encoding="utf-8")
+    return str(root)
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    """
+    Latency percentiles in milliseconds
+    """
+    if not latencies:
+        return {'count': 0}
+    values = np.asarray(latencies) * 1000.0
+    return {
+        'count': int(values.size),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'max_ms': round(float(values.max()), 3),
+    }
+
+def bench_chunking(args) -> Dict[str, Any]:
+    from document_service import DocumentService
+
+    rng = random.Random(args.seed)
+    texts = [synthetic_markdown(rng, paragraphs=12) for _ in range(args.documents)]
+    service = DocumentService(embedding_service=StandInEmbeddingService(), qdrant_service=StandInQdrantService())
+
+    latencies = []
+    chunks = 0
+    start = time.perf_counter()
+    for text in texts:
+        t = time.perf_counter()
+        chunks += len(service.chunk_text(text))
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+
+    total_bytes = sum(len(t) for t in texts)
+    return {
+        'documents': len(texts),
+        'chunks': chunks,
+        'docs_per_second': round(len(texts) / elapsed, 1),
+        'mb_per_second': round(total_bytes / elapsed / 1e6, 2),
+        'per_document': summarize(latencies),
+    }
+
+def bench_parsing(args) -> Dict[str, Any]:
+    """
+    Parse and chunk a synthetic docs tree in-process, then with the process pool
+    """
+    from doc_parsing import parse_directory
+
+    # parse_directory never runs more processes than there are cores
+    workers = min(args.parse_workers or os.cpu_count() or 1, os.cpu_count() or 1)
+    with tempfile.TemporaryDirectory() as directory:
+        write_synthetic_corpus(directory, args.parse_files, seed=args.seed)
+        timings, outputs = {}, {}
+        for name, count in (('serial', 1), ('parallel', workers)):
+            start = time.perf_counter()
+            outputs[name] = list(parse_directory(directory, workers=count, min_files=0))
+            timings[name] = time.perf_counter() - start
+
+    # Same documents and chunks in the same order, whatever the worker count
+    assert outputs['serial'] == outputs['parallel'], "parallel parsing changed the output"
+    return {
+        'files': args.parse_files,
+        'workers': workers,
+        'chunks': sum(len(chunks) for _, chunks in outputs['serial']),
+        'serial_seconds': round(timings['serial'], 3),
+        'parallel_seconds': round(timings['parallel'], 3),
+        'serial_files_per_second': round(args.parse_files / timings['serial'], 1),
+        'parallel_files_per_second': round(args.parse_files / timings['parallel'], 1),
+        'speedup': round(timings['serial'] / timings['parallel'], 2),
+    }
+
+def bench_ingestion(args) -> Dict[str, Any]:
+    from document_service import DocumentService
+
+    embedding = StandInEmbeddingService(latency=args.embed_latency, rate_limit=args.embed_rate_limit, seed=args.seed)
+    qdrant = StandInQdrantService(latency=args.search_latency, seed=args.seed)
+    service = DocumentService(embedding_service=embedding, qdrant_service=qdrant)
+
+    original = Config.INGEST_BATCH_SIZE, Config.INGEST_BATCH_DELAY_SECONDS
+    Config.INGEST_BATCH_SIZE, Config.INGEST_BATCH_DELAY_SECONDS = args.batch_size, 0
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            write_synthetic_corpus(directory, args.files, seed=args.seed)
+            start = time.perf_counter()
+            result = service.ingest_documents(directory)
+            elapsed = time.perf_counter() - start
+    finally:
+        Config.INGEST_BATCH_SIZE, Config.INGEST_BATCH_DELAY_SECONDS = original
+
+    return {
+        'files': args.files,
+        'chunks': result['chunks_created'],
+        'embedding_calls': embedding.calls,
+        'seconds': round(elapsed, 3),
+        'chunks_per_second': round(result['chunks_created'] / elapsed, 1),
+    }
+
+def build_index(args, qdrant: StandInQdrantService) -> int:
+    from document_service import DocumentService
+
+    rng = random.Random(args.seed)
+    service = DocumentService(embedding_service=StandInEmbeddingService(), qdrant_service=qdrant)
+    chunks = []
+    while len(chunks) < args.index_size:
+        chunks.extend(service.chunk_text(synthetic_markdown(rng)))
+    chunks = chunks[:args.index_size]
+    embeddings = service.embedding_service.embed_texts(chunks)
+    qdrant.upsert_documents([
+        {'id': str(i), 'text': text, 'source': f"section-{i // 10:05d}.md", 'embedding': embedding}
+        for i, (text, embedding) in enumerate(zip(chunks, embeddings))
+    ])
+    return len(chunks)
+
+def bench_retrieval(args) -> Dict[str, Any]:
+    embedding = StandInEmbeddingService(latency=args.embed_latency, seed=args.seed)
+    qdrant = StandInQdrantService(latency=args.search_latency, seed=args.seed)
+    indexed = build_index(args, qdrant)
+
+    rng = random.Random(args.seed)
+    embed_latencies, search_latencies = [], []
+    for _ in range(args.queries):
+        question = rng.choice(QUESTIONS)
+        t = time.perf_counter()
+        vector = embedding.embed_query(question)
+        embed_latencies.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        qdrant.search(vector, top_k=Config.TOP_K)
+        search_latencies.append(time.perf_counter() - t)
+
+    return {
+        'indexed_chunks': indexed,
+        'embed': summarize(embed_latencies),
+        'search': summarize(search_latencies),
+    }
+
+async def _load(args, client, question_pool: List[str] = QUESTIONS) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    questions = [rng.choice(question_pool) for _ in range(args.requests)]
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    for question in questions:
+        queue.put_nowait(question)
+
+    async def worker(user: int):
+        # Each worker is a separate client, so per-client rate limits apply as they would in production
+        headers = {"X-Forwarded-For": f"10.0.{user // 256}.{user % 256}"}
+        while True:
+            try:
+                question = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            t = time.perf_counter()
+            try:
+                response = await client.post("/chat", json={"message": question}, headers=headers)
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - t)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(user) for user in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': len(questions),
+        'concurrency': args.concurrency,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(questions) / elapsed, 2),
+        'latency': summarize(latencies),
+        'status_codes': statuses,
+    }
+
+async def _load_in_process(args) -> Dict[str, Any]:
+    import httpx
+    import main
+    from books import BookRegistry
+    from service_container import ServiceContainer
+
+    question_pool = QUESTIONS
+    if args.cassette:
+        # Replay recorded Cohere/Qdrant/OpenRouter traffic, asking the recorded questions
+        from upstream_cassette import get_cassette, replay_service
+        main.app.state.services = ServiceContainer(**{
+            name: replay_service(name, args.cassette, args.replay_speed)
+            for name in ('embedding_service', 'qdrant_service', 'llm_service')
+        })
+        question_pool = get_cassette(args.cassette, load=True).recorded_queries() or QUESTIONS
+    else:
+        qdrant = StandInQdrantService(latency=args.search_latency, rate_limit=args.search_rate_limit, seed=args.seed)
+        build_index(args, qdrant)
+        main.app.state.services = ServiceContainer(
+            embedding_service=StandInEmbeddingService(latency=args.embed_latency, rate_limit=args.embed_rate_limit, seed=args.seed),
+            qdrant_service=qdrant,
+            llm_service=StandInLLMService(latency=args.llm_latency, token_latency_ms=args.llm_token_latency,
+                                          rate_limit=args.llm_rate_limit, seed=args.seed),
+        )
+
+    # The question pool is small, so cached answers would measure the cache rather than the pipeline
+    Config.ANSWER_CACHE_SIZE = 0
+    main.app.state.books = BookRegistry(path=None)
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            results = await _load(args, client, question_pool)
+    embedding = main.app.state.services.embedding_service
+    if hasattr(embedding, 'calls'):
+        # Fewer calls than requests means query embeddings were batched
+        results['embed_calls'] = embedding.calls
+    return results
+
+async def _load_remote(args) -> Dict[str, Any]:
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=120, limits=limits) as client:
+        return await _load(args, client)
+
+def bench_load(args) -> Dict[str, Any]:
+    return asyncio.run(_load_remote(args) if args.url else _load_in_process(args))
+
+BENCHMARKS = {
+    'chunking': bench_chunking,
+    'parsing': bench_parsing,
+    'ingestion': bench_ingestion,
+    'retrieval': bench_retrieval,
+    'load': bench_load,
+}
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+def flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def compare(current: Dict[str, Any], baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nComparison against {baseline_path} (commit {baseline.get('commit')}):")
+    old, new = flatten(baseline['results']), flatten(current['results'])
+    for name in sorted(set(old) & set(new)):
+        if old[name]:
+            change = (new[name] - old[name]) / old[name] * 100
+            print(f"  {name:50s} {old[name]:>12} -> {new[name]:>12}  ({change:+.1f}%)")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the RAG chatbot")
+    parser.add_argument("benchmarks", nargs="*", default=[],
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--documents", type=int, default=500, help="documents for the chunking benchmark")
+    parser.add_argument("--files", type=int, default=200, help="files for the ingestion benchmark")
+    parser.add_argument("--parse-files", type=int, default=10000, help="files for the parsing benchmark")
+    parser.add_argument("--parse-workers", type=int, default=0, help="parse processes (0 = CPU cores)")
+    parser.add_argument("--batch-size", type=int, default=Config.INGEST_BATCH_SIZE)
+    parser.add_argument("--index-size", type=int, default=5000, help="chunks in the retrieval/load index")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=200, help="requests for the load test")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--url", help="load-test a running server instead of the in-process app")
+    parser.add_argument("--embed-latency", default="lognormal:60:250", help="Cohere stand-in latency spec (ms)")
+    parser.add_argument("--search-latency", default="lognormal:20:120", help="Qdrant stand-in latency spec (ms)")
+    parser.add_argument("--llm-latency", default="lognormal:600:3000", help="OpenRouter stand-in latency spec (ms)")
+    parser.add_argument("--llm-token-latency", type=float, default=5.0, help="extra ms per generated token")
+    parser.add_argument("--embed-rate-limit", type=float, default=0.0, help="requests/second, 0 = unlimited")
+    parser.add_argument("--search-rate-limit", type=float, default=0.0)
+    parser.add_argument("--llm-rate-limit", type=float, default=0.0)
+    parser.add_argument("--cassette", help="replay upstream calls recorded with UPSTREAM_CASSETTE_MODE=record")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="replay speed-up, 0 = no upstream delay")
+    parser.add_argument("--output-dir", default="bench_results")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    selected = args.benchmarks or list(BENCHMARKS)
+
+    results = {}
+    for name in selected:
+        print(f"Running {name} benchmark...")
+        results[name] = BENCHMARKS[name](args)
+        print(json.dumps(results[name], indent=2))
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'settings': {k: v for k, v in vars(args).items() if k not in ("benchmarks", "compare")},
+        'results': results,
+    }
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['commit']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {path}")
+
+    if args.compare:
+        compare(report, args.compare)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,46 @@
 #!/usr/bin/env python3
 """
 Script to run the RAG chatbot backend server
+
+The listening socket is bound and the app is imported once in the parent
+process, then worker processes are forked from it so they share the preloaded
+modules copy-on-write. Each worker runs its own uvicorn server
+(uvloop/httptools when available) on the shared socket. A crashed worker is
+restarted after a growing delay; if workers keep crashing, the server stops.
 """
+from collections import deque
 import os
-import subprocess
-import sys
+import shutil
+import signal
+import socket
+import tempfile
+import time
 from dotenv import load_dotenv
 
-def main():
-    # Load environment variables
-    load_dotenv()  # Load .env file
-    load_dotenv('.env.local')  # Load .env.local file (overrides .env if present)
+# The values .env.example ships with
+PLACEHOLDERS = {
+    'COHERE_API_KEY': 'your_actual_cohere_api_key_here',
+    'QDRANT_URL': 'https://your-cluster-url.qdrant.tech',
+    'QDRANT_API_KEY': 'your_actual_qdrant_api_key_here',
+    'OPENROUTER_API_KEY': 'your_actual_openrouter_api_key_here',
+}
 
-    # Check if environment variables are set (not placeholder values)
-    cohere_key = os.getenv("COHERE_API_KEY")
-    qdrant_url = os.getenv("QDRANT_URL")
-    qdrant_api_key = os.getenv("QDRANT_API_KEY")
-    openrouter_key = os.getenv("OPENROUTER_API_KEY")
+def check_environment() -> bool:
+    # Check that the variables Config.validate requires are set (not placeholder values)
+    from config import Config
 
     print("Checking environment variables...")
+    if Config.UPSTREAM_CASSETTE_MODE == 'replay':
+        print("Replaying recorded upstream traffic, no API keys needed")
 
-    cohere_set = cohere_key and cohere_key != 'your_actual_cohere_api_key_here'
-    qdrant_url_set = qdrant_url and qdrant_url != 'https://your-cluster-url.qdrant.tech'
-    qdrant_api_set = qdrant_api_key and qdrant_api_key != 'your_actual_qdrant_api_key_here'
-    openrouter_set = openrouter_key and openrouter_key != 'your_actual_openrouter_api_key_here'
+    all_set = True
+    for name in Config.required_vars():
+        value = getattr(Config, name)
+        is_set = bool(value) and value != PLACEHOLDERS.get(name)
+        print(f"{name} set: {'Yes' if is_set else 'No'}")
+        all_set = all_set and is_set
 
-    print(f"COHERE_API_KEY set: {'Yes' if cohere_set else 'No'}")
-    print(f"QDRANT_URL set: {'Yes' if qdrant_url_set else 'No'}")
-    print(f"QDRANT_API_KEY set: {'Yes' if qdrant_api_set else 'No'}")
-    print(f"OPENROUTER_API_KEY set: {'Yes' if openrouter_set else 'No'}")
-
-    if not all([cohere_set, qdrant_url_set, qdrant_api_set, openrouter_set]):
+    if not all_set:
         print("\nWarning: Some environment variables are still using placeholder values!")
         print("Please update your .env file with actual API keys before running the server.")
         print("\nYou need to get API keys from:")
@@ -38,21 +48,197 @@ def main():
         print("- Qdrant: https://qdrant.tech/ (or use a local instance)")
         print("- OpenRouter: https://openrouter.ai/")
         print("\nAfter getting your API keys, edit the .env file and replace the placeholder values.")
-        return
+        return False
+
+    return True
+
+def get_worker_count(config) -> int:
+    """
+    Number of worker processes: WEB_CONCURRENCY if set, otherwise one per core
+    """
+    if not hasattr(os, "fork"):
+        return 1
+
+    # Embedded (path-based) Qdrant takes an exclusive lock on its directory,
+    # so only one process can open it
+    if not (config.QDRANT_URL and config.QDRANT_API_KEY):
+        return 1
+
+    if config.WEB_CONCURRENCY > 0:
+        return config.WEB_CONCURRENCY
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    return max(1, min(cores, config.MAX_WORKERS))
+
+def pick_event_loop() -> str:
+    try:
+        import uvloop  # noqa: F401
+        return "uvloop"
+    except ImportError:
+        return "asyncio"
+
+def pick_http_protocol() -> str:
+    try:
+        import httptools  # noqa: F401
+        return "httptools"
+    except ImportError:
+        return "h11"
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def preload():
+    """
+    Import the app and the service modules before forking workers
+    """
+    from main import app
+    from service_container import ServiceContainer
+
+    ServiceContainer.preload_shared()
+    return app
+
+def run_worker(app, sock: socket.socket, config):
+    import uvicorn
+    import metrics
 
+    metrics.share(config.METRICS_DIR)
+
+    server_config = uvicorn.Config(
+        app,
+        loop=pick_event_loop(),
+        http=pick_http_protocol(),
+        timeout_keep_alive=config.KEEP_ALIVE_SECONDS,
+        timeout_graceful_shutdown=config.GRACEFUL_SHUTDOWN_SECONDS,
+        backlog=config.SOCKET_BACKLOG,
+        # X-Forwarded-For is read by main.client_id, which only trusts the hops TRUSTED_PROXIES added
+        proxy_headers=False,
+    )
+    # uvicorn drains in-flight requests on SIGTERM/SIGINT before running the lifespan shutdown
+    uvicorn.Server(server_config).run(sockets=[sock])
+
+def spawn_worker(app, sock: socket.socket, config) -> int:
+    pid = os.fork()
+    if pid == 0:
+        # Child: restore default signal handling; uvicorn installs its own
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        try:
+            run_worker(app, sock, config)
+        finally:
+            os._exit(0)
+    return pid
+
+def restart_delay(recent_crashes: int) -> float:
+    """
+    Seconds to wait before replacing a crashed worker: 1, 2, 4, ... up to 30
+    """
+    return min(30.0, 2.0 ** max(0, recent_crashes - 1))
+
+def supervise(app, sock: socket.socket, config, workers: int) -> bool:
+    """
+    Fork the workers, restart any that crash, and forward shutdown signals.
+
+    Returns False if the server stopped because workers kept crashing
+    (more than WORKER_RESTART_LIMIT times within a minute).
+    """
+    children = {spawn_worker(app, sock, config) for _ in range(workers)}
+    crashes = deque()
+    stopping = False
+    gave_up = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    while children and not stopping:
+        try:
+            pid, status = os.waitpid(-1, 0)
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        if pid in children:
+            children.discard(pid)
+            if stopping:
+                continue
+            now = time.monotonic()
+            crashes.append(now)
+            while now - crashes[0] > 60:
+                crashes.popleft()
+            if len(crashes) > config.WORKER_RESTART_LIMIT:
+                print(f"Worker {pid} exited with status {status}; {len(crashes)} crashes within a minute, "
+                      f"shutting down")
+                gave_up = True
+                request_stop(None, None)
+                break
+            delay = restart_delay(len(crashes))
+            print(f"Worker {pid} exited with status {status}, restarting in {delay:.0f}s")
+            time.sleep(delay)  # a signal during the wait still stops the server
+            if not stopping:
+                children.add(spawn_worker(app, sock, config))
+
+    # Give workers time to drain in-flight chats, then force them down
+    deadline = time.monotonic() + config.GRACEFUL_SHUTDOWN_SECONDS + 5
+    while children and time.monotonic() < deadline:
+        pid, _ = os.waitpid(-1, os.WNOHANG)
+        if pid:
+            children.discard(pid)
+        else:
+            time.sleep(0.1)
+    for pid in children:
+        os.kill(pid, signal.SIGKILL)
+    return not gave_up
+
+def main():
+    # Load environment variables
+    load_dotenv()  # Load .env file
+    load_dotenv('.env.local')  # Load .env.local file (overrides .env if present)
+
+    if not check_environment():
+        return 1
+
+    from config import Config
+
+    workers = get_worker_count(Config)
     print("\nAll environment variables are properly set!")
-    print("Starting the RAG chatbot backend server on http://localhost:8000")
+    print(f"Starting the RAG chatbot backend server on http://{Config.APP_HOST}:{Config.APP_PORT} "
+          f"with {workers} worker(s) ({pick_event_loop()}/{pick_http_protocol()})")
     print("Press Ctrl+C to stop the server")
 
-    # Run the server
+    sock = bind_socket(Config.APP_HOST, Config.APP_PORT, Config.SOCKET_BACKLOG)
+    app = preload()
+    metrics_dir = None
+    if workers > 1 and not Config.METRICS_DIR:
+        # Workers publish their metrics here so any one of them can serve the combined /metrics
+        metrics_dir = Config.METRICS_DIR = tempfile.mkdtemp(prefix="rag-metrics-")
+
+    exit_code = 0
     try:
-        # Use uvicorn to run the FastAPI app
-        cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--port", "8000"]
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error starting the server: {e}")
+        if workers == 1:
+            run_worker(app, sock, Config)
+        else:
+            if not supervise(app, sock, Config, workers):
+                exit_code = 1
     except KeyboardInterrupt:
         print("\nServer stopped by user.")
+    finally:
+        sock.close()
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+    return exit_code
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    raise SystemExit(main())
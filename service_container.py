@@ -0,0 +1,169 @@
+import asyncio
+import importlib
+import threading
+import time
+from typing import Any, Dict, Optional
+from config import Config
+
+class ServiceContainer:
+    """
+    Holds one shared instance of each backend service.
+
+    Services are created on first use, so importing the app never touches Cohere,
+    Qdrant or OpenRouter. The heavy client libraries are only imported when the
+    service that needs them is built. warm_up() builds all of them concurrently
+    during application startup without letting an unreachable backend block it.
+    """
+
+    # name -> (module, class) so the client libraries are imported lazily
+    SERVICE_FACTORIES = {
+        'embedding_service': ('embedding_service', 'EmbeddingService'),
+        'qdrant_service': ('qdrant_service', 'QdrantService'),
+        'llm_service': ('llm_service', 'LLMService'),
+        'sentence_encoder': ('text_ranking', 'SentenceEncoder'),
+    }
+
+    # Built from local code and data only, so never recorded or replayed
+    LOCAL_SERVICES = ('document_service', 'sentence_encoder')
+
+    def __init__(self, **overrides: Any):
+        # Pre-built services (e.g. mocks) can be injected by name
+        self._instances: Dict[str, Any] = dict(overrides)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self.startup_timings: Dict[str, float] = {}
+        self.startup_errors: Dict[str, str] = {}
+        self.startup_seconds: Optional[float] = None
+
+    @classmethod
+    def preload_shared(cls):
+        """
+        Import the service modules.
+
+        Called once in the server's parent process before workers are forked,
+        so the imported code is shared copy-on-write. Nothing else is loaded:
+        the index lives in the Qdrant server, the related-sections graph is
+        memory-mapped (its pages are shared through the page cache anyway),
+        and network clients and the sentence encoder's threads don't survive
+        a fork.
+        """
+        for module_name, _ in cls.SERVICE_FACTORIES.values():
+            importlib.import_module(module_name)
+        import document_service  # noqa: F401
+
+    def _build(self, name: str) -> Any:
+        if name in self.LOCAL_SERVICES:
+            return self._build_real(name)
+        if Config.UPSTREAM_CASSETTE_MODE == 'replay':
+            from upstream_cassette import replay_service
+            return replay_service(name, Config.UPSTREAM_CASSETTE_PATH, Config.UPSTREAM_REPLAY_SPEED)
+
+        service = self._build_real(name)
+        if Config.UPSTREAM_CASSETTE_MODE == 'record':
+            from upstream_cassette import wrap_for_recording
+            service = wrap_for_recording(name, service, Config.UPSTREAM_CASSETTE_PATH)
+        return service
+
+    def _build_real(self, name: str) -> Any:
+        if name == 'document_service':
+            from document_service import DocumentService
+            return DocumentService(
+                embedding_service=self.get('embedding_service'),
+                qdrant_service=self.get('qdrant_service'),
+            )
+
+        module_name, class_name = self.SERVICE_FACTORIES[name]
+        if name == 'llm_service' and Config.LLM_BACKEND == 'local':
+            module_name, class_name = 'local_llm_service', 'LocalLLMService'
+        module = importlib.import_module(module_name)
+        return getattr(module, class_name)()
+
+    def get(self, name: str) -> Any:
+        """
+        Return the shared instance of a service, creating it on first use
+        """
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        # One lock per service so warm-up can build them in parallel
+        with self._locks_guard:
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            instance = self._instances.get(name)
+            if instance is None:
+                instance = self._build(name)
+                self._instances[name] = instance
+        return instance
+
+    @property
+    def embedding_service(self):
+        return self.get('embedding_service')
+
+    @property
+    def qdrant_service(self):
+        return self.get('qdrant_service')
+
+    @property
+    def llm_service(self):
+        return self.get('llm_service')
+
+    @property
+    def sentence_encoder(self):
+        return self.get('sentence_encoder')
+
+    @property
+    def document_service(self):
+        return self.get('document_service')
+
+    def is_ready(self, name: str) -> bool:
+        return name in self._instances
+
+    def _timed_get(self, name: str) -> float:
+        start = time.perf_counter()
+        self.get(name)
+        return time.perf_counter() - start
+
+    async def warm_up(self, timeout: float = Config.WARMUP_TIMEOUT_SECONDS) -> Dict[str, Any]:
+        """
+        Build all services concurrently in worker threads.
+
+        A service that fails or exceeds the timeout is left unbuilt and will be
+        retried lazily on the first request that needs it, so a backend outage
+        doesn't prevent the app from starting.
+        """
+        start = time.perf_counter()
+        names = list(self.SERVICE_FACTORIES)
+        tasks = [asyncio.create_task(asyncio.to_thread(self._timed_get, name)) for name in names]
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+
+        for name, task in zip(names, tasks):
+            if task in pending:
+                # The thread keeps running; its result is picked up by get() if it finishes
+                self.startup_errors[name] = f"not ready after {timeout:.1f}s"
+            elif task.exception() is not None:
+                self.startup_errors[name] = str(task.exception())
+            else:
+                self.startup_timings[name] = task.result()
+
+        self.startup_seconds = time.perf_counter() - start
+        for name, error in self.startup_errors.items():
+            print(f"Warm-up of {name} failed, will retry on first use: {error}")
+        if self.startup_seconds > Config.STARTUP_BUDGET_SECONDS:
+            print(f"Startup took {self.startup_seconds:.2f}s, over the {Config.STARTUP_BUDGET_SECONDS:.2f}s budget")
+
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'startup_seconds': self.startup_seconds,
+            'startup_budget_seconds': Config.STARTUP_BUDGET_SECONDS,
+            'services': {
+                name: {
+                    'ready': self.is_ready(name),
+                    'init_seconds': self.startup_timings.get(name),
+                    'error': self.startup_errors.get(name),
+                }
+                for name in self.SERVICE_FACTORIES
+            },
+        }
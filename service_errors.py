@@ -0,0 +1,5 @@
+class LLMUnavailableError(Exception):
+    """Raised when no model in the pool could produce an answer"""
+
+class IndexBusyError(Exception):
+    """Raised when another request or process is already writing a new version of the index"""
@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+def make_request_key(message: str, selected_text: Optional[str], scope: str) -> Tuple[str, str, str]:
+    """
+    Normalize a chat request into a key so trivially different copies of the same
+    question (case, extra whitespace) share one computation
+    """
+    normalized_message = " ".join(message.lower().split())
+    selection_hash = ""
+    if selected_text:
+        normalized_selection = " ".join(selected_text.split())
+        selection_hash = hashlib.sha1(normalized_selection.encode('utf-8')).hexdigest()
+    return (scope, normalized_message, selection_hash)
+
+class _Broadcast:
+    """
+    Buffers the chunks of one stream so late joiners replay from the start
+    """
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+
+    async def publish(self, source: AsyncIterator[Any]):
+        try:
+            async for chunk in source:
+                async with self.changed:
+                    self.chunks.append(chunk)
+                    self.changed.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            async with self.changed:
+                self.done = True
+                self.changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        position = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: position < len(self.chunks) or self.done)
+                pending = self.chunks[position:]
+                finished = self.done
+            for chunk in pending:
+                yield chunk
+            position += len(pending)
+            if finished and position >= len(self.chunks):
+                break
+
+        if self.error is not None:
+            raise self.error
+
+class SingleFlight:
+    """
+    Deduplicate concurrent identical work.
+
+    The first caller for a key starts the computation as its own task; callers
+    that arrive while it is in flight wait on the same task instead of starting
+    another. A caller that is cancelled (e.g. client disconnect) doesn't cancel
+    the shared work for the others. A stream whose callers have all gone away
+    is cancelled, so nobody keeps paying for an answer no one will read.
+    """
+
+    def __init__(self, on_coalesced: Optional[Callable[[], None]] = None):
+        self.on_coalesced = on_coalesced
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._streams: Dict[Hashable, _Broadcast] = {}
+        self.started = 0
+        self.coalesced = 0
+        self.streams_started = 0
+        self.streams_coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.started += 1
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+            if self.on_coalesced:
+                self.on_coalesced()
+
+        return await asyncio.shield(task)
+
+    async def stream(self, key: Hashable, fn: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        Like do(), but for async generators: every caller receives all chunks
+        """
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            self.streams_started += 1
+            broadcast.task = asyncio.ensure_future(broadcast.publish(fn()))
+            broadcast.task.add_done_callback(lambda _: self._forget_stream(key, broadcast))
+        else:
+            self.streams_coalesced += 1
+            if self.on_coalesced:
+                self.on_coalesced()
+
+        broadcast.subscribers += 1
+        try:
+            async for chunk in broadcast.subscribe():
+                yield chunk
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done:
+                self._forget_stream(key, broadcast)
+                broadcast.task.cancel()
+
+    def _forget_stream(self, key: Hashable, broadcast: _Broadcast):
+        # A cancelled stream's key may already belong to a newer stream
+        if self._streams.get(key) is broadcast:
+            del self._streams[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'started': self.started,
+            'coalesced': self.coalesced,
+            'streams_started': self.streams_started,
+            'streams_coalesced': self.streams_coalesced,
+            'in_flight': len(self._calls) + len(self._streams),
+        }
@@ -0,0 +1,217 @@
+"""
+Offline stand-ins for Cohere, Qdrant and OpenRouter.
+
+They expose the same methods as EmbeddingService, QdrantService and
+LLMService, so they can be injected into ServiceContainer. Each one sleeps
+according to a configurable latency distribution and can enforce a rate limit
+the way the real APIs do, which makes benchmarks reproducible without a network.
+"""
+import random
+import re
+import threading
+import time
+import uuid
+from typing import List, Dict, Any, Iterator, Optional
+import numpy as np
+from service_errors import LLMUnavailableError
+from text_ranking import hashed_embedding  # noqa: F401 (re-exported for benchmarks)
+
+class RateLimitError(Exception):
+    """Raised by a stand-in when its rate limit is exceeded (HTTP 429 upstream)"""
+
+class LatencyModel:
+    """
+    A latency distribution parsed from a spec string (all values in milliseconds):
+
+        "0"                   no delay
+        "fixed:50"            always 50ms
+        "uniform:20:80"       uniform between 20 and 80ms
+        "lognormal:80:400"    lognormal with median 80ms and p99 400ms
+    """
+
+    def __init__(self, spec: str = "0", seed: Optional[int] = None):
+        self.spec = spec
+        parts = spec.split(":")
+        self.kind = parts[0] if len(parts) > 1 else "fixed"
+        self.params = [float(p) for p in (parts[1:] if len(parts) > 1 else parts)]
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        """
+        Return a latency in seconds
+        """
+        with self._lock:
+            if self.kind == "uniform":
+                ms = self.random.uniform(self.params[0], self.params[1])
+            elif self.kind == "lognormal":
+                median, p99 = self.params
+                sigma = np.log(max(p99, median * 1.0001) / median) / 2.326  # z-score of p99
+                ms = self.random.lognormvariate(np.log(median), sigma)
+            else:
+                ms = self.params[0]
+        return ms / 1000.0
+
+    def sleep(self, scale: float = 1.0):
+        delay = self.sample() * scale
+        if delay > 0:
+            time.sleep(delay)
+
+class RateLimiter:
+    """
+    Token bucket: `rate` requests per second with bursts up to `burst`
+    """
+
+    def __init__(self, rate: float = 0.0, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                self.rejected += 1
+                raise RateLimitError("429: rate limit exceeded")
+            self.tokens -= 1
+
+class StandInEmbeddingService:
+    def __init__(self, latency: str = "0", rate_limit: float = 0.0, burst: int = 10, dimension: int = 1024, seed: Optional[int] = None):
+        self.latency = LatencyModel(latency, seed)
+        self.rate_limiter = RateLimiter(rate_limit, burst)
+        self.dimension = dimension
+        self.model = "stand-in-embed"
+        self.calls = 0
+
+    def embed_texts(self, texts: List[str], input_type: str = "search_document") -> List[List[float]]:
+        self.rate_limiter.acquire()
+        self.calls += 1
+        self.latency.sleep()
+        return [hashed_embedding(text, self.dimension) for text in texts]
+
+    def embed_query(self, query: str) -> List[float]:
+        return self.embed_texts([query], input_type="search_query")[0]
+
+class StandInQdrantService:
+    """
+    Brute-force cosine search over an in-memory matrix
+    """
+
+    def __init__(self, latency: str = "0", rate_limit: float = 0.0, burst: int = 50, seed: Optional[int] = None):
+        self.latency = LatencyModel(latency, seed)
+        self.rate_limiter = RateLimiter(rate_limit, burst)
+        self.collection_name = "stand_in_collection"
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.payloads: List[Dict[str, Any]] = []
+        self.ids: List[str] = []
+        self._lock = threading.Lock()
+
+    def create_collection(self, vector_size: int = 1024):
+        with self._lock:
+            if self.vectors.shape[1] != vector_size:
+                self.vectors = np.zeros((0, vector_size), dtype=np.float32)
+
+    def upsert_documents(self, documents: List[Dict[str, Any]]):
+        self.rate_limiter.acquire()
+        self.latency.sleep()
+        rows = np.asarray([doc['embedding'] for doc in documents], dtype=np.float32)
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        rows = rows / np.where(norms == 0, 1, norms)
+        with self._lock:
+            if self.vectors.shape[1] != rows.shape[1]:
+                self.vectors = np.zeros((0, rows.shape[1]), dtype=np.float32)
+            self.vectors = np.vstack([self.vectors, rows])
+            for doc in documents:
+                self.ids.append(doc.get('id', str(uuid.uuid4())))
+                self.payloads.append({
+                    'text': doc['text'],
+                    'source': doc.get('source', ''),
+                    'metadata': doc.get('metadata', {}),
+                    'chunk_id': doc.get('chunk_id', ''),
+                    **({'sources': doc['sources']} if doc.get('sources') else {}),
+                })
+
+    def add_sources(self, extra_sources: Dict[str, List[str]]) -> Dict[str, List[float]]:
+        vectors = {}
+        with self._lock:
+            for row, point_id in enumerate(self.ids):
+                if point_id in extra_sources:
+                    payload = self.payloads[row]
+                    payload['sources'] = list(dict.fromkeys([payload['source'], *payload.get('sources', []),
+                                                             *extra_sources[point_id]]))
+                    vectors[point_id] = self.vectors[row].tolist()
+        return vectors
+
+    def search(self, query_vector: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
+        self.rate_limiter.acquire()
+        self.latency.sleep()
+        with self._lock:
+            vectors, payloads = self.vectors, self.payloads
+        if not payloads:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        scores = vectors @ (query / (np.linalg.norm(query) or 1.0))
+        top_k = min(top_k, len(payloads))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [{**payloads[i], 'score': float(scores[i])} for i in best]
+
+    def delete_collection(self):
+        with self._lock:
+            self.vectors = np.zeros((0, self.vectors.shape[1]), dtype=np.float32)
+            self.payloads, self.ids = [], []
+
+class StandInLLMService:
+    """
+    Answers with the first sentence of the context; latency = base + per output token
+    """
+
+    def __init__(self, latency: str = "0", token_latency_ms: float = 0.0, rate_limit: float = 0.0, burst: int = 5, seed: Optional[int] = None):
+        self.latency = LatencyModel(latency, seed)
+        self.token_latency = token_latency_ms / 1000.0
+        self.rate_limiter = RateLimiter(rate_limit, burst)
+        self.model_name = "stand-in-llm"
+        self.calls = 0
+
+    def _answer(self, context: str) -> str:
+        first = re.split(r'(?<=[.!?])\s+', context.strip(), maxsplit=1)[0] if context else ""
+        return first or "The answer is not available in the provided content."
+
+    def generate(self, query: str, context: str, mode: str = "full_book", system_message: Optional[str] = None) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            self.rate_limiter.acquire()
+        except RateLimitError as e:
+            raise LLMUnavailableError(str(e)) from e
+        self.calls += 1
+        answer = self._answer(context)
+        self.latency.sleep()
+        time.sleep(self.token_latency * len(answer.split()))
+        return {'response': answer, 'model': self.model_name, 'latency_ms': round((time.perf_counter() - start) * 1000, 1)}
+
+    def generate_response(self, query: str, context: str, mode: str = "full_book", system_message: Optional[str] = None) -> str:
+        return self.generate(query, context, mode, system_message)['response']
+
+    def stream_response(self, query: str, context: str, mode: str = "full_book", system_message: Optional[str] = None) -> Iterator[str]:
+        try:
+            self.rate_limiter.acquire()
+        except RateLimitError as e:
+            raise LLMUnavailableError(str(e)) from e
+        self.calls += 1
+        self.latency.sleep()
+        for i, word in enumerate(self._answer(context).split()):
+            time.sleep(self.token_latency)
+            yield word if i == 0 else " " + word
+
+    def is_available(self) -> bool:
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        return {self.model_name: {'calls': self.calls}}
@@ -0,0 +1,49 @@
+import asyncio
+from books import BookRegistry
+from chat_pipeline import NOT_AVAILABLE, ChatPipeline, cut_results
+from service_container import ServiceContainer
+from stand_in_services import StandInEmbeddingService, StandInLLMService, StandInQdrantService, hashed_embedding
+
+def hits(*scores):
+    return [{'text': f"chunk {i}", 'source': f"{i}.md", 'score': score} for i, score in enumerate(scores)]
+
+def test_adaptive_top_k():
+    print("Testing adaptive top-k...")
+
+    # One clear match is sent alone; a flat run of good matches is kept up to max_k
+    assert len(cut_results(hits(0.62, 0.41, 0.40, 0.39), min_score=0.2, relative=0.5, min_gap=0.1)) == 1
+    assert len(cut_results(hits(0.5, 0.49, 0.48, 0.47, 0.46, 0.45), max_k=5, min_score=0.2, relative=0.75, min_gap=0.1)) == 5
+    assert [h['score'] for h in cut_results(hits(0.6, 0.3, 0.29), min_score=0.2, relative=0.75, min_gap=0)] == [0.6]
+    assert cut_results(hits(0.15, 0.14), min_score=0.2) == []
+    assert cut_results([], min_score=0.2) == []
+
+    embedding = StandInEmbeddingService()
+    qdrant = StandInQdrantService()
+    texts = ["ROS 2 nodes publish messages on topics.", "A PID controller corrects the tracking error."]
+    qdrant.create_collection(1024)
+    qdrant.upsert_documents([{'text': text, 'source': f"doc{i}.md", 'embedding': hashed_embedding(text)}
+                             for i, text in enumerate(texts)])
+    llm = StandInLLMService()
+    pipeline = ChatPipeline(ServiceContainer(embedding_service=embedding, qdrant_service=qdrant, llm_service=llm),
+                            BookRegistry(path=None))
+
+    # An off-topic question is answered right away, without an LLM call
+    result = asyncio.run(pipeline.answer("Which team won the 1998 football world cup?"))
+    print(f"Off-topic: {result}")
+    assert result['response'] == NOT_AVAILABLE and result['fallback_reason'] == "no_match"
+    assert llm.calls == 0
+
+    result = asyncio.run(pipeline.answer("How do ROS 2 nodes publish messages?"))
+    print(f"On-topic: {result}")
+    assert result['sources'] == ["doc0.md"] and llm.calls == 1
+
+    async def stream():
+        return [event async for event in pipeline.stream_answer("Who painted the Mona Lisa?")]
+
+    events = asyncio.run(stream())
+    assert events[-1]['fallback_reason'] == "no_match" and llm.calls == 1
+
+    print("Adaptive top-k test completed!")
+
+if __name__ == "__main__":
+    test_adaptive_top_k()
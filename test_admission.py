@@ -0,0 +1,105 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from admission import AdmissionController, AdmissionRejected, HIGH_PRIORITY, NORMAL_PRIORITY
+
+def test_admission():
+    print("Testing admission control...")
+
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=2, queue_timeout=1.0, client_rate=0)
+        order = []
+
+        async def request(name, priority, hold=0.05):
+            async with controller.admit(name, priority):
+                order.append(name)
+                await asyncio.sleep(hold)
+
+        first = asyncio.create_task(request("first", NORMAL_PRIORITY))
+        await asyncio.sleep(0.01)
+        normal = asyncio.create_task(request("normal", NORMAL_PRIORITY))
+        await asyncio.sleep(0.01)
+        short = asyncio.create_task(request("short", HIGH_PRIORITY))
+        await asyncio.sleep(0.01)
+
+        # Queue is full: the next request is turned away immediately
+        try:
+            await request("overflow", NORMAL_PRIORITY)
+            raise AssertionError("expected a rejection")
+        except AdmissionRejected as e:
+            assert e.reason == "queue_full" and e.retry_after >= 1
+
+        await asyncio.gather(first, normal, short)
+        assert controller.stats()['in_flight'] == 0
+        return order
+
+    order = asyncio.run(scenario())
+    print(f"Admission order: {order}")
+    assert order == ["first", "short", "normal"]
+
+    async def rate_limited():
+        controller = AdmissionController(client_rate=1, client_burst=2)
+        for _ in range(2):
+            async with controller.admit("10.0.0.1"):
+                pass
+        async with controller.admit("10.0.0.2"):
+            pass
+        try:
+            async with controller.admit("10.0.0.1"):
+                pass
+        except AdmissionRejected as e:
+            return e.reason
+        return None
+
+    reason = asyncio.run(rate_limited())
+    print(f"Third burst request: {reason}")
+    assert reason == "rate_limit"
+
+    async def deadline():
+        controller = AdmissionController(max_concurrent=1, max_queue=5, queue_timeout=0.05, client_rate=0)
+
+        async def slow():
+            async with controller.admit("a"):
+                await asyncio.sleep(0.2)
+
+        task = asyncio.create_task(slow())
+        await asyncio.sleep(0.01)
+        try:
+            async with controller.admit("b"):
+                pass
+        except AdmissionRejected as e:
+            reason = e.reason
+        await task
+        return reason, controller.stats()
+
+    reason, stats = asyncio.run(deadline())
+    print(f"Waiting past the deadline: {reason}, {stats}")
+    assert reason == "deadline"
+    assert stats['queued'] == 0 and stats['in_flight'] == 0
+
+    print("Admission control test completed!")
+
+def test_client_id(config):
+    print("Testing client addresses behind proxies...")
+    from main import client_id
+
+    def request(peer, forwarded=None):
+        return SimpleNamespace(client=SimpleNamespace(host=peer),
+                               headers={"X-Forwarded-For": forwarded} if forwarded else {})
+
+    # Untrusted by default: a client can't pick its own rate-limit bucket
+    assert client_id(request("203.0.113.9", "1.2.3.4")) == "203.0.113.9"
+
+    # Behind one proxy, the entry it appended is the client; anything left of it was sent by the client
+    config(TRUST_FORWARDED_FOR=True, TRUSTED_PROXIES="*")
+    assert client_id(request("10.0.0.2", "1.2.3.4, 198.51.100.7")) == "198.51.100.7"
+    assert client_id(request("10.0.0.2", "198.51.100.7")) == "198.51.100.7"
+    assert client_id(request("10.0.0.2")) == "10.0.0.2"
+
+    # With a proxy list, listed hops are skipped and other peers' headers are ignored
+    config(TRUSTED_PROXIES="10.0.0.0/8, 172.16.0.1")
+    assert client_id(request("10.0.0.2", "1.2.3.4, 198.51.100.7, 172.16.0.1")) == "198.51.100.7"
+    assert client_id(request("203.0.113.9", "1.2.3.4")) == "203.0.113.9"
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,82 @@
+import asyncio
+import json
+import os
+import pytest
+from admission import AdmissionController, NORMAL_PRIORITY
+from books import Book, BookRegistry, UnknownBook
+from chat_pipeline import ChatPipeline
+from document_service import DocumentService
+from qdrant_service import QdrantService
+from service_container import ServiceContainer
+from stand_in_services import StandInEmbeddingService, StandInLLMService
+
+def test_books(local_index):
+    print("Testing multi-book routing...")
+
+    directory = str(local_index)
+    for book_id, text in (("robots", "ROS 2 nodes talk over topics."), ("control", "A PID controller sums three terms.")):
+        os.makedirs(os.path.join(directory, book_id))
+        with open(os.path.join(directory, book_id, f"{book_id}.md"), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    path = os.path.join(directory, "books.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({'default': "robots", 'books': [
+            {'id': "robots", 'collection': "robots_book", 'docs_path': os.path.join(directory, "robots")},
+            {'id': "control", 'title': "Feedback Control textbook", 'docs_path': os.path.join(directory, "control")},
+        ]}, f)
+    books = BookRegistry(path, check_seconds=0)
+    assert books.get().id == "robots" and books.get("control").collection == "control_book"
+    assert books.get("robots").system_prompt("full_book") is None  # the default prompt
+    assert "Feedback Control textbook" in books.get("control").system_prompt("full_book")
+    try:
+        books.get("missing")
+        raise AssertionError("expected an unknown book")
+    except UnknownBook:
+        pass
+
+    # Registered books are persisted; unchanged books keep their caches
+    robots = books.get("robots")
+    books.register(Book("extra", docs_path=directory))
+    assert BookRegistry(path).get("extra").collection == "extra_book"
+    assert books.get("robots") is robots
+
+    qdrant = QdrantService()
+    embedding = StandInEmbeddingService()
+    for book_id in ("robots", "control"):
+        book = books.get(book_id)
+        DocumentService(embedding, book.index(qdrant)).ingest_documents(book.docs_path)
+
+    pipeline = ChatPipeline(ServiceContainer(embedding_service=embedding, qdrant_service=qdrant,
+                                             llm_service=StandInLLMService()), books)
+    for book_id, source in (("robots", "robots.md"), ("control", "control.md")):
+        # The same question is answered from each book's own collection
+        result = asyncio.run(pipeline.answer("What do ROS 2 nodes and a PID controller do?",
+                                             book=books.get(book_id)))
+        print(f"{book_id}: {result}")
+        assert result['sources'] == [source]
+
+    async def fair_share():
+        # One book may hold at most half the slots while another book is waiting
+        controller = AdmissionController(max_concurrent=2, max_queue=10, queue_timeout=2.0, client_rate=0, book_share=0.5)
+        order = []
+
+        async def request(name, book):
+            async with controller.admit(name, NORMAL_PRIORITY, book=book):
+                order.append(name)
+                await asyncio.sleep(0.05)
+
+        tasks = [asyncio.create_task(request(f"big{i}", "big")) for i in range(4)]
+        await asyncio.sleep(0.01)
+        tasks.append(asyncio.create_task(request("small", "small")))
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(fair_share())
+    print(f"Admission order: {order}")
+    assert order.index("small") == 2
+
+    print("Multi-book test completed!")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
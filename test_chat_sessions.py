@@ -0,0 +1,96 @@
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+from admission import AdmissionController
+from books import BookRegistry
+from service_container import ServiceContainer
+from stand_in_services import StandInEmbeddingService, StandInLLMService, StandInQdrantService, hashed_embedding
+from text_ranking import SentenceEncoder
+
+TEXT = "ROS 2 nodes publish messages on topics. A subscriber receives every message on its topic."
+
+class EndlessLLM(StandInLLMService):
+    """
+    Streams a token every 10 ms until its stream is closed
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.closed = threading.Event()
+
+    def stream_response(self, query, context, mode="full_book", system_message=None):
+        try:
+            for i in range(1000):
+                yield f"word{i} "
+                time.sleep(0.01)
+        finally:
+            self.closed.set()
+
+def receive_until(websocket, kind):
+    events = []
+    while not events or events[-1]['type'] != kind:
+        events.append(websocket.receive_json())
+    return events
+
+def test_cancel_stops_stream_and_frees_slot(config, monkeypatch):
+    print("Testing a cancelled /ws/chat turn end to end...")
+    config(INDEX_ALIAS_CHECK_SECONDS=0, LLM_DEADLINE_SECONDS=5, ANSWER_CACHE_SIZE=0)
+    from main import app
+
+    qdrant = StandInQdrantService()
+    qdrant.create_collection(1024)
+    qdrant.upsert_documents([{'text': TEXT, 'source': "ros.md", 'embedding': hashed_embedding(TEXT)}])
+    llm = EndlessLLM()
+    admission = AdmissionController(max_concurrent=1)
+    services = ServiceContainer(embedding_service=StandInEmbeddingService(), qdrant_service=qdrant,
+                                llm_service=llm, sentence_encoder=SentenceEncoder("hashed"))
+    for name, value in (('services', services), ('books', BookRegistry(path=None)), ('admission', admission)):
+        monkeypatch.setattr(app.state, name, value, raising=False)
+
+    with TestClient(app) as client, client.websocket_connect("/ws/chat") as websocket:
+        assert websocket.receive_json()['type'] == "session"
+        websocket.send_json({'type': "message", 'message': "How do ROS 2 nodes publish messages?"})
+        assert websocket.receive_json() == {'type': "sources", 'turn': 1, 'sources': ["ros.md"], 'mode': "full_book"}
+        assert websocket.receive_json()['type'] == "token"
+        assert admission.stats()['in_flight'] == 1
+
+        websocket.send_json({'type': "cancel"})
+        events = receive_until(websocket, "cancelled")
+        print(f"{len(events) - 1} more tokens before the cancel took effect")
+        assert events[-1] == {'type': "cancelled", 'turn': 1}
+        assert llm.closed.wait(2)  # the upstream stream was closed, not left running
+        assert admission.stats()['in_flight'] == 0
+
+        # The freed slot serves the next turn
+        websocket.send_json({'type': "message", 'message': "Who receives the messages?", 'extractive': True})
+        done = receive_until(websocket, "done")[-1]
+        assert done['turn'] == 2 and done['fallback_reason'] == "requested"
+
+def test_malformed_frames(config, monkeypatch):
+    print("Testing /ws/chat frames that aren't JSON objects...")
+    config(INDEX_ALIAS_CHECK_SECONDS=0, ANSWER_CACHE_SIZE=0)
+    from main import app
+
+    services = ServiceContainer(embedding_service=StandInEmbeddingService(), qdrant_service=StandInQdrantService(),
+                                llm_service=StandInLLMService(), sentence_encoder=SentenceEncoder("hashed"))
+    for name, value in (('services', services), ('books', BookRegistry(path=None)),
+                        ('admission', AdmissionController(max_concurrent=1))):
+        monkeypatch.setattr(app.state, name, value, raising=False)
+
+    with TestClient(app) as client, client.websocket_connect("/ws/chat") as websocket:
+        assert websocket.receive_json()['type'] == "session"
+        for frame in ("{not json", '["message", "hello"]', '"hello"', "42"):
+            websocket.send_text(frame)
+            assert websocket.receive_json() == {'type': "error", 'status': 400, 'detail': "Expected a JSON object"}
+        websocket.send_bytes(b'{"type": "message", "message": "hi"}')
+        assert websocket.receive_json()['status'] == 400
+        websocket.send_json({'type': "ping"})
+        assert websocket.receive_json()['detail'] == "Expected a message or cancel event"
+
+        # The session survives bad frames
+        websocket.send_json({'type': "message", 'message': "Anything?", 'extractive': True})
+        assert receive_until(websocket, "done")[-1]['turn'] == 1
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
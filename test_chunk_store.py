@@ -0,0 +1,51 @@
+import os
+import pytest
+from config import Config
+from document_service import DocumentService
+from qdrant_service import QdrantService
+from stand_in_services import StandInEmbeddingService, hashed_embedding
+
+def test_chunk_store(local_index, config):
+    print("Testing slim payloads backed by the chunk text store...")
+
+    docs = local_index / "docs"
+    os.makedirs(docs / "control")
+    with open(docs / "ros.md", "w", encoding="utf-8") as f:
+        f.write("ROS 2 nodes talk over topics. " * 30 + "Services answer requests — über fast.")
+    with open(docs / "control" / "pid.md", "w", encoding="utf-8") as f:
+        f.write("A PID controller sums proportional, integral and derivative terms.")
+    config(CHUNK_STORE_DIR=str(local_index / "chunks"))
+
+    qdrant = QdrantService()
+    service = DocumentService(embedding_service=StandInEmbeddingService(), qdrant_service=qdrant)
+    service.ingest_documents(str(docs))
+    full = qdrant.search(hashed_embedding("ROS 2 topics", 1024), top_k=3)
+
+    config(SLIM_PAYLOADS=True)
+    result = service.ingest_documents(str(docs))
+    assert os.path.exists(os.path.join(Config.CHUNK_STORE_DIR, result['collection_name'], "files.jsonl"))
+
+    # Points hold a reference only; the stored chunk reads back unchanged
+    point = next(qdrant.iter_points())
+    raw = qdrant.client.retrieve(result['collection_name'], ids=[point['id']], with_payload=True)[0].payload
+    print(f"Slim payload: {raw}")
+    assert 'text' not in raw and 'metadata' not in raw
+    assert point['payload']['text'] and 'store' not in point['payload']
+
+    slim = qdrant.search(hashed_embedding("ROS 2 topics", 1024), top_k=3)
+    assert slim == full
+
+    refs = qdrant.search(hashed_embedding("ROS 2 topics", 1024), top_k=3, with_text=False)
+    assert all('text' not in r for r in refs)
+    assert qdrant.attach_texts(refs[:1]) == full[:1]
+
+    # Pruning a version removes its store as well
+    service.ingest_documents(str(docs))
+    service.ingest_documents(str(docs))
+    assert not os.path.exists(os.path.join(Config.CHUNK_STORE_DIR, result['collection_name']))
+    assert qdrant.search(hashed_embedding("ROS 2 topics", 1024), top_k=3) == full
+
+    print("Chunk store test completed!")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,61 @@
+import asyncio
+import threading
+import pytest
+from books import BookRegistry
+from chat_pipeline import ChatPipeline
+from service_container import ServiceContainer
+from stand_in_services import StandInEmbeddingService, StandInLLMService, StandInQdrantService, hashed_embedding
+from text_ranking import SentenceEncoder
+
+QUESTION = "How do ROS 2 nodes publish messages on topics?"
+
+class ThreadRecordingContainer(ServiceContainer):
+    """
+    Notes which threads asked for the sentence encoder
+    """
+
+    def __init__(self, **services):
+        super().__init__(**services)
+        self.encoder_threads = []
+
+    @property
+    def sentence_encoder(self):
+        self.encoder_threads.append(threading.current_thread())
+        return super().sentence_encoder
+
+def make_pipeline():
+    qdrant = StandInQdrantService()
+    qdrant.create_collection(1024)
+    text = "ROS 2 nodes publish messages on topics. " + " ".join(
+        f"Paragraph {i} covers gripper wiring and torque limits." for i in range(8))
+    qdrant.upsert_documents([{'text': text, 'source': "ros.md", 'embedding': hashed_embedding(QUESTION)}])
+    services = ThreadRecordingContainer(embedding_service=StandInEmbeddingService(), qdrant_service=qdrant,
+                                        llm_service=StandInLLMService(), sentence_encoder=SentenceEncoder("hashed"))
+    return ChatPipeline(services, BookRegistry(path=None)), services
+
+def prepare(pipeline):
+    async def run():
+        context, _, passages = await pipeline.prepare_context(QUESTION, None, "full_book", pipeline.books.get())
+        await pipeline._extractive(QUESTION, passages, "full_book", "requested")
+        return context, threading.current_thread()
+    return asyncio.run(run())
+
+def test_compression_needs_a_semantic_encoder(config):
+    print("Testing that auto compression skips the hashed encoder...")
+    config(CONTEXT_COMPRESSION="auto", CONTEXT_COMPRESSION_MIN_CHARS=200)
+    pipeline, services = make_pipeline()
+    try:
+        context, loop_thread = prepare(pipeline)
+        assert "Paragraph 7" in context
+        # The encoder is looked up on the stage threads, never on the event loop
+        assert services.encoder_threads and loop_thread not in services.encoder_threads
+
+        config(CONTEXT_COMPRESSION="true")
+        context, _ = prepare(pipeline)
+        print(f"Forced compression: {context[:80]!r}")
+        assert context.startswith("ROS 2 nodes publish messages on topics.") and "Paragraph 7" not in context
+    finally:
+        pipeline.close()
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import doc_parsing
+from doc_parsing import ordered_map, parse_directory
+
+def write_tree(directory: str, files: int):
+    for i in range(files):
+        chapter = os.path.join(directory, f"chapter-{i % 3}")
+        os.makedirs(chapter, exist_ok=True)
+        with open(os.path.join(chapter, f"section-{i:02d}.md"), "w", encoding="utf-8") as f:
+            f.write(" ".join(f"Sentence {j} of section {i} about robots." for j in range(40)))
+
+def test_doc_parsing():
+    print("Testing parallel parsing and chunking...")
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_tree(directory, 12)
+        serial = list(parse_directory(directory, workers=1))
+        # Workers are capped at the CPU count; report enough cores for the pool to run on any host
+        with mock.patch.object(os, "cpu_count", return_value=4):
+            parallel = list(parse_directory(directory, workers=3, min_files=0))
+        print(f"Parsed {len(serial)} files into {sum(len(c) for _, c in serial)} chunks")
+
+        # Same documents, chunks and order whatever the worker count
+        assert parallel == serial
+        sources = [doc['source'] for doc, _ in serial]
+        assert sources == sorted(sources) and len(sources) == 12
+        assert all(len(chunks) > 1 and 'text' not in doc for doc, chunks in serial)
+
+    print("Parallel parsing test completed!")
+
+def test_single_core_parses_in_process():
+    print("Testing that a single core never starts the parse pool...")
+    pool = mock.Mock(side_effect=AssertionError("process pool started"))
+    with tempfile.TemporaryDirectory() as directory:
+        write_tree(directory, 6)
+        with mock.patch.object(os, "cpu_count", return_value=1), mock.patch.object(doc_parsing, "ProcessPoolExecutor", pool):
+            assert len(list(parse_directory(directory, workers=8, min_files=0))) == 6
+            assert len(list(parse_directory(directory, workers=0, min_files=0))) == 6
+        # Small trees stay in-process too
+        with mock.patch.object(os, "cpu_count", return_value=8), mock.patch.object(doc_parsing, "ProcessPoolExecutor", pool):
+            assert len(list(parse_directory(directory, workers=8, min_files=200))) == 6
+
+def test_ordered_map_window():
+    print("Testing the bounded in-flight window of parse submissions...")
+    started = []
+    lock = threading.Lock()
+
+    def work(item):
+        with lock:
+            started.append(item)
+        return item * item
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = ordered_map(pool, work, range(20), window=4)
+        assert next(results) == 0
+        # The consumer has taken one result, so no more than window items were ever submitted
+        pool.shutdown(wait=True)
+        assert len(started) == 4
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        assert list(ordered_map(pool, work, range(20), window=4)) == [i * i for i in range(20)]
+
+if __name__ == "__main__":
+    test_doc_parsing()
+    test_single_core_parses_in_process()
+    test_ordered_map_window()
@@ -0,0 +1,36 @@
+import asyncio
+from embedding_batcher import QueryEmbeddingBatcher
+from stand_in_services import RateLimitError, StandInEmbeddingService, hashed_embedding
+
+def test_embedding_batcher():
+    print("Testing query embedding micro-batching...")
+
+    async def scenario():
+        # A burst over the embedding rate limit goes out as a few batched calls
+        embedding = StandInEmbeddingService(rate_limit=5, burst=2)
+        batcher = QueryEmbeddingBatcher(lambda: embedding, max_batch=96, max_wait=0.005)
+        questions = [f"question {i % 50}" for i in range(100)]
+        vectors = await asyncio.gather(*[batcher.embed(q) for q in questions])
+        print(f"Batcher stats: {batcher.stats()}, embed calls: {embedding.calls}")
+        assert embedding.calls == 2 and batcher.queries == 100
+        assert vectors[0] == vectors[50] == hashed_embedding("question 0", 1024)
+
+        # A cancelled caller doesn't disturb the rest of its batch
+        batcher = QueryEmbeddingBatcher(lambda: StandInEmbeddingService(), max_batch=96, max_wait=0.005)
+        waiting = asyncio.create_task(batcher.embed("gone"))
+        kept = asyncio.create_task(batcher.embed("kept"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        assert await kept == hashed_embedding("kept", 1024)
+
+        # An upstream error reaches every caller in the batch
+        failing = QueryEmbeddingBatcher(lambda: embedding, max_batch=96, max_wait=0.005)
+        embedding.rate_limiter.tokens = 0
+        results = await asyncio.gather(failing.embed("a"), failing.embed("b"), return_exceptions=True)
+        assert all(isinstance(r, RateLimitError) for r in results)
+
+    asyncio.run(scenario())
+    print("Query embedding batcher test completed!")
+
+if __name__ == "__main__":
+    test_embedding_batcher()
@@ -0,0 +1,48 @@
+import os
+import pytest
+import evaluate_retrieval
+
+GOLDEN_SET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden_set.example.jsonl")
+
+DOCS = {
+    "module-1-ros2/intro.md": "ROS 2 is robot middleware, and why it is used in robotics is simple: "
+                              "nodes communicate using topics.",
+    "intro.md": "Digital twins simulate a robot.",
+    # Shares only filler words with the digital twin question, but enough of them to rank above intro.md
+    "module-3-navigation/planning.md": "What is a path? A path is what a planner finds; what is a map is a grid.",
+}
+
+def test_sweep_scores_golden_set(tmp_path):
+    print("Testing the retrieval sweep on the example golden set...")
+    for source, text in DOCS.items():
+        path = tmp_path / "docs" / source
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+    argv = [GOLDEN_SET, "--docs", str(tmp_path / "docs"), "--embedder", "hashed", "--chunk-sizes", "1000",
+            "--overlaps", "0", "--top-k", "1,3", "--quantization", "none,int8", "--min-recall", "1.0",
+            "--cache-dir", str(tmp_path / "cache")]
+    report = evaluate_retrieval.evaluate(evaluate_retrieval.parse_args(argv))
+
+    assert report['questions'] == 3 and len(report['configurations']) == 4
+    scores = {(row['quantization'], row['top_k']): (row['recall_at_k'], row['mrr'], row['chunks'])
+              for row in report['configurations']}
+    print(scores)
+    # One chunk per document. The ROS 2 questions find their page first; the digital twin
+    # question finds intro.md second, so it scores only at k=3, with a reciprocal rank of 1/2
+    for quantization in ("none", "int8"):
+        assert scores[(quantization, 1)] == (0.6667, 0.6667, 3)
+        assert scores[(quantization, 3)] == (1.0, 0.8333, 3)
+    assert report['recommended']['top_k'] == 3
+
+    # A second sweep reads every embedding from the cache
+    assert evaluate_retrieval.evaluate(evaluate_retrieval.parse_args(argv))['embedding_calls'] == 0
+
+def test_score_ranking():
+    print("Testing recall@k and reciprocal rank...")
+    ranked = ["a.md", "b.md", "c.md"]
+    assert evaluate_retrieval.score_ranking(ranked, ["b.md"], 3) == {'recall': 1.0, 'rr': 0.5}
+    assert evaluate_retrieval.score_ranking(ranked, ["b.md", "d.md"], 3) == {'recall': 0.5, 'rr': 0.5}
+    assert evaluate_retrieval.score_ranking(ranked, ["c.md"], 2) == {'recall': 0.0, 'rr': 0.0}
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,54 @@
+import os
+import pytest
+import metrics
+from document_service import DocumentService
+from qdrant_service import QdrantService
+from stand_in_services import StandInEmbeddingService, hashed_embedding
+
+def test_hierarchical_search(local_index, config):
+    print("Testing coarse-to-fine search over section centroids...")
+
+    docs = local_index / "docs"
+    os.makedirs(docs)
+    for i in range(30):
+        with open(docs / f"chapter-{i:02d}.md", "w", encoding="utf-8") as f:
+            f.write(" ".join(f"Topic{i} covers joint{i} and sensor{i} in part {j}." for j in range(60)))
+    config(HIERARCHICAL_SEARCH="on", HIERARCHICAL_TOP_SECTIONS=3, HIERARCHICAL_MIN_SECTIONS=10,
+           HIERARCHICAL_MIN_SCORE=0.2)
+
+    qdrant = QdrantService()
+    service = DocumentService(embedding_service=StandInEmbeddingService(), qdrant_service=qdrant)
+    service.ingest_documents(str(docs))
+    assert qdrant.client.count(qdrant.alias + "_sections").count == 30
+
+    coarse = metrics.HIERARCHICAL_SEARCHES.value(path="sections")
+    query = hashed_embedding("topic7 joint7 sensor7", 1024)
+    results = qdrant.search(query, top_k=5)
+    assert metrics.HIERARCHICAL_SEARCHES.value(path="sections") == coarse + 1
+    assert all(r['source'] == "chapter-07.md" for r in results)
+
+    config(HIERARCHICAL_SEARCH="auto")  # flat, the embedded store is local
+    assert [r['chunk_id'] for r in qdrant.search(query, top_k=5)] == [r['chunk_id'] for r in results]
+    config(HIERARCHICAL_SEARCH="on")
+
+    # A question no section matches well falls back to flat search
+    low = metrics.HIERARCHICAL_SEARCHES.value(path="flat_low_confidence")
+    assert len(qdrant.search(hashed_embedding("unrelated words entirely", 1024), top_k=5)) == 5
+    assert metrics.HIERARCHICAL_SEARCHES.value(path="flat_low_confidence") == low + 1
+
+    # Sections follow their chunks through re-indexing, rollback and pruning
+    service.ingest_documents(str(docs))
+    assert qdrant.live_collection(qdrant.alias + "_sections") == qdrant.version_name(2) + "_sections"
+    qdrant.rollback()
+    assert qdrant.live_collection(qdrant.alias + "_sections") == qdrant.version_name(1) + "_sections"
+    service.ingest_documents(str(docs))
+    service.ingest_documents(str(docs))
+    collections = {c.name for c in qdrant.client.get_collections().collections}
+    print(f"Collections: {sorted(collections)}")
+    assert qdrant.version_name(1) + "_sections" not in collections
+    assert qdrant.search(query, top_k=5)[0]['source'] == "chapter-07.md"
+
+    print("Hierarchical search test completed!")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
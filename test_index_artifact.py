@@ -0,0 +1,97 @@
+import os
+import tempfile
+import numpy as np
+from document_service import DocumentService
+from index_artifact import ArtifactError, build_from_documents, import_artifact, read_artifact, write_artifact
+from stand_in_services import StandInEmbeddingService, StandInQdrantService, hashed_embedding
+
+class NamedModelEmbeddingService(StandInEmbeddingService):
+    """
+    Like LocalEmbeddingService: .model is a model object, .model_name its name
+    """
+
+    def __init__(self):
+        super().__init__(dimension=64)
+        self.model = object()
+        self.model_name = "all-MiniLM-L6-v2"
+
+def test_index_artifact():
+    print("Testing index artifact export/import...")
+
+    texts = ["ROS 2 uses DDS for communication.", "Gazebo simulates robot physics.", "URDF describes links and joints."]
+    payloads = [{'text': t, 'source': f"doc{i}.md", 'metadata': {'chunk_index': 0}, 'chunk_id': f"doc{i}.md#0"}
+                for i, t in enumerate(texts)]
+    vectors = np.asarray([hashed_embedding(t, 64) for t in texts], dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as directory:
+        manifest = write_artifact(directory, [f"id-{i}" for i in range(3)], vectors, payloads, "test-model")
+        assert manifest['count'] == 3 and manifest['dimension'] == 64
+
+        # Any target with create_collection/upsert_documents works; no embedding calls are made
+        index = StandInQdrantService()
+        result = import_artifact(directory, index, batch_size=2, expected_model="test-model")
+        print(f"Import result: {result}")
+        assert result['points_loaded'] == 3
+        assert index.search(hashed_embedding("How does Gazebo simulate physics?", 64), top_k=1)[0]['source'] == "doc1.md"
+
+        try:
+            import_artifact(directory, StandInQdrantService(), expected_model="another-model")
+            raise AssertionError("expected a model mismatch")
+        except ArtifactError:
+            pass
+
+        with open(os.path.join(directory, "chunks.jsonl"), "a", encoding="utf-8") as f:
+            f.write('{"id": "tampered"}\n')
+        try:
+            read_artifact(directory)
+            raise AssertionError("expected a hash mismatch")
+        except ArtifactError as e:
+            print(f"Corrupt artifact rejected: {e}")
+
+    print("Index artifact test completed!")
+
+def test_artifact_records_model_name():
+    print("Testing the embedding model recorded by build_from_documents...")
+    with tempfile.TemporaryDirectory() as directory:
+        docs = os.path.join(directory, "docs")
+        os.makedirs(docs)
+        with open(os.path.join(docs, "ros.md"), "w", encoding="utf-8") as f:
+            f.write("ROS 2 nodes publish messages on topics.")
+
+        manifest = build_from_documents(NamedModelEmbeddingService(), docs, os.path.join(directory, "local"))
+        assert manifest['embedding_model'] == "all-MiniLM-L6-v2"
+        assert import_artifact(os.path.join(directory, "local"), StandInQdrantService(),
+                               expected_model="all-MiniLM-L6-v2")['points_loaded'] == 1
+
+        assert build_from_documents(StandInEmbeddingService(), docs,
+                                    os.path.join(directory, "stand-in"))['embedding_model'] == "stand-in-embed"
+
+def test_artifact_matches_live_ingest():
+    print("Testing that artifacts and live ingest name chunks the same way...")
+    with tempfile.TemporaryDirectory() as directory:
+        docs = os.path.join(directory, "docs")
+        os.makedirs(os.path.join(docs, "module-1"))
+        for name, text in (("intro.md", "A digital twin simulates a robot."),
+                           ("module-1/ros.md", " ".join(f"Node {i} publishes reading {i * i} on topic t{i}." for i in range(80)))):
+            with open(os.path.join(docs, name), "w", encoding="utf-8") as f:
+                f.write(text)
+
+        qdrant = StandInQdrantService()
+        DocumentService(embedding_service=StandInEmbeddingService(), qdrant_service=qdrant).ingest_documents(docs)
+        live = dict(zip(qdrant.ids, (payload['chunk_id'] for payload in qdrant.payloads)))
+
+        build_from_documents(StandInEmbeddingService(), docs, os.path.join(directory, "artifact"), qdrant.collection_name)
+        _, _, records = read_artifact(os.path.join(directory, "artifact"))
+        assert len(records) > 2 and {r['id']: r['chunk_id'] for r in records} == live
+        assert "module-1/ros.md#1" in live.values()
+
+        # Point ids are per book: the same docs for another collection get other ids
+        build_from_documents(StandInEmbeddingService(), docs, os.path.join(directory, "other"), "other_book")
+        _, _, others = read_artifact(os.path.join(directory, "other"))
+        assert [r['chunk_id'] for r in others] == [r['chunk_id'] for r in records]
+        assert not {r['id'] for r in others} & set(live)
+
+if __name__ == "__main__":
+    test_index_artifact()
+    test_artifact_records_model_name()
+    test_artifact_matches_live_ingest()
@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import pytest
+import caches
+from document_service import DocumentService
+from qdrant_service import QdrantService
+from service_errors import IndexBusyError
+from stand_in_services import StandInEmbeddingService, hashed_embedding
+
+def test_index_versions(local_index):
+    print("Testing versioned re-indexing behind the collection alias...")
+
+    docs = local_index / "docs"
+    os.makedirs(docs)
+    with open(docs / "ros.md", "w", encoding="utf-8") as f:
+        f.write("ROS 2 nodes talk over topics. Services answer requests.")
+
+    qdrant = QdrantService()
+    service = DocumentService(embedding_service=StandInEmbeddingService(), qdrant_service=qdrant)
+    answers = caches.LRUCache("test_answers", 4, index=qdrant.alias)
+    selections = caches.LRUCache("test_selections", 4)
+
+    for expected_version in (1, 2, 3):
+        answers.put("q", "cached answer")
+        selections.put("s", "kept")
+        result = service.ingest_documents(str(docs))
+        print(f"Ingest result: {result}")
+        assert result['collection_name'] == qdrant.version_name(expected_version)
+        assert qdrant.live_version() == expected_version
+        # The flip clears only index-bound caches
+        assert len(answers) == 0 and len(selections) == 1
+
+    # Readers search through the alias; only the live version and one rollback target are kept
+    assert qdrant.search(hashed_embedding("ROS 2 topics", 1024), top_k=1)[0]['source'] == "ros.md"
+    assert qdrant.list_versions() == [2, 3]
+
+    qdrant.rollback()
+    assert qdrant.live_version() == 2
+    print(f"Index status after rollback: {qdrant.index_status()}")
+    try:
+        qdrant.rollback()
+        raise AssertionError("expected no older version")
+    except ValueError:
+        pass
+
+    print("Index version test completed!")
+
+def test_migrate_unversioned_collection(local_index):
+    print("Testing the move from an unversioned collection to versions behind an alias...")
+    docs = local_index / "docs"
+    os.makedirs(docs)
+    with open(docs / "ros.md", "w", encoding="utf-8") as f:
+        f.write("ROS 2 nodes talk over topics. Services answer requests.")
+
+    qdrant = QdrantService()
+    # A collection from before versioning, under the alias's own name
+    qdrant.create_collection(1024)
+    qdrant.upsert_documents([{'id': "00000000-0000-0000-0000-000000000001", 'text': "Gazebo simulates physics.",
+                              'source': "legacy.md", 'embedding': hashed_embedding("Gazebo simulates physics.", 1024)}])
+    assert qdrant.live_collection() is None
+
+    result = DocumentService(embedding_service=StandInEmbeddingService(), qdrant_service=qdrant).ingest_documents(str(docs))
+    assert result['collection_name'] == qdrant.version_name(1) and qdrant.live_version() == 1
+    assert qdrant.search(hashed_embedding("ROS 2 topics", 1024), top_k=1)[0]['source'] == "ros.md"
+
+    # The old data was kept as version 0, so the migration can be rolled back
+    assert qdrant.list_versions() == [0, 1]
+    qdrant.rollback()
+    assert qdrant.live_collection() == qdrant.version_name(0)
+    assert [hit['source'] for hit in qdrant.search(hashed_embedding("Gazebo physics", 1024), top_k=5)] == ["legacy.md"]
+
+def hold_writer_lock(index, held, release):
+    with index.writer_lock():
+        held.set()
+        release.wait(10)
+
+def test_writer_lock(local_index):
+    print("Testing the index writer lock across processes...")
+    qdrant = QdrantService()
+    other_book = qdrant.for_collection("other_book")
+    context = multiprocessing.get_context("fork")
+    held, release = context.Event(), context.Event()
+    worker = context.Process(target=hold_writer_lock, args=(qdrant, held, release))
+    worker.start()
+    try:
+        assert held.wait(10)
+        with pytest.raises(IndexBusyError):
+            with qdrant.writer_lock():
+                pass
+        with other_book.writer_lock():
+            pass  # other aliases are not blocked
+    finally:
+        release.set()
+        worker.join()
+
+    with qdrant.writer_lock():
+        # Another request in the same process is turned away too
+        with pytest.raises(IndexBusyError):
+            with qdrant.writer_lock():
+                pass
+    with qdrant.writer_lock():
+        pass
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,164 @@
+import asyncio
+import time
+import pytest
+import metrics
+from books import BookRegistry
+from chat_pipeline import ChatPipeline
+from service_container import ServiceContainer
+from service_errors import LLMUnavailableError
+from stand_in_services import StandInEmbeddingService, StandInQdrantService, hashed_embedding
+
+QUESTION = "How do ROS 2 nodes publish messages?"
+TEXT = "ROS 2 nodes publish messages on topics. A subscriber receives every message on its topic."
+
+class ScriptedLLM:
+    """
+    Answers "LLM answer <n>" for its n-th call after `delay` seconds, or fails when `down`
+    """
+
+    def __init__(self):
+        self.delay = 0.0
+        self.down = False
+        self.broken = False
+        self.available = True
+        self.calls = 0
+        self.finished = []
+
+    def is_available(self) -> bool:
+        return self.available
+
+    def generate(self, query, context, mode="full_book", system_message=None):
+        self.calls += 1
+        call = self.calls
+        if self.down:
+            raise LLMUnavailableError("every model failed")
+        time.sleep(self.delay)
+        self.finished.append(call)
+        return {'response': f"LLM answer {call}", 'model': "scripted", 'latency_ms': self.delay * 1000}
+
+    def stream_response(self, query, context, mode="full_book", system_message=None):
+        answer = self.generate(query, context, mode, system_message)['response']
+        for i, word in enumerate(answer.split()):
+            if i and self.broken:
+                raise RuntimeError("connection reset mid-stream")
+            yield word if i == 0 else " " + word
+
+def make_pipeline():
+    qdrant = StandInQdrantService()
+    qdrant.create_collection(1024)
+    qdrant.upsert_documents([{'text': TEXT, 'source': "ros.md", 'embedding': hashed_embedding(TEXT)}])
+    llm = ScriptedLLM()
+    pipeline = ChatPipeline(ServiceContainer(embedding_service=StandInEmbeddingService(), qdrant_service=qdrant,
+                                             llm_service=llm), BookRegistry(path=None))
+    return pipeline, llm
+
+def test_deadline_falls_back_to_extractive(config):
+    print("Testing the extractive fallback at the LLM deadline...")
+    config(LLM_DEADLINE_SECONDS=0.1)
+    pipeline, llm = make_pipeline()
+
+    async def scenario():
+        llm.delay = 0.5
+        late = await pipeline.answer(QUESTION)
+        assert pipeline.single_flight.stats()['in_flight'] == 0
+
+        # The degraded answer isn't cached: the next request asks the LLM again
+        llm.delay = 0.0
+        fresh = await pipeline.answer(QUESTION)
+
+        # Once the abandoned call returns, its answer goes nowhere
+        await asyncio.sleep(0.6)
+        assert llm.finished == [2, 1]
+        cached = await pipeline.answer(QUESTION)
+        return late, fresh, cached
+
+    try:
+        late, fresh, cached = asyncio.run(scenario())
+    finally:
+        pipeline.close()
+    print(f"Past the deadline: {late}")
+    assert late['model'] == "extractive" and late['fallback_reason'] == "deadline"
+    assert "publish messages on topics" in late['response'] and late['sources'] == ["ros.md"]
+    assert fresh['response'] == "LLM answer 2" and fresh.get('fallback_reason') is None
+    assert cached['response'] == "LLM answer 2" and llm.calls == 2
+
+def test_unavailable_llm_falls_back_to_extractive(config):
+    print("Testing the extractive fallback when the LLM is unavailable...")
+    config(LLM_DEADLINE_SECONDS=1)
+    pipeline, llm = make_pipeline()
+    try:
+        llm.down = True
+        result = asyncio.run(pipeline.answer(QUESTION))
+        assert result['model'] == "extractive" and result['fallback_reason'] == "llm_unavailable"
+
+        # With every circuit open the LLM isn't even called
+        llm.down, llm.available = False, False
+        calls = llm.calls
+        result = asyncio.run(pipeline.answer(QUESTION))
+        assert result['fallback_reason'] == "circuit_open" and llm.calls == calls
+
+        llm.available = True
+        assert asyncio.run(pipeline.answer(QUESTION))['model'] == "scripted"
+    finally:
+        pipeline.close()
+
+def test_stream_deadline(config):
+    print("Testing the streaming extractive fallback at the LLM deadline...")
+    config(LLM_DEADLINE_SECONDS=0.1)
+    pipeline, llm = make_pipeline()
+
+    async def stream():
+        return [event async for event in pipeline.stream_answer(QUESTION)]
+
+    try:
+        llm.delay = 0.4
+        late = asyncio.run(stream())
+        assert late[-1]['fallback_reason'] == "deadline" and late[-1]['model'] == "extractive"
+
+        # The abandoned stream's tokens don't show up in the next answer
+        llm.delay = 0.0
+        fresh = asyncio.run(stream())
+        time.sleep(0.5)
+        text = "".join(event['text'] for event in fresh if event['type'] == 'token')
+        print(f"Next stream: {text!r}")
+        assert text == "LLM answer 2" and 'fallback_reason' not in fresh[-1]
+    finally:
+        pipeline.close()
+
+def test_stream_outcomes_counted_once(config):
+    print("Testing that each stream is counted once as ok, error or cancelled...")
+    config(LLM_DEADLINE_SECONDS=1, ANSWER_CACHE_SIZE=0)
+    pipeline, llm = make_pipeline()
+    statuses = ("ok", "error", "cancelled")
+
+    def counts():
+        return {status: metrics.CHAT_REQUESTS.value(mode="full_book", status=status) for status in statuses}
+
+    async def consume(limit=None):
+        stream = pipeline.stream_answer(QUESTION)
+        try:
+            async for event in stream:
+                if event['type'] == 'token' and limit is not None:
+                    break
+        finally:
+            await stream.aclose()
+
+    def outcome(limit=None):
+        before = counts()
+        try:
+            asyncio.run(consume(limit))
+        except RuntimeError:
+            pass
+        after = counts()
+        return {status: after[status] - before[status] for status in statuses}
+
+    try:
+        assert outcome() == {"ok": 1, "error": 0, "cancelled": 0}
+        assert outcome(limit=1) == {"ok": 0, "error": 0, "cancelled": 1}
+        llm.broken = True
+        assert outcome() == {"ok": 0, "error": 1, "cancelled": 0}
+    finally:
+        pipeline.close()
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
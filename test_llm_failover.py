@@ -0,0 +1,81 @@
+import time
+import pytest
+from circuit_breaker import CircuitBreaker
+from fake_llm_server import FakeLLMServer
+from service_errors import LLMUnavailableError
+
+def test_circuit_breaker():
+    print("Testing circuit breaker transitions...")
+    breaker = CircuitBreaker("model", failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow_request() and breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.is_open() and not breaker.allow_request()
+
+    # After the reset timeout a single trial goes through; its failure reopens the circuit
+    time.sleep(0.06)
+    assert breaker.allow_request() and breaker.state == "half_open"
+    assert not breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.is_open()
+
+    # A trial that ends without an outcome frees the slot; a successful one closes the circuit
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.release_trial()
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+def llm_service(config, server, primary, fallbacks="", reset_seconds=30.0):
+    config(OPENROUTER_BASE_URL=server.url, OPENROUTER_API_KEY="test", OPENROUTER_MODEL=primary,
+           OPENROUTER_FALLBACK_MODELS=fallbacks, CIRCUIT_FAILURE_THRESHOLD=1, CIRCUIT_RESET_SECONDS=reset_seconds,
+           LLM_HEDGE_DELAY_SECONDS=0.1, LLM_HEDGE_MIN_DELAY_SECONDS=0.1)
+    from llm_service import LLMService
+    return LLMService()
+
+def test_failover_and_hedging(config):
+    print("Testing model failover and hedged requests...")
+    with FakeLLMServer(failing_models={"down"}, model_delays={"slow": 1.0}) as server:
+        service = llm_service(config, server, "down", "up")
+        result = service.generate("What is ROS 2?", "ROS 2 is robot middleware.")
+        print(f"Failover: {result}")
+        assert result['model'] == "up" and result['response'] == "Echo: What is ROS 2?"
+        assert service.breakers["down"].is_open()
+
+        # With the primary's circuit open, the next call goes straight to the fallback
+        calls = len(server.requests)
+        assert service.generate("Again?", "context")['model'] == "up"
+        assert [r['model'] for r in server.requests[calls:]] == ["up"]
+        assert "".join(service.stream_response("Streamed?", "context")) == "Echo: Streamed?"
+
+        # A primary slower than the hedge delay is raced against the next model
+        service = llm_service(config, server, "slow", "up")
+        result = service.generate("What is a PID controller?", "context")
+        print(f"Hedged: {result}")
+        assert result['model'] == "up" and result['hedged'] is True
+
+        service = llm_service(config, server, "down")
+        with pytest.raises(LLMUnavailableError):
+            service.generate("Anyone?", "context")
+        with pytest.raises(LLMUnavailableError):
+            service.generate("Anyone?", "context")  # circuit open: no request is sent
+
+def test_cancelled_stream_releases_trial(config):
+    print("Testing a cancelled stream during a half-open trial...")
+    with FakeLLMServer(token_delay=0.01) as server:
+        service = llm_service(config, server, "up", reset_seconds=0.05)
+        breaker = service.breakers["up"]
+        breaker.record_failure()
+        time.sleep(0.06)
+
+        # The trial stream is closed after its first token, like a cancelled WebSocket answer
+        stream = service.stream_response("What is Physical AI?", "context")
+        assert next(stream) == "Echo:"
+        assert breaker.state == "half_open" and not breaker.allow_request()
+        stream.close()
+        assert breaker.state == "closed" and breaker.allow_request()
+        assert service.is_available()
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
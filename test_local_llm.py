@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from fake_llm_server import FakeLLMServer
+
+def test_local_llm_service(config):
+    print("Testing local LLM service against a fake inference server...")
+
+    with FakeLLMServer(token_delay=0.01) as server:
+        config(LOCAL_LLM_URL=server.url)
+        from local_llm_service import LocalLLMService
+        llm_service = LocalLLMService()
+
+        result = llm_service.generate("What is ROS 2?", "ROS 2 is robot middleware.")
+        print(f"Response: {result}")
+        assert result['response'] == "Echo: What is ROS 2?"
+        assert server.requests[-1]['cache_prompt'] is True
+
+        streamed = list(llm_service.stream_response("What is Physical AI?", "Physical AI is embodied AI."))
+        print(f"Streamed chunks: {streamed}")
+        assert "".join(streamed) == "Echo: What is Physical AI?"
+
+        # Concurrent requests share the keep-alive client and the server's slots
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            answers = list(pool.map(lambda i: llm_service.generate_response(f"Question {i}?", "context"), range(8)))
+        assert answers == [f"Echo: Question {i}?" for i in range(8)]
+
+        # The system prompt is identical across requests so the server can reuse its KV cache
+        system_prompts = {request['messages'][0]['content'] for request in server.requests}
+        assert len(system_prompts) == 1
+
+    print("Local LLM service test completed!")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,54 @@
+import multiprocessing
+import os
+import pytest
+from metrics import Counter, Gauge, Histogram, Registry
+
+def make_registry():
+    registry = Registry()
+    requests = registry.register(Counter("test_requests_total", "Requests", ["mode"]))
+    active = registry.register(Gauge("test_active", "Active requests"))
+    latency = registry.register(Histogram("test_seconds", "Latency", buckets=(0.1, 1.0)))
+    return registry, requests, active, latency
+
+def exited_worker(directory):
+    registry, requests, active, latency = make_registry()
+    requests.inc(3, mode="full_book")
+    active.inc(5)
+    latency.observe(0.5)
+    registry.flush(directory)
+
+def test_render_single_process(config):
+    config(METRICS_DIR="")
+    registry, requests, active, latency = make_registry()
+    requests.inc(mode="full_book")
+    latency.observe(0.05)
+    text = registry.render()
+    assert 'test_requests_total{mode="full_book"} 1.0' in text
+    assert 'test_seconds_bucket{le="0.1"} 1' in text and "test_seconds_count 1" in text
+
+def test_render_sums_workers(tmp_path, config):
+    print("Testing /metrics aggregation across worker processes...")
+    config(METRICS_DIR=str(tmp_path))
+    worker = multiprocessing.get_context("fork").Process(target=exited_worker, args=(str(tmp_path),))
+    worker.start()
+    worker.join()
+
+    registry, requests, active, latency = make_registry()
+    requests.inc(mode="full_book")
+    requests.inc(mode="selected_text")
+    active.inc(2)
+    latency.observe(0.05)
+    text = registry.render()
+    print(text)
+
+    # The exited worker's counts stay in the totals, so counters never go backwards; its gauge is dropped
+    assert 'test_requests_total{mode="full_book"} 4.0' in text
+    assert 'test_requests_total{mode="selected_text"} 1.0' in text
+    assert "test_active 2.0" in text
+    assert 'test_seconds_bucket{le="0.1"} 1' in text and 'test_seconds_bucket{le="1.0"} 2' in text
+    assert "test_seconds_sum 0.55" in text and "test_seconds_count 2" in text
+    assert f'rag_worker_info{{pid="{worker.pid}"}}' not in text
+    assert {p.name for p in tmp_path.iterdir()} == {f"{worker.pid}.json", f"{os.getpid()}.json"}
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
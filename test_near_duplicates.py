@@ -0,0 +1,74 @@
+import os
+import pytest
+from books import BookRegistry
+from chat_pipeline import ChatPipeline
+from document_service import DocumentService
+from near_duplicates import NearDuplicateIndex
+from qdrant_service import QdrantService
+from service_container import ServiceContainer
+from stand_in_services import StandInEmbeddingService, hashed_embedding
+from text_ranking import SentenceEncoder, extractive_answer
+
+FOOTER = ("Safety note: always power down the robot, disconnect the battery and secure the arm before you "
+          "touch any joint, motor or sensor cable. Follow the lab checklist and ask an instructor when unsure. "
+          "This book is licensed under CC BY 4.0; see the license page for details.")
+
+def test_minhash():
+    print("Testing MinHash near-duplicate detection...")
+    index = NearDuplicateIndex()
+    assert index.check("a", FOOTER) is None
+    assert index.check("b", FOOTER) == "a"
+    # Case, spacing and a changed word still match; different text does not
+    assert index.check("c", "  " + FOOTER.upper().replace("instructor", "teacher")) == "a"
+    assert index.check("d", "A PID controller sums proportional, integral and derivative terms of the error.") is None
+    assert index.check("e", FOOTER[:len(FOOTER) // 2]) is None
+    assert (index.checked, index.duplicates) == (5, 2)
+
+def test_ingest_collapses_duplicates(local_index, config):
+    print("Testing duplicate collapse during ingestion...")
+    docs = local_index / "docs"
+    os.makedirs(docs)
+    for i in range(6):
+        with open(docs / f"chapter-{i}.md", "w", encoding="utf-8") as f:
+            f.write(" ".join(f"Chapter {i} explains actuator{i} and encoder{i} in step {j}." for j in range(12)))
+    for i in range(6):
+        with open(docs / f"lab-{i}.md", "w", encoding="utf-8") as f:
+            f.write(FOOTER)
+    config(DEDUP_CHUNKS=True)
+
+    qdrant = QdrantService()
+    embedding = StandInEmbeddingService()
+    service = DocumentService(embedding_service=embedding, qdrant_service=qdrant)
+    result = service.ingest_documents(str(docs))
+    print(f"Result: {result}")
+    assert result['duplicate_chunks'] == 5
+    assert qdrant.client.count(qdrant.alias).count == result['chunks_created']
+
+    # One hit for the footer, listing every lab page; each lab page keeps its section vector
+    hits = qdrant.search(hashed_embedding(FOOTER, 1024), top_k=5)
+    footers = [hit for hit in hits if hit['text'] == FOOTER]
+    assert len(footers) == 1
+    assert sorted(footers[0]['sources']) == [f"lab-{i}.md" for i in range(6)]
+
+    # Answers from the collapsed chunk cite every page it appeared on
+    pipeline = ChatPipeline(ServiceContainer(qdrant_service=qdrant), BookRegistry(path=None))
+    try:
+        _, sources = pipeline.build_context(footers)
+    finally:
+        pipeline.close()
+    assert sorted(sources) == [f"lab-{i}.md" for i in range(6)]
+    answer = extractive_answer(SentenceEncoder("hashed"), "Who do I ask when unsure?", footers)
+    assert sorted(answer['sources']) == sorted(sources)
+    assert qdrant.client.count(qdrant.alias + "_sections").count == 12
+
+    config(DEDUP_CHUNKS=False)
+    calls = embedding.calls
+    again = service.ingest_documents(str(docs))
+    assert again['duplicate_chunks'] == 0
+    assert again['chunks_created'] == result['chunks_created'] + 5
+    print(f"Embedding calls: {calls} with dedup, {embedding.calls - calls} without")
+
+    print("Near-duplicate test completed!")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
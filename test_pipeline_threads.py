@@ -0,0 +1,52 @@
+import asyncio
+import threading
+import time
+import pytest
+from books import BookRegistry
+from chat_pipeline import ChatPipeline
+from service_container import ServiceContainer
+from stand_in_services import StandInEmbeddingService, StandInLLMService, StandInQdrantService, hashed_embedding
+
+class StuckLLM(StandInLLMService):
+    """
+    Holds every generation until released, like a slow model
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def generate(self, *args, **kwargs):
+        self.release.wait(10)
+        return super().generate(*args, **kwargs)
+
+def test_llm_calls_do_not_starve_search(config):
+    print("Testing that LLM generations don't hold the embed/search threads...")
+    config(LLM_EXECUTOR_THREADS=4, STAGE_EXECUTOR_THREADS=2, LLM_DEADLINE_SECONDS=0.2)
+    qdrant = StandInQdrantService()
+    text = "ROS 2 nodes publish messages on topics."
+    qdrant.create_collection(1024)
+    qdrant.upsert_documents([{'text': text, 'source': "ros.md", 'embedding': hashed_embedding(text)}])
+    llm = StuckLLM()
+    pipeline = ChatPipeline(ServiceContainer(embedding_service=StandInEmbeddingService(), qdrant_service=qdrant,
+                                             llm_service=llm), BookRegistry(path=None))
+
+    async def scenario():
+        # More stuck generations than the stage pool has threads, all past their deadline
+        answers = await asyncio.gather(*(pipeline.answer(f"How do ROS 2 nodes publish messages? ({i})")
+                                         for i in range(4)))
+        assert all(a['fallback_reason'] == "deadline" for a in answers)
+        start = time.perf_counter()
+        hits = await pipeline.retrieve("How do ROS 2 nodes publish messages?")
+        return hits, time.perf_counter() - start
+
+    try:
+        hits, seconds = asyncio.run(scenario())
+        print(f"Search with every LLM thread busy: {seconds * 1000:.1f} ms, stats {pipeline.stats()['threads']}")
+        assert hits[0]['source'] == "ros.md" and seconds < 1
+    finally:
+        llm.release.set()
+        pipeline.close()
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
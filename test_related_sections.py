@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pytest
+import related_sections
+from document_service import DocumentService
+from qdrant_service import QdrantService
+from stand_in_services import StandInEmbeddingService
+
+def corpus(rng, documents=40, per_document=6, dimension=64):
+    centers = rng.normal(size=(documents, dimension))
+    vectors = np.repeat(centers, per_document, axis=0) + 0.7 * rng.normal(size=(documents * per_document, dimension))
+    sources = [f"doc-{i // per_document:02d}.md" for i in range(documents * per_document)]
+    keys = [f"{source}#{i % per_document}" for i, source in enumerate(sources)]
+    return keys, sources, vectors.astype(np.float32)
+
+def neighbor_keys(arrays, meta, row):
+    return [meta['keys'][n] for n in arrays['chunk_neighbors'][row] if n >= 0]
+
+def test_related_sections():
+    print("Testing the related-sections graph...")
+    rng = np.random.default_rng(7)
+    keys, sources, vectors = corpus(rng)
+
+    arrays, meta = related_sections.build(keys, sources, vectors, top_n=5)
+    assert arrays['chunk_neighbors'].dtype == np.int32 and arrays['chunk_scores'].dtype == np.float16
+
+    # Matches a brute-force search that skips the chunk's own document
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    similarity = normalized @ normalized.T
+    own = np.asarray(sources)[:, None] == np.asarray(sources)[None, :]
+    similarity[own] = -np.inf
+    expected = np.argsort(-similarity, axis=1)[:, :5]
+    assert (arrays['chunk_neighbors'] == expected).all()
+    assert np.allclose(arrays['chunk_scores'], np.take_along_axis(similarity, expected, axis=1), atol=1e-2)
+
+    with tempfile.TemporaryDirectory() as root:
+        related_sections.save("book", arrays, meta, root)
+        previous = related_sections.load("book", root)
+        print(f"doc-03.md: {previous.related('doc-03.md', limit=3)}")
+        assert previous.related("doc-03.md", limit=3)['related'][0]['source'] != "doc-03.md"
+
+        # Change, drop and add a few chunks; the incremental graph equals a full rebuild
+        vectors[3] += rng.normal(size=vectors.shape[1]).astype(np.float32)
+        keep = [i for i in range(len(keys)) if sources[i] != "doc-10.md"]
+        new_keys, new_sources = [keys[i] for i in keep], [sources[i] for i in keep]
+        extra_keys, extra_sources, extra_vectors = corpus(rng, documents=2)
+        new_keys += [f"new-{k}" for k in extra_keys]
+        new_sources += [f"new-{s}" for s in extra_sources]
+        new_vectors = np.vstack([vectors[keep], extra_vectors])
+
+        incremental, incremental_meta = related_sections.build(new_keys, new_sources, new_vectors, previous, top_n=5)
+        full, full_meta = related_sections.build(new_keys, new_sources, new_vectors, top_n=5)
+        print(f"Recomputed {incremental_meta['recomputed_rows']} of {len(new_keys)} rows")
+        assert incremental_meta['recomputed_rows'] < len(new_keys) / 2
+        for row in range(len(new_keys)):
+            assert neighbor_keys(incremental, incremental_meta, row) == neighbor_keys(full, full_meta, row)
+
+        generation = related_sections.save("book", incremental, incremental_meta, root)
+        graphs = related_sections.RelatedGraphs(root, check_seconds=0)
+        assert graphs.get("book")[0] == generation == 2
+        assert graphs.get("book")[1].related("doc-10.md") is None
+
+    print("Related sections test completed!")
+
+def test_rollback_restores_graph(local_index):
+    print("Testing the related-sections graph across an index rollback...")
+    docs = local_index / "docs"
+    os.makedirs(docs)
+    topics = ["ROS 2 nodes publish on topics.", "Gazebo simulates robot physics.", "PID loops steer motors."]
+    for i, topic in enumerate(topics):
+        with open(docs / f"page-{i}.md", "w", encoding="utf-8") as f:
+            f.write(topic * 3)
+
+    qdrant = QdrantService()
+    service = DocumentService(embedding_service=StandInEmbeddingService(), qdrant_service=qdrant)
+    service.ingest_documents(str(docs))
+    assert related_sections.load(qdrant.alias) is None  # only asked for by POST /ingest
+    first = service.ingest_documents(str(docs), update_related=True)['related_sections']
+
+    with open(docs / "page-3.md", "w", encoding="utf-8") as f:
+        f.write("Isaac Sim renders synthetic camera images." * 3)
+    second = service.ingest_documents(str(docs), update_related=True)['related_sections']
+    assert related_sections.load(qdrant.alias).related("page-3.md") is not None
+
+    qdrant.rollback()
+    restored = related_sections.follow_live_collection(qdrant)
+    assert restored == {'alias': qdrant.alias, 'generation': first['generation'], 'rebuilt': False}
+    graph = related_sections.load(qdrant.alias)
+    assert graph.meta['collection'] == qdrant.live_collection() and graph.related("page-3.md") is None
+
+    # The next build gets a new number, so cached ETags of the rolled-back graph never match it
+    third = service.ingest_documents(str(docs), update_related=True)['related_sections']
+    assert third['generation'] > second['generation']
+    assert related_sections.generations(qdrant.alias) == [second['generation'], third['generation']]
+
+    # The graph of the index's rollback target is kept; when it is missing, it is rebuilt
+    shutil.rmtree(os.path.join(related_sections.graph_root(qdrant.alias), f"g{second['generation']}"))
+    qdrant.rollback()
+    rebuilt = related_sections.follow_live_collection(qdrant)
+    assert rebuilt['rebuilt'] and rebuilt['generation'] > third['generation']
+    assert related_sections.load(qdrant.alias).meta['collection'] == qdrant.live_collection()
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
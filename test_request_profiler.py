@@ -0,0 +1,53 @@
+import threading
+import time
+import pytest
+from request_profiler import ProfileStore, RequestProfiler
+
+def busy_request(seconds: float):
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(i * i for i in range(1000))
+    return total
+
+def test_profile_busy_request(tmp_path):
+    print("Testing a profile of a busy request...")
+    profiler = RequestProfiler(sample_rate=0, store=ProfileStore(str(tmp_path), max_profiles=5), interval=0.002)
+    assert not profiler.should_profile(False) and profiler.should_profile(True)
+
+    sampler = profiler.begin()
+    assert sampler is not None
+    # Only one request is profiled at a time
+    assert profiler.begin() is None
+    worker = threading.Thread(target=busy_request, args=(0.2,), name="busy-request")
+    worker.start()
+    worker.join()
+    profile_id = profiler.finish(sampler, {'path': "/chat", 'status': 200, 'requested': True})
+
+    summary = profiler.store.get(profile_id)
+    print(f"{summary['samples']} samples, hottest: {summary['top_functions'][0]['function']}")
+    assert summary['samples'] > 10 and summary['path'] == "/chat"
+    # Most of the busy time is in the generator busy_request sums over
+    assert any("test_request_profiler.py" in row['function'] for row in summary['top_functions'][:3])
+    with open(profiler.store.collapsed_path(profile_id), encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert any(line.startswith("busy-request;") and "busy_request " in line for line in lines)
+    # Finished, so the next request can be profiled
+    sampler = profiler.begin()
+    assert sampler is not None
+    profiler.finish(sampler, {'path': "/chat", 'status': 200, 'requested': False})
+
+def test_store_evicts_oldest(tmp_path):
+    print("Testing the profile ring...")
+    profiler = RequestProfiler(store=ProfileStore(str(tmp_path), max_profiles=2), interval=0.002)
+    ids = []
+    for i in range(4):
+        ids.append(profiler.finish(profiler.begin(), {'path': "/chat", 'status': 200, 'requested': True, 'n': i}))
+    listed = profiler.store.list()
+    assert [profile['n'] for profile in listed] == [3, 2]
+    assert profiler.store.get(ids[0]) is None and profiler.store.collapsed_path(ids[1]) is None
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(f"{i}{suffix}" for i in ids[2:]
+                                                                for suffix in (".collapsed", ".json"))
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
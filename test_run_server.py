@@ -0,0 +1,40 @@
+import os
+import signal
+import pytest
+import run_server
+from config import Config
+
+def test_check_environment(config):
+    print("Testing the startup environment check...")
+    config(COHERE_API_KEY="key", QDRANT_URL="https://qdrant.example", QDRANT_API_KEY="key",
+           OPENROUTER_API_KEY="", LLM_BACKEND="local", UPSTREAM_CASSETTE_MODE="off")
+    assert run_server.check_environment()  # a local LLM needs no OpenRouter key
+
+    config(LLM_BACKEND="openrouter")
+    assert not run_server.check_environment()
+    config(OPENROUTER_API_KEY=run_server.PLACEHOLDERS['OPENROUTER_API_KEY'])
+    assert not run_server.check_environment()
+
+    config(COHERE_API_KEY="", QDRANT_URL="", QDRANT_API_KEY="", UPSTREAM_CASSETTE_MODE="replay")
+    assert run_server.check_environment()
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="workers are forked")
+def test_supervise_gives_up_on_crash_loop(config, monkeypatch):
+    print("Testing that a crash-looping worker stops the server...")
+    assert [run_server.restart_delay(n) for n in (1, 2, 3, 6, 10)] == [1, 2, 4, 30, 30]
+
+    config(WORKER_RESTART_LIMIT=3, GRACEFUL_SHUTDOWN_SECONDS=0)
+    delays = []
+    monkeypatch.setattr(run_server, "run_worker", lambda app, sock, config: os._exit(3))
+    monkeypatch.setattr(run_server, "restart_delay", lambda crashes: delays.append(crashes) or 0)
+    handlers = {sig: signal.getsignal(sig) for sig in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        assert run_server.supervise(None, None, Config, workers=1) is False
+    finally:
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+    # Restarted after each of the first three crashes, then the fourth within a minute stops it
+    assert delays == [1, 2, 3]
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from service_container import ServiceContainer
+from stand_in_services import StandInEmbeddingService, StandInLLMService, StandInQdrantService
+from text_ranking import SentenceEncoder
+
+class StandInContainer(ServiceContainer):
+    """
+    Builds stand-in services, counting builds. The LLM waits for llm_gate; failing names raise.
+    """
+
+    FACTORIES = {
+        'embedding_service': StandInEmbeddingService,
+        'qdrant_service': StandInQdrantService,
+        'llm_service': StandInLLMService,
+        'sentence_encoder': lambda: SentenceEncoder("hashed"),
+    }
+
+    def __init__(self, failing=(), **overrides):
+        super().__init__(**overrides)
+        self.builds = {name: 0 for name in self.FACTORIES}
+        self.failing = set(failing)
+        self.llm_gate = threading.Event()
+        self.llm_gate.set()
+
+    def _build_real(self, name):
+        self.builds[name] += 1
+        if name in self.failing:
+            raise ConnectionError(f"{name} unreachable")
+        if name == 'llm_service':
+            self.llm_gate.wait()
+        return self.FACTORIES[name]()
+
+def test_services_built_lazily_once():
+    print("Testing lazy, once-only service builds...")
+    container = StandInContainer()
+    assert not any(container.is_ready(name) for name in container.FACTORIES)
+    assert sum(container.builds.values()) == 0
+
+    # Concurrent first uses share one build
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        services = list(pool.map(lambda _: container.embedding_service, range(16)))
+    assert all(service is services[0] for service in services)
+    assert container.builds['embedding_service'] == 1 and container.is_ready('embedding_service')
+    assert container.builds['qdrant_service'] == 0
+
+def test_warm_up_keeps_injected_services(config):
+    print("Testing that warm-up doesn't rebuild injected services...")
+    config(UPSTREAM_CASSETTE_MODE="off")
+    qdrant = StandInQdrantService()
+    container = StandInContainer(qdrant_service=qdrant)
+    status = asyncio.run(container.warm_up(timeout=5))
+
+    assert container.qdrant_service is qdrant and container.builds['qdrant_service'] == 0
+    assert all(container.builds[name] == 1 for name in ('embedding_service', 'llm_service', 'sentence_encoder'))
+    assert all(service['ready'] and service['error'] is None for service in status['services'].values())
+    assert status['startup_seconds'] is not None
+
+def test_warm_up_timeout_and_failure(config):
+    print("Testing warm-up with a slow and a failing backend...")
+    config(UPSTREAM_CASSETTE_MODE="off")
+    container = StandInContainer(failing={'embedding_service'})
+    container.llm_gate.clear()
+
+    async def start():
+        status = await container.warm_up(timeout=0.2)
+        # Let the abandoned build finish, or closing the loop waits for its thread forever
+        container.llm_gate.set()
+        return status
+
+    status = asyncio.run(start())
+    services = status['services']
+    print(f"Warm-up: {services}")
+
+    assert services['llm_service'] == {'ready': False, 'init_seconds': None, 'error': "not ready after 0.2s"}
+    assert not services['embedding_service']['ready']
+    assert services['embedding_service']['error'] == "embedding_service unreachable"
+    assert services['qdrant_service']['ready'] and services['sentence_encoder']['ready']
+
+    # The abandoned build finished in its thread; get() serves it without building again
+    assert isinstance(container.llm_service, StandInLLMService) and container.builds['llm_service'] == 1
+
+    # A failed service is retried on first use
+    container.failing.clear()
+    assert isinstance(container.embedding_service, StandInEmbeddingService)
+    assert container.builds['embedding_service'] == 2
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,67 @@
+import asyncio
+from singleflight import SingleFlight, make_request_key
+
+def test_single_flight():
+    print("Testing request coalescing...")
+
+    single_flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def ask_concurrently():
+        keys = [make_request_key(message, None, "full_book") for message in ["What is ROS 2?", "what is  ros 2?", "What is Physical AI?"]]
+        return await asyncio.gather(*[single_flight.do(key, compute) for key in keys])
+
+    results = asyncio.run(ask_concurrently())
+    print(f"Results: {results}, upstream calls: {len(calls)}")
+    assert results == ["answer"] * 3
+    assert len(calls) == 2
+    assert single_flight.stats()['coalesced'] == 1
+
+    async def chunks():
+        for chunk in ["a", "b", "c"]:
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def stream_concurrently():
+        async def consume():
+            return [chunk async for chunk in single_flight.stream("key", chunks)]
+        return await asyncio.gather(consume(), consume())
+
+    streamed = asyncio.run(stream_concurrently())
+    print(f"Streamed: {streamed}")
+    assert streamed == [["a", "b", "c"], ["a", "b", "c"]]
+    assert single_flight.stats()['streams_coalesced'] == 1
+
+    finished = []
+
+    async def endless():
+        try:
+            while True:
+                await asyncio.sleep(0.01)
+                yield "chunk"
+        finally:
+            finished.append(True)
+
+    async def abandon():
+        async def consume():
+            async for _ in single_flight.stream("endless", endless):
+                pass
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(abandon())
+    print(f"Abandoned stream closed: {finished}")
+    assert finished == [True]
+    assert single_flight.stats()['in_flight'] == 0
+
+    print("Request coalescing test completed!")
+
+if __name__ == "__main__":
+    test_single_flight()
@@ -0,0 +1,72 @@
+from text_ranking import (SentenceEncoder, compress_context, extractive_answer, focus_selection, group_sentences,
+                          selection_cache, split_sentences)
+
+PASSAGES = [
+    {'text': "ROS 2 is a middleware framework. It replaces ROS 1. Nodes communicate over topics using DDS. "
+             "Launch files start many nodes. Colcon builds workspaces.", 'source': 'module-1-ros2/intro.md'},
+    {'text': "Gazebo simulates physics. Isaac Sim renders photorealistic scenes. URDF describes robot links.",
+     'source': 'module-2-simulation/gazebo.md'},
+]
+
+class SemanticStandIn(SentenceEncoder):
+    """
+    Hashed vectors, but treated as a semantic model
+    """
+
+    def __init__(self):
+        super().__init__("hashed")
+
+    @property
+    def semantic(self) -> bool:
+        return True
+
+def test_text_ranking():
+    print("Testing sentence ranking...")
+    encoder = SentenceEncoder("hashed")
+
+    assert split_sentences("# Title\n\nShort. This one is long enough.") == ["This one is long enough."]
+
+    answer = extractive_answer(encoder, "How do nodes communicate over topics?", PASSAGES, max_sentences=2)
+    print(f"Extractive answer: {answer}")
+    assert "Nodes communicate over topics using DDS." in answer['response']
+    assert answer['sources'][0] == 'module-1-ros2/intro.md'
+    assert extractive_answer(encoder, "anything", [{'text': "", 'source': 'x.md'}]) is None
+
+    context, sources = compress_context(encoder, "How do nodes communicate over topics?", PASSAGES,
+                                        neighbours=1, min_sentences=1)
+    print(f"Compressed context: {context!r} from {sources}")
+    assert context == "It replaces ROS 1. Nodes communicate over topics using DDS. Launch files start many nodes."
+    assert sources == ['module-1-ros2/intro.md']
+
+    filler = " ".join(f"Paragraph {i} talks about sensor calibration and wiring." for i in range(200))
+    selection = filler + " Zero moment point control keeps bipedal robots balanced. " + filler
+    semantic = SemanticStandIn()
+    focused = focus_selection(semantic, "What keeps bipedal robots balanced?", selection, max_chars=600, chunk_chars=200)
+    print(f"Focused {len(selection)} chars to {len(focused)}")
+    assert len(focused) <= 600 and "Zero moment point" in focused
+    cached = len(selection_cache)
+    focus_selection(semantic, "Which wiring is used?", selection, max_chars=600, chunk_chars=200)
+    assert len(selection_cache) == cached  # chunk embeddings reused for the second question
+
+    # Without a semantic model the selection is cut in order, and nothing is embedded
+    truncated = focus_selection(encoder, "What keeps bipedal robots balanced?", selection, max_chars=600, chunk_chars=200)
+    assert len(truncated) <= 600 and selection.startswith(truncated) and " ... " not in truncated
+    assert len(selection_cache) == cached
+
+    print("Sentence ranking test completed!")
+
+def test_long_sentences_are_split():
+    print("Testing selections with sentences longer than a chunk...")
+    run_on = " ".join(f"word{i}" for i in range(2000))  # ~16k characters, no sentence boundary
+    chunks = group_sentences(f"Short one. {run_on}. Another short one.", 200)
+    assert max(len(chunk) for chunk in chunks) <= 200
+    assert " ".join(chunks).split() == f"Short one. {run_on}. Another short one.".split()
+
+    for encoder in (SentenceEncoder("hashed"), SemanticStandIn()):
+        focused = focus_selection(encoder, "What is word1500?", run_on, max_chars=600, chunk_chars=5000)
+        print(f"{encoder.backend} semantic={encoder.semantic}: {len(focused)} chars")
+        assert 0 < len(focused) <= 600
+
+if __name__ == "__main__":
+    test_text_ranking()
+    test_long_sentences_are_split()
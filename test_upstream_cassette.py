@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from fake_llm_server import FakeLLMServer
+from service_errors import LLMUnavailableError
+from stand_in_services import StandInEmbeddingService, StandInQdrantService, hashed_embedding
+from test_llm_failover import llm_service
+from upstream_cassette import Cassette, CassetteMissError, RecordingProxy, ReplayService
+
+CONTEXT = "ROS 2 is robot middleware."
+
+def record_session(config, path):
+    """
+    Records embeddings, a search, a whole answer, a streamed answer and a failed answer
+    """
+    cassette = Cassette(path)
+    embedder = RecordingProxy('embedding_service', StandInEmbeddingService(), cassette)
+    qdrant = StandInQdrantService()
+    qdrant.create_collection(1024)
+    qdrant.upsert_documents([{'text': CONTEXT, 'source': 'ros2.md', 'embedding': hashed_embedding(CONTEXT)}])
+    qdrant = RecordingProxy('qdrant_service', qdrant, cassette)
+    with FakeLLMServer(failing_models={"down"}) as server:
+        llm = RecordingProxy('llm_service', llm_service(config, server, "up"), cassette)
+        recorded = {
+            'vectors': embedder.embed_texts([CONTEXT]),
+            'query': embedder.embed_query("What is ROS 2?"),
+            'hits': qdrant.search(hashed_embedding("What is ROS 2?"), top_k=3),
+            'answer': llm.generate("What is ROS 2?", CONTEXT),
+            'chunks': list(llm.stream_response("Streamed?", CONTEXT)),
+        }
+        down = RecordingProxy('llm_service', llm_service(config, server, "down"), cassette)
+        with pytest.raises(LLMUnavailableError) as failure:
+            down.generate("Anyone?", CONTEXT)
+        recorded['error'] = str(failure.value)
+    return recorded
+
+def test_record_then_replay(config, tmp_path):
+    print("Testing that a replayed cassette matches the recording...")
+    for name in ("upstream.jsonl", "upstream.jsonl.gz"):
+        path = str(tmp_path / name)
+        recorded = record_session(config, path)
+        assert recorded['answer']['response'] == "Echo: What is ROS 2?"
+        assert len(recorded['chunks']) > 1 and "".join(recorded['chunks']) == "Echo: Streamed?"
+
+        cassette = Cassette(path).load()
+        embedder = ReplayService('embedding_service', cassette, speed=0)
+        qdrant = ReplayService('qdrant_service', cassette, speed=0)
+        llm = ReplayService('llm_service', cassette, speed=0)
+        assert np.allclose(embedder.embed_texts([CONTEXT]), recorded['vectors'], atol=1e-6)
+        assert np.allclose(embedder.embed_query("What is ROS 2?"), recorded['query'], atol=1e-6)
+        assert qdrant.search(hashed_embedding("What is ROS 2?"), top_k=3) == recorded['hits']
+        assert llm.generate("What is ROS 2?", CONTEXT) == recorded['answer']
+        assert llm.generate_response("What is ROS 2?", CONTEXT) == "Echo: What is ROS 2?"
+        # Streams replay chunk for chunk, not as one joined answer
+        assert list(llm.stream_response("Streamed?", CONTEXT)) == recorded['chunks']
+        # The upstream 500 comes back as the same failure
+        with pytest.raises(LLMUnavailableError, match=recorded['error']):
+            llm.generate("Anyone?", CONTEXT)
+        assert cassette.recorded_queries() == ["What is ROS 2?"]
+
+def test_replay_miss(config, tmp_path):
+    print("Testing replay of calls the cassette never saw...")
+    path = str(tmp_path / "upstream.jsonl")
+    record_session(config, path)
+    llm = ReplayService('llm_service', Cassette(path).load(), speed=0)
+    with pytest.raises(CassetteMissError):
+        llm.generate("A question nobody asked", CONTEXT)
+    with pytest.raises(CassetteMissError):
+        list(llm.stream_response("A question nobody asked", CONTEXT))
+    # A stream missing from an older cassette falls back to its whole recorded answer
+    assert list(llm.stream_response("What is ROS 2?", CONTEXT)) == ["Echo: What is ROS 2?"]
+    with pytest.raises(AttributeError):
+        llm.embed_query("What is ROS 2?")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,247 @@
+"""
+Sentence-level relevance scoring with a local encoder.
+
+Used to pick the sentences of the retrieved context that best answer the
+question. That powers the extractive fallback answer when the LLM is slow or
+down. It also drives context compression, which trims the prompt to the
+relevant sentences before generation, and focusing of large text
+selections on the parts that matter to the question. Scoring is one batched embedding call for the question and all
+sentences, followed by a single NumPy matrix-vector product.
+
+The encoder is a local sentence-transformers model when one is installed.
+Otherwise, or if the model fails at runtime, it falls back to hashed
+bag-of-words vectors. Those are lexical only but need no model and take
+microseconds. sentence-transformers is optional (it pulls in torch), so
+context compression is only on by default when the model actually loaded.
+"""
+import hashlib
+import logging
+import re
+import textwrap
+from typing import Any, Dict, List, Optional
+import numpy as np
+from caches import LRUCache
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Chunks and chunk vectors of recent large selections, keyed by selection hash and encoder
+selection_cache = LRUCache("selection_embeddings", Config.SELECTION_CACHE_SIZE)
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n{2,}')
+
+def split_sentences(text: str, min_words: int = 3) -> List[str]:
+    """
+    Split text into sentences, dropping headings and fragments shorter than min_words
+    """
+    sentences = []
+    for part in SENTENCE_BOUNDARY.split(text):
+        sentence = " ".join(part.split())
+        if len(sentence.split()) >= min_words:
+            sentences.append(sentence)
+    return sentences
+
+def passage_sources(passage: Dict[str, Any]) -> List[str]:
+    """
+    The pages a passage stands for: its own source, then those of the near-duplicates collapsed into it
+    """
+    return [s for s in dict.fromkeys([passage.get('source', ''), *passage.get('sources', ())]) if s]
+
+def hashed_embedding(text: str, dimension: int = 1024) -> List[float]:
+    """
+    Deterministic bag-of-words embedding via feature hashing, normalized to unit length.
+    Texts that share words get similar vectors, so retrieval behaves plausibly.
+    """
+    vector = np.zeros(dimension, dtype=np.float32)
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dimension
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector.tolist()
+
+class SentenceEncoder:
+    """
+    Local text encoder: sentence-transformers when available, hashed vectors otherwise
+    """
+
+    def __init__(self, backend: str = Config.SENTENCE_ENCODER, model_name: str = Config.SENTENCE_ENCODER_MODEL):
+        self.backend = "hashed"
+        self.model = None
+        if backend in ("auto", "local"):
+            try:
+                from sentence_transformers import SentenceTransformer
+                self.model = SentenceTransformer(model_name)
+                self.backend = "local"
+            except Exception as e:
+                if backend == "local":
+                    raise
+                logger.warning("Sentence encoder using hashed embeddings (%s: %s)", type(e).__name__, e)
+
+    @property
+    def semantic(self) -> bool:
+        """
+        Whether scores reflect meaning rather than shared words
+        """
+        return self.model is not None
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Unit-length float32 vectors, one row per text
+        """
+        if self.model is not None:
+            try:
+                vectors = self.model.encode(texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True)
+                return np.asarray(vectors, dtype=np.float32)
+            except Exception as e:
+                logger.warning("Sentence encoder failed, scoring lexically: %s", e)
+        return np.asarray([hashed_embedding(text) for text in texts], dtype=np.float32)
+
+def score_sentences(encoder: SentenceEncoder, query: str, sentences: List[str]) -> np.ndarray:
+    """
+    Cosine similarity of each sentence to the query, from one batched encoder call
+    """
+    if not sentences:
+        return np.zeros(0, dtype=np.float32)
+    vectors = encoder.embed([query] + sentences)
+    return vectors[1:] @ vectors[0]
+
+def extractive_answer(encoder: SentenceEncoder, query: str, passages: List[Dict[str, Any]],
+                      max_sentences: int = Config.EXTRACTIVE_MAX_SENTENCES) -> Optional[Dict[str, Any]]:
+    """
+    Answer with the passages' sentences that best match the query, in their original order.
+
+    passages are search results ({'text', 'source'}, optionally 'sources'); returns None when
+    they hold no usable sentence.
+    """
+    sentences, owners, seen = [], [], set()
+    for passage in passages:
+        for sentence in split_sentences(passage['text']):
+            # Overlapping chunks repeat sentences
+            if sentence not in seen:
+                seen.add(sentence)
+                sentences.append(sentence)
+                owners.append(passage_sources(passage))
+    if not sentences:
+        return None
+
+    scores = score_sentences(encoder, query, sentences)
+    ranked = np.argsort(-scores)[:max_sentences]
+    # Sentences with nothing in common with the query only pad the answer; keep at least the best one
+    best = sorted(ranked[(scores[ranked] > 0) | (np.arange(len(ranked)) == 0)].tolist())
+    sources = list(dict.fromkeys(source for i in best for source in owners[i]))
+    return {'response': " ".join(sentences[i] for i in best), 'sources': sources}
+
+def compress_context(encoder: SentenceEncoder, query: str, passages: List[Dict[str, Any]],
+                     ratio: float = Config.CONTEXT_COMPRESSION_RATIO,
+                     neighbours: int = Config.CONTEXT_COMPRESSION_NEIGHBOURS,
+                     min_sentences: int = Config.CONTEXT_COMPRESSION_MIN_SENTENCES):
+    """
+    Keep only the sentences of the passages that are relevant to the query.
+
+    A sentence is kept if it scores at least `ratio` times the best sentence,
+    or is among the `min_sentences` best. Each kept sentence brings its
+    `neighbours` on either side, so pronouns and definitions keep their
+    referents. The threshold is relative because absolute similarity levels
+    differ between encoders. Returns the compressed context (passages joined
+    by blank lines, " ... " marking dropped sentences) and the sources of the
+    passages that kept anything.
+    """
+    sentences, owners = [], []
+    for index, passage in enumerate(passages):
+        for sentence in split_sentences(passage['text'], min_words=1):
+            sentences.append(sentence)
+            owners.append(index)
+    if not sentences:
+        return "", []
+
+    scores = score_sentences(encoder, query, sentences)
+    keep = scores >= ratio * scores.max() if scores.max() > 0 else np.zeros(len(scores), dtype=bool)
+    keep[np.argsort(-scores)[:min_sentences]] = True
+
+    # Widen each kept sentence by its neighbours within the same passage
+    owners = np.asarray(owners)
+    widened = keep.copy()
+    for offset in range(1, neighbours + 1):
+        widened[:-offset] |= keep[offset:] & (owners[:-offset] == owners[offset:])
+        widened[offset:] |= keep[:-offset] & (owners[offset:] == owners[:-offset])
+
+    parts, sources = [], []
+    for index, passage in enumerate(passages):
+        positions = np.flatnonzero(owners == index)
+        if not widened[positions].any():
+            continue
+        text, previous = "", None
+        for position in positions[widened[positions]]:
+            if previous is not None:
+                text += " " if position == previous + 1 else " ... "
+            text += sentences[position]
+            previous = position
+        parts.append(text)
+        sources.extend(s for s in passage_sources(passage) if s not in sources)
+    return "\n\n".join(parts), sources
+
+def group_sentences(text: str, max_chars: int) -> List[str]:
+    """
+    Pack consecutive sentences into chunks of up to max_chars; longer sentences are split at words
+    """
+    chunks, current = [], ""
+    for sentence in split_sentences(text, min_words=1):
+        pieces = [sentence] if len(sentence) <= max_chars else textwrap.wrap(sentence, max_chars,
+                                                                               break_on_hyphens=False)
+        for piece in pieces:
+            if current and len(current) + 1 + len(piece) > max_chars:
+                chunks.append(current)
+                current = ""
+            current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def focus_selection(encoder: SentenceEncoder, query: str, selection: str,
+                    max_chars: int = Config.SELECTION_MAX_CHARS,
+                    chunk_chars: int = Config.SELECTION_CHUNK_CHARS) -> str:
+    """
+    Reduce a large selection to its chunks most relevant to the query, up to max_chars.
+
+    The selection's chunks are embedded once and cached by selection hash, so
+    follow-up questions on the same selection only embed the question. Chosen
+    chunks are returned in selection order, with " ... " where text was skipped.
+    Without a semantic encoder the selection is cut to its first max_chars
+    instead: shared words alone pick scattered chunks that read worse.
+    """
+    if len(selection) <= max_chars:
+        return selection
+    chunk_chars = min(chunk_chars, max_chars)
+
+    if encoder.semantic:
+        key = (hashlib.sha256(selection.encode("utf-8")).hexdigest(), encoder.backend, chunk_chars)
+
+        def embed_chunks():
+            chunks = group_sentences(selection, chunk_chars)
+            return chunks, encoder.embed(chunks)
+
+        chunks, vectors = selection_cache.get_or_compute(key, embed_chunks)
+        ranking = np.argsort(-(vectors @ encoder.embed([query])[0]))
+    else:
+        chunks = group_sentences(selection, chunk_chars)
+        ranking = range(len(chunks))
+
+    chosen, used = [], 0
+    for index in ranking:
+        # Every chunk after the first costs a separator of up to five characters
+        cost = len(chunks[index]) + (len(" ... ") if chosen else 0)
+        if used + cost > max_chars:
+            break
+        chosen.append(index)
+        used += cost
+
+    text, previous = "", None
+    for index in sorted(chosen):
+        if previous is not None:
+            text += " " if index == previous + 1 else " ... "
+        text += chunks[index]
+        previous = index
+    return text
@@ -0,0 +1,256 @@
+"""
+Record and replay upstream calls (Cohere embeddings, Qdrant search, OpenRouter completions).
+
+In record mode the real services are wrapped, and every call's arguments,
+result and measured latency are appended to a cassette file. In replay mode
+the cassette stands in for the network: calls with the same arguments get
+the recorded results back, in recording order, after the recorded latency
+divided by the replay speed (0 = no delay). A streamed answer is recorded as
+its list of chunks, with the time to the first one as its latency.
+
+Vectors are stored as base64 float32, and a path ending in .gz is
+gzip-compressed, so cassettes of real traffic stay small.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+import numpy as np
+from service_errors import LLMUnavailableError
+
+# Calls worth recording for each service in the container
+RECORDED_METHODS = {
+    'embedding_service': ('embed_texts', 'embed_query'),
+    'qdrant_service': ('search',),
+    'llm_service': ('generate', 'stream_response'),
+}
+
+# Methods that return an iterator of chunks rather than a value
+STREAMED_METHODS = {'stream_response'}
+
+class CassetteMissError(KeyError):
+    """Raised in replay mode for a call that was never recorded"""
+
+def _is_vector(value) -> bool:
+    return isinstance(value, list) and bool(value) and all(isinstance(v, float) for v in value[:8])
+
+def encode_value(value: Any) -> Any:
+    if _is_vector(value):
+        return {'__f32__': base64.b64encode(np.asarray(value, dtype=np.float32).tobytes()).decode('ascii')}
+    if isinstance(value, list) and value and all(_is_vector(v) for v in value):
+        matrix = np.asarray(value, dtype=np.float32)
+        return {'__f32__': base64.b64encode(matrix.tobytes()).decode('ascii'), 'shape': list(matrix.shape)}
+    return value
+
+def decode_value(value: Any) -> Any:
+    if isinstance(value, dict) and '__f32__' in value:
+        array = np.frombuffer(base64.b64decode(value['__f32__']), dtype=np.float32)
+        if 'shape' in value:
+            array = array.reshape(value['shape'])
+        return array.tolist()
+    return value
+
+def call_key(service: str, method: str, args: tuple, kwargs: Dict[str, Any]) -> str:
+    """
+    Stable key for a call; vectors are hashed by their float32 bytes
+    """
+    def canonical(value):
+        if _is_vector(value):
+            return hashlib.sha1(np.asarray(value, dtype=np.float32).tobytes()).hexdigest()
+        if isinstance(value, (list, tuple)):
+            return [canonical(v) for v in value]
+        if isinstance(value, dict):
+            return {k: canonical(v) for k, v in sorted(value.items())}
+        return value
+
+    payload = json.dumps([service, method, canonical(list(args)), canonical(kwargs)], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+class Cassette:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._cursor: Dict[str, int] = defaultdict(int)
+
+    def _open(self, mode: str):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, mode + 't', encoding='utf-8')
+        return open(self.path, mode, encoding='utf-8')
+
+    def load(self) -> 'Cassette':
+        with self._open('r') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries[entry['key']].append(entry)
+        return self
+
+    def record(self, entry: Dict[str, Any]):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            self.entries[entry['key']].append(entry)
+            # Appending gzip members keeps the file readable as one stream
+            with self._open('a') as f:
+                f.write(line)
+
+    def next_entry(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            recorded = self.entries.get(key)
+            if not recorded:
+                raise CassetteMissError(key)
+            # Repeated identical calls replay their recordings in order, then cycle
+            entry = recorded[self._cursor[key] % len(recorded)]
+            self._cursor[key] += 1
+        return entry
+
+    def recorded_queries(self) -> List[str]:
+        """
+        The questions seen while recording, for driving load tests with real traffic
+        """
+        queries = []
+        for recorded in self.entries.values():
+            for entry in recorded:
+                if entry['service'] == 'embedding_service' and entry['method'] == 'embed_query':
+                    queries.append(entry['args'][0])
+        return queries
+
+class RecordingProxy:
+    """
+    Wraps a real service and records the calls listed in RECORDED_METHODS
+    """
+
+    def __init__(self, name: str, service: Any, cassette: Cassette):
+        self._name = name
+        self._service = service
+        self._cassette = cassette
+
+    def __getattr__(self, attribute):
+        value = getattr(self._service, attribute)
+        if attribute not in RECORDED_METHODS.get(self._name, ()):
+            return value
+
+        def new_entry(args, kwargs):
+            return {
+                'key': call_key(self._name, attribute, args, kwargs),
+                'service': self._name,
+                'method': attribute,
+                # Only short text arguments are kept in clear, for inspection and load replay
+                'args': [a for a in args if isinstance(a, str)],
+            }
+
+        def streamed(*args, **kwargs):
+            entry = new_entry(args, kwargs)
+            chunks, latency = [], None
+            start = time.perf_counter()
+            try:
+                for chunk in value(*args, **kwargs):
+                    if latency is None:
+                        latency = time.perf_counter() - start
+                    chunks.append(chunk)
+                    yield chunk
+            except GeneratorExit:
+                raise  # a cancelled answer is incomplete, so it isn't recorded
+            except Exception as e:
+                entry.update(latency=time.perf_counter() - start, error=str(e), error_type=type(e).__name__)
+                self._cassette.record(entry)
+                raise
+            entry.update(latency=latency or 0.0, result=chunks)
+            self._cassette.record(entry)
+
+        if attribute in STREAMED_METHODS:
+            return streamed
+
+        def recorded(*args, **kwargs):
+            entry = new_entry(args, kwargs)
+            start = time.perf_counter()
+            try:
+                result = value(*args, **kwargs)
+            except Exception as e:
+                entry.update(latency=time.perf_counter() - start, error=str(e), error_type=type(e).__name__)
+                self._cassette.record(entry)
+                raise
+            entry.update(latency=time.perf_counter() - start, result=encode_value(result))
+            self._cassette.record(entry)
+            return result
+
+        return recorded
+
+    def generate_response(self, *args, **kwargs):
+        return self.generate(*args, **kwargs)['response']
+
+class ReplayService:
+    """
+    Serves one service's recorded calls back from a cassette
+    """
+
+    def __init__(self, name: str, cassette: Cassette, speed: float = 1.0):
+        self._name = name
+        self._cassette = cassette
+        self._speed = speed
+        self.collection_name = "replay"
+
+    def __getattr__(self, attribute):
+        if attribute not in RECORDED_METHODS.get(self._name, ()):
+            raise AttributeError(f"{attribute} is not available in replay mode")
+
+        def replay(method, args, kwargs):
+            entry = self._cassette.next_entry(call_key(self._name, method, args, kwargs))
+            if self._speed > 0:
+                time.sleep(entry['latency'] / self._speed)
+            if 'error' in entry:
+                if entry.get('error_type') == 'LLMUnavailableError':
+                    raise LLMUnavailableError(entry['error'])
+                raise RuntimeError(f"Replayed {entry.get('error_type')}: {entry['error']}")
+            return decode_value(entry['result'])
+
+        def replayed(*args, **kwargs):
+            return replay(attribute, args, kwargs)
+
+        def streamed(*args, **kwargs):
+            try:
+                chunks = replay(attribute, args, kwargs)
+            except CassetteMissError:
+                # Cassettes recorded before streams were captured hold only the whole answer
+                chunks = [replay('generate', args, kwargs)['response']]
+            yield from chunks
+
+        return streamed if attribute in STREAMED_METHODS else replayed
+
+    def generate_response(self, *args, **kwargs):
+        return self.generate(*args, **kwargs)['response']
+
+    def is_available(self) -> bool:
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        return {'replay': {'speed': self._speed}}
+
+_cassettes: Dict[str, Cassette] = {}
+
+def get_cassette(path: str, load: bool) -> Cassette:
+    """
+    One cassette object per file, shared by all services in the process
+    """
+    if path not in _cassettes:
+        cassette = Cassette(path)
+        if load:
+            cassette.load()
+        _cassettes[path] = cassette
+    return _cassettes[path]
+
+def wrap_for_recording(name: str, service: Any, path: str) -> Any:
+    if name not in RECORDED_METHODS:
+        return service
+    return RecordingProxy(name, service, get_cassette(path, load=False))
+
+def replay_service(name: str, path: str, speed: float = 1.0) -> Optional[ReplayService]:
+    if name not in RECORDED_METHODS:
+        return None
+    return ReplayService(name, get_cassette(path, load=True), speed)